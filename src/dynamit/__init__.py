@@ -5,4 +5,6 @@ for computing GFR.
 from .image import *  # noqa
 from .core import *  # noqa
 from .model import *  # noqa
+from .fit import *  # noqa
+from .parametric import *  # noqa
 from .tasks import *  # noqa
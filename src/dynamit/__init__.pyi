@@ -1,72 +1,333 @@
 import SimpleITK as sitk
+import lmfit
+import numpy as np
+import numpy.typing as npt
 from datetime import datetime
-from typing import Any, Optional, Union, OrderedDict
+from typing import Any, Callable, Iterable, Iterator, Mapping, Optional, \
+    Sequence, Union, OrderedDict
 
 # From core.py
 
+def parse_acq_datetime(img_date: str, img_time: str) -> datetime: ...
+
 def get_acq_datetime(dicom_path: str) -> datetime: ...
 
 def shift_time(y: list[float], t: list[float],
                deltat: float) -> list[float]: ...
 
-def save_tac(tac: dict[Union[str, int], list[float]], path: str): ...
+class TAC(Mapping[str, npt.NDArray[np.float64]]):
+    data: npt.NDArray[np.float64]
+    labels: list[str]
+    def __init__(self, data: npt.ArrayLike, labels: Sequence[str]): ...
+    @classmethod
+    def from_dict(cls, tac: Mapping[Any, npt.ArrayLike]) -> TAC: ...
+    def __getitem__(self, label: str) -> npt.NDArray[np.float64]: ...
+    def __iter__(self) -> Iterator[str]: ...
+    def __len__(self) -> int: ...
+    @property
+    def rows(self) -> int: ...
+    def window(self, start: Optional[int] = ...,
+               stop: Optional[int] = ...) -> TAC: ...
+    def time_window(self, t_min: float, t_max: float,
+                    time_label: str = ...) -> TAC: ...
+    def to_dict(self) -> dict[str, list[float]]: ...
+
+def save_tac(tac: Mapping[Any, Any],
+             path: str,
+             binary: bool = ...,
+             units: Optional[dict[str, str]] = ...,
+             metadata: Optional[dict[str, Any]] = ...): ...
+
+def load_tac(path: str) -> TAC: ...
+
+def load_tac_info(path: str) -> dict[str, Any]: ...
+
+def append_tac_archive(path: str,
+                       tacs: Mapping[str, Mapping[Any, Any]],
+                       replace: bool = ...,
+                       units: Optional[dict[str, str]] = ...,
+                       metadata: Optional[dict[str, Any]] = ...): ...
+
+def tac_archive_keys(path: str) -> list[str]: ...
 
-def load_tac(path: str) -> dict[str, list[float]]: ...
+def load_tac_archive(path: str, key: str) -> TAC: ...
+
+def export_tac_archive(path: str,
+                       out_dir: str,
+                       binary: bool = ...) -> list[str]: ...
 
 # From image.py
 
-def load_dynamic_series(dicom_path: str) \
+def default_cache_dir() -> str: ...
+
+def scan_dynamic_series(dicom_path: str,
+                        use_index: bool = ...,
+                        index_dir: Optional[str] = ...) \
+        -> dict[str, Any]: ...
+
+def load_dynamic_series(dicom_path: str,
+                        index_dir: Optional[str] = ...) \
         -> dict[str, Any]: ...
 
-def resample_series_to_reference(series: list[sitk.Image],
-                                 ref: sitk.Image) -> list[sitk.Image]: ...
+def save_series_memmap(dicom_path: str,
+                       path: str,
+                       index_dir: Optional[str] = ...): ...
+
+def load_series_memmap(path: str) -> dict[str, Any]: ...
+
+def load_multiframe_series(path: str) -> dict[str, Any]: ...
 
-def series_roi_means(series: list[sitk.Image],
+def load_series_file(path: str) -> dict[str, Any]: ...
+
+class DynamicSeries(Sequence[sitk.Image]):
+    files: list[str]
+    acq: npt.NDArray[np.float64]
+    geometry: dict[str, Any]
+    cache_size: int
+    def __init__(self, path: str, cache_size: int = ...,
+                 index_dir: Optional[str] = ...): ...
+    def __len__(self) -> int: ...
+    def raw(self, i: int) -> tuple[npt.NDArray[Any], float, float]: ...
+    def __getitem__(self, i: Any) -> Any: ...
+
+class NearestNeighbourResampler:
+    source: sitk.Image
+    reference: sitk.Image
+    shape: tuple[int, ...]
+    def __init__(self, source: sitk.Image, reference: sitk.Image,
+                 use_cache: bool = ...,
+                 cache_dir: Optional[str] = ...,
+                 cache_size: int = ...): ...
+    def execute(self, img: Union[sitk.Image, npt.NDArray[Any]]) \
+            -> sitk.Image: ...
+
+def resample_series_to_reference(series: Sequence[sitk.Image],
+                                 ref: sitk.Image,
+                                 use_cache: bool = ...,
+                                 cache_dir: Optional[str] = ...) \
+        -> list[sitk.Image]: ...
+
+class LabelIndex:
+    shape: tuple[int, ...]
+    labels: list[int]
+    counts: npt.NDArray[np.int64]
+    def __init__(self, roi: sitk.Image, background: bool = ...): ...
+    def sums(self, img: Union[sitk.Image, npt.NDArray[Any]]) \
+            -> npt.NDArray[np.float64]: ...
+    def means(self, img: Union[sitk.Image, npt.NDArray[Any]]) \
+            -> dict[int, float]: ...
+
+class RoiWeights:
+    reference: sitk.Image
+    shape: tuple[int, ...]
+    names: list[str]
+    def __init__(self, reference: sitk.Image): ...
+    def add_labelmap(self, roi: sitk.Image,
+                     labels: Optional[dict[str, str]] = ...): ...
+    def add_weight_map(self, weight_map: sitk.Image, name: str): ...
+    def resampled(self, reference: sitk.Image) -> RoiWeights: ...
+    def voxels(self) -> npt.NDArray[np.intp]: ...
+    def gather(self, img: Union[sitk.Image, npt.NDArray[Any]]) \
+            -> npt.NDArray[np.float64]: ...
+    def means_from_values(self,
+                          values: Iterable[npt.NDArray[np.float64]]) \
+            -> dict[str, list[float]]: ...
+    def series_means(self,
+                     series: Iterable[Union[sitk.Image, npt.NDArray[Any]]]) \
+            -> dict[str, list[float]]: ...
+
+def series_roi_means(series: Union[Sequence[sitk.Image], npt.NDArray[Any],
+                                   DynamicSeries],
                      roi: sitk.Image) -> dict[int, list[float]]: ...
 
+def lazy_series_roi_set_means(series_path: str,
+                              roi_sets: list[dict[str, Any]],
+                              workers: int = ...,
+                              index_dir: Optional[str] = ...,
+                              use_cache: bool = ...,
+                              cache_dir: Optional[str] = ...) \
+        -> list[TAC]: ...
+
 def lazy_series_roi_means(series_path: str,
-                          roi_path: str,
+                          roi_path: Union[str, RoiWeights],
                           resample: Optional[str] = ...,
-                          labels: Optional[dict[str, str]] = ...)\
-        -> dict[Union[str, int], list[float]]: ...
+                          labels: Optional[dict[str, str]] = ...,
+                          workers: int = ...,
+                          index_dir: Optional[str] = ...,
+                          crop: bool = ...,
+                          use_cache: bool = ...,
+                          cache_dir: Optional[str] = ...)\
+        -> TAC: ...
+
+def incremental_series_roi_means(series_path: str,
+                                 roi_path: str,
+                                 out_path: str,
+                                 resample: Optional[str] = ...,
+                                 labels: Optional[dict[str, str]] = ...,
+                                 workers: int = ...,
+                                 crop: bool = ...) -> int: ...
+
+def watch_series_roi_means(series_path: str,
+                           roi_path: str,
+                           out_path: str,
+                           resample: Optional[str] = ...,
+                           labels: Optional[dict[str, str]] = ...,
+                           workers: int = ...,
+                           crop: bool = ...,
+                           interval: float = ...,
+                           timeout: float = ...) -> int: ...
 
 # From model.py
 
-def model_step(t: list[float], in_func: list[float],
-               amp: float, extent: float) -> list[float]: ...
+def model_step(t: npt.ArrayLike, in_func: npt.ArrayLike,
+               amp: float, extent: float) -> npt.NDArray[np.float64]: ...
 
-def model_step_2(t: list[float],
-                 in_func: list[float],
+def model_step_jac(t: npt.ArrayLike, in_func: npt.ArrayLike,
+                   amp: float, extent: float) -> npt.NDArray[np.float64]: ...
+
+def model_step_2(t: npt.ArrayLike,
+                 in_func: npt.ArrayLike,
                  amp1: float,
                  extent1: float,
                  amp2: float,
-                 extent2: float) -> list[float]: ...
+                 extent2: float) -> npt.NDArray[np.float64]: ...
 
-def model_step_fermi(t: list[float],
-                     in_func: list[float],
+def model_step_2_jac(t: npt.ArrayLike,
+                     in_func: npt.ArrayLike,
+                     amp1: float,
+                     extent1: float,
+                     amp2: float,
+                     extent2: float) -> npt.NDArray[np.float64]: ...
+
+class ConvolutionOperator:
+    n: int
+    lag: npt.NDArray[np.float64]
+    def __init__(self, t: npt.ArrayLike, in_func: npt.ArrayLike,
+                 nodes: int = ...): ...
+    def apply(self, resp_values: npt.NDArray[np.float64]) \
+            -> npt.NDArray[np.float64]: ...
+    def __call__(self, resp: Callable[[npt.NDArray[np.float64]],
+                                      npt.NDArray[np.float64]]) \
+            -> npt.NDArray[np.float64]: ...
+
+def model_step_fermi(t: npt.ArrayLike,
+                     in_func: npt.ArrayLike,
                      amp1: float,
                      extent1: float,
-                     width1: float,
                      amp2: float,
                      extent2: float,
-                     width2: float) -> list[float]: ...
+                     width2: float) -> npt.NDArray[np.float64]: ...
 
-def model_fermi_2(t: list[float],
-                  in_func: list[float],
+def model_step_fermi_jac(t: npt.ArrayLike,
+                         in_func: npt.ArrayLike,
+                         amp1: float,
+                         extent1: float,
+                         amp2: float,
+                         extent2: float,
+                         width2: float) -> npt.NDArray[np.float64]: ...
+
+def model_fermi_2(t: npt.ArrayLike,
+                  in_func: npt.ArrayLike,
                   amp1: float,
                   extent1: float,
                   width1: float,
                   amp2: float,
                   extent2: float,
-                  width2: float) -> list[float]: ...
+                  width2: float) -> npt.NDArray[np.float64]: ...
+
+def model_fermi_2_jac(t: npt.ArrayLike,
+                      in_func: npt.ArrayLike,
+                      amp1: float,
+                      extent1: float,
+                      width1: float,
+                      amp2: float,
+                      extent2: float,
+                      width2: float) -> npt.NDArray[np.float64]: ...
+
+def patlak_regressors(t: npt.ArrayLike,
+                      in_func: npt.ArrayLike) -> npt.NDArray[np.float64]: ...
 
-def model_patlak(t: list[float],
-                 in_func: list[float],
+def model_patlak(t: npt.ArrayLike,
+                 in_func: npt.ArrayLike,
                  k1: float,
-                 v0: float) -> list[float]: ...
+                 v0: float) -> npt.NDArray[np.float64]: ...
+
+def model_patlak_jac(t: npt.ArrayLike,
+                     in_func: npt.ArrayLike,
+                     k1: float,
+                     v0: float) -> npt.NDArray[np.float64]: ...
+
+def model_patlak_batch(t: npt.ArrayLike,
+                       in_func: npt.ArrayLike,
+                       params: npt.ArrayLike) -> npt.NDArray[np.float64]: ...
+
+# From fit.py
+
+def fit_models() \
+        -> dict[str, tuple[Callable[..., Any],
+                           Callable[..., npt.NDArray[np.float64]]]]: ...
+
+def tac_fit(tac: Mapping[str, npt.ArrayLike],
+            time_label: str,
+            inp_label: str,
+            tis_label: str,
+            fit_model: str,
+            params: dict[str, dict[str, float]],
+            t_cut: Optional[int] = ...) -> lmfit.model.ModelResult: ...
+
+def tac_fit_uncertainty(res: lmfit.model.ModelResult,
+                        fit_model: str,
+                        sigma: float = ...) \
+        -> tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]: ...
+
+def tac_fit_batch(tac_paths: list[str],
+                  time_label: str,
+                  inp_label: str,
+                  tis_label: str,
+                  fit_model: str,
+                  params: dict[str, dict[str, float]],
+                  t_cut: Optional[int] = ...,
+                  workers: int = ...) -> list[dict[str, Any]]: ...
+
+def fit_summary(res: lmfit.model.ModelResult) -> dict[str, Any]: ...
+
+def save_fit_table(results: list[dict[str, Any]],
+                   param_names: list[str],
+                   path: str): ...
+
+# From parametric.py
+
+def patlak_map(series: Iterable[sitk.Image],
+               t: npt.ArrayLike,
+               in_func: npt.ArrayLike) -> dict[str, sitk.Image]: ...
+
+def parametric_map(series: Iterable[sitk.Image],
+                   t: npt.ArrayLike,
+                   in_func: npt.ArrayLike,
+                   fit_model: str,
+                   params: dict[str, dict[str, float]],
+                   mask: Optional[sitk.Image] = ...,
+                   chunk_size: int = ...,
+                   workers: int = ...) -> dict[str, sitk.Image]: ...
 
 # From tasks.py
 
-def task_roi_means(task: OrderedDict[str, Any]): ...
+def task_io(task: Any) -> dict[str, set[str]]: ...
+
+def task_roi_means(task: OrderedDict[str, Any],
+                   store: Optional[dict[str, Any]] = ...): ...
+
+def task_series_memmap(task: OrderedDict[str, Any],
+                       store: Optional[dict[str, Any]] = ...): ...
+
+def task_tac_fit(task: OrderedDict[str, Any],
+                 store: Optional[dict[str, Any]] = ...): ...
+
+def task_tac_fit_batch(task: OrderedDict[str, Any],
+                       store: Optional[dict[str, Any]] = ...): ...
+
+def task_patlak_map(task: OrderedDict[str, Any],
+                    store: Optional[dict[str, Any]] = ...): ...
 
-def task_tac_fit(task: OrderedDict[str, Any]): ...
+def task_parametric_map(task: OrderedDict[str, Any],
+                        store: Optional[dict[str, Any]] = ...): ...
@@ -1,32 +1,226 @@
 
+import argparse
+import concurrent.futures
+import contextlib
+import fnmatch
+import glob
+import io
+import os
 import sys
+import traceback
+from typing import Any, Callable, Optional
 
 import dynamit
 import xmltodict
 
 
-def main(argv: list[str]):
+def _task_functions() -> dict[str, Callable[..., Any]]:
+    """The task functions stored by the task names used in the xml files."""
 
-    print("Starting DYNAMIT1")
-    print()
-
-    tasks = {
+    return {
         'ROIMeans': dynamit.task_roi_means,
-        'TACFit': dynamit.task_tac_fit
+        'SeriesMemmap': dynamit.task_series_memmap,
+        'TACFit': dynamit.task_tac_fit,
+        'TACFitBatch': dynamit.task_tac_fit_batch,
+        'PatlakMap': dynamit.task_patlak_map,
+        'ParametricMap': dynamit.task_parametric_map
     }
 
+
+def _paths_overlap(paths1: set[str], paths2: set[str]) -> bool:
+    """Whether any path in paths1 is the same as, inside, or contains a path
+    in paths2. Paths can be glob patterns.
+    """
+
+    for p1 in paths1:
+        for p2 in paths2:
+            if p1 == p2 or p1.startswith(p2 + os.sep) \
+                    or p2.startswith(p1 + os.sep):
+                return True
+            if glob.has_magic(p1) and fnmatch.fnmatch(p2, p1):
+                return True
+            if glob.has_magic(p2) and fnmatch.fnmatch(p1, p2):
+                return True
+    return False
+
+
+def task_dependencies(tasks: list[Any]) -> list[set[int]]:
+    """Derives the dependencies between the tasks of a job from the files and
+    named results they read and write. A task depends on an earlier task if
+    it reads something the earlier task writes, or if it writes something the
+    earlier task reads or writes. Running the tasks in any order respecting
+    the dependencies therefore gives the same result as running them one
+    after another.
+
+    Arguments:
+    tasks   --  The tasks of the job (as parsed from the xml file).
+
+    Return value:
+    A list with the set of (indices of) tasks each task depends on.
+    """
+
+    io_sets = [dynamit.task_io(task) for task in tasks]
+    deps: list[set[int]] = []
+    for j, b in enumerate(io_sets):
+        deps.append(set())
+        for i, a in enumerate(io_sets[:j]):
+            if _paths_overlap(b['in_paths'], a['out_paths']) \
+                    or _paths_overlap(b['out_paths'], a['in_paths']) \
+                    or _paths_overlap(b['out_paths'], a['out_paths']) \
+                    or b['in_names'] & a['out_names'] \
+                    or b['out_names'] & (a['in_names'] | a['out_names']):
+                deps[j].add(i)
+    return deps
+
+
+def _run_task(task: Any,
+              store: dict[str, Any],
+              capture: bool) -> tuple[bool, str, dict[str, Any]]:
+    """Runs a single task. This is the work done by each worker process when
+    tasks are run in parallel. The output of the task is captured if chosen,
+    so that the output of tasks running at the same time is not mixed.
+
+    Arguments:
+    task    --  The task.
+    store   --  The named results used by the task.
+    capture --  Whether to capture the output of the task.
+
+    Return value:
+    A tuple with whether the task succeeded, the captured output and the
+    named results stored by the task.
+    """
+
+    inputs = dict(store)
+    log = io.StringIO()
+    with contextlib.ExitStack() as stack:
+        if capture:
+            stack.enter_context(contextlib.redirect_stdout(log))
+            stack.enter_context(contextlib.redirect_stderr(log))
+        try:
+            _task_functions()[task['@name']](task, store)
+            success = True
+        except Exception:
+            traceback.print_exc()
+            success = False
+    outputs = {name: value for name, value in store.items()
+               if name not in inputs or value is not inputs[name]}
+    return success, log.getvalue(), outputs
+
+
+def run_tasks(tasks: list[Any],
+              jobs: int = 1,
+              log_dir: Optional[str] = None) -> int:
+    """Runs the tasks of a job. Tasks that do not depend on each other (see
+    task_dependencies) are run at the same time in a pool of jobs worker
+    processes. The named results of the tasks (see e.g. the <out_name>-tag
+    of the ROIMeans task) are passed to the tasks using them. The output of
+    each task is printed as a whole when the task ends, and it is also saved
+    to a log file for each task if chosen. When a task fails, no new tasks
+    are started.
+    With a single job the tasks are run one after another in this process.
+
+    Arguments:
+    tasks   --  The tasks of the job (as parsed from the xml file).
+    jobs    --  The number of worker processes (default 1).
+    log_dir --  The folder where the log file of each task is saved.
+                Optional.
+
+    Return value:
+    The exit status: 0 if all tasks succeeded and 1 otherwise.
+    """
+
+    def report(i: int, success: bool, log: str):
+        name = str(tasks[i]['@name'])
+        if jobs > 1:
+            print("---- Task", i + 1, "(" + name + ") ----")
+            print(log, end='')
+        if log_dir is not None:
+            os.makedirs(log_dir, exist_ok=True)
+            with open(os.path.join(log_dir, f'task_{i + 1:03d}_{name}.log'),
+                      'w') as f:
+                f.write(log)
+        if not success:
+            print("Task", i + 1, "(" + name + ") failed.", file=sys.stderr)
+
+    store: dict[str, Any] = {}
+
+    if jobs <= 1:
+        for i, task in enumerate(tasks):
+            success, log, outputs = _run_task(task, store,
+                                              capture=log_dir is not None)
+            if log_dir is not None:
+                print(log, end='')
+            report(i, success, log)
+            if not success:
+                return 1
+        return 0
+
+    deps = task_dependencies(tasks)
+    in_names = [dynamit.task_io(task)['in_names'] for task in tasks]
+    waiting = set(range(len(tasks)))
+    done: set[int] = set()
+    failed = False
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as ex:
+        running: dict[concurrent.futures.Future[Any], int] = {}
+        while waiting or running:
+            # Start the tasks whose dependencies have all finished
+            if not failed:
+                for i in sorted(waiting):
+                    if deps[i] <= done:
+                        waiting.remove(i)
+                        inputs = {name: store[name] for name in in_names[i]
+                                  if name in store}
+                        running[ex.submit(_run_task, tasks[i], inputs,
+                                          True)] = i
+            if not running:
+                break
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                i = running.pop(future)
+                try:
+                    success, log, outputs = future.result()
+                except Exception:
+                    success, log, outputs = False, traceback.format_exc(), {}
+                report(i, success, log)
+                store.update(outputs)
+                done.add(i)
+                failed = failed or not success
+
+    return 1 if failed else 0
+
+
+def main(argv: list[str]) -> int:
+
+    parser = argparse.ArgumentParser(prog='dynamit')
+    parser.add_argument('xml_file', help="path to an XML file")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="number of tasks run at the same time")
+    parser.add_argument('--log-dir', default=None,
+                        help="folder where the log of each task is saved")
+    args = parser.parse_args(argv)
+
+    print("Starting DYNAMIT1")
+    print()
+
     # Parse XML input file
-    if len(argv) != 1:
-        exit("Missing command line argument: path to an XML file.")
-    xml_file = open(argv[0], "r")
-    task_tree = xmltodict.parse(xml_file.read(), force_list=('task'))
+    with open(args.xml_file, "r") as xml_file:
+        task_tree = xmltodict.parse(xml_file.read(), force_list=('task'))
     root = task_tree['dynamit1']
 
-    for task in root['task']:
-        tasks[task['@name']](task)
+    # The number of jobs is given on the command line or in the xml file
+    jobs = args.jobs
+    if jobs is None:
+        jobs = int(root.get('@jobs', 1))
+
+    status = run_tasks(root['task'], jobs=jobs, log_dir=args.log_dir)
 
-    print("DYNAMIT1 ended!")
+    if status != 0:
+        print("DYNAMIT1 ended with errors!")
+    else:
+        print("DYNAMIT1 ended!")
+    return status
 
 
 if __name__ == "__main__":
-    main(sys.argv[1:])
+    sys.exit(main(sys.argv[1:]))
@@ -1,14 +1,38 @@
 import SimpleITK as sitk
 from datetime import datetime
+import io
+import json
 import numpy as np
-from typing import Union
+import numpy.typing as npt
+import os
+import struct
+from typing import Any, BinaryIO, Iterator, Mapping, Optional, Sequence
+
+
+def parse_acq_datetime(img_date: str, img_time: str) -> datetime:
+    """Turns the acquisition date and time strings of a dicom header (tags
+    0008|0022 and 0008|0032) into a datetime object.
+
+    Arguments:
+    img_date    --  The acquisition date (YYYYMMDD).
+    img_time    --  The acquisition time (hhmmss.f).
+
+    Return value:
+    A datetime object representing the date and time of the acquisition.
+    """
+
+    # Format the strings into ISO 8601 format [ YYYY-MM-DD hh:mm:ss.ffffff ]
+    sd = img_date[:4] + "-" + img_date[4:6] + "-" + img_date[6:]
+    sd = sd + " " + img_time[:2] + ":" + img_time[2:4] + ":" + img_time[4:6]
+    sd = sd + "." + img_time[-1].ljust(6, "0")
+    return datetime.fromisoformat(sd)
 
 
 def get_acq_datetime(dicom_path: str) -> datetime:
     """Get an image acquisition datetime from its dicom header.
     Dicom images store the acquisition date and time in tags in the images
     dicom header. This function reads the relevant tags and turns it into a
-    datetime object.
+    datetime object. Only the header is read, not the pixel data.
 
     Arguments:
     dicom_path  --  The path to the dicom file.
@@ -17,18 +41,14 @@ def get_acq_datetime(dicom_path: str) -> datetime:
     A datetime object representing the date and time of the acquisition.
     """
 
-    # Read the dicom image into Simple ITK
-    img = sitk.ReadImage(dicom_path)
+    # Read the dicom header into Simple ITK
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(dicom_path)
+    reader.ReadImageInformation()
 
     # Read the relevant header tags as strings
-    img_time = img.GetMetaData('0008|0032')
-    img_date = img.GetMetaData('0008|0022')
-
-    # Format the strings into ISO 8601 format [ YYYY-MM-DD hh:mm:ss.ffffff ]
-    sd = img_date[:4] + "-" + img_date[4:6] + "-" + img_date[6:]
-    sd = sd + " " + img_time[:2] + ":" + img_time[2:4] + ":" + img_time[4:6]
-    sd = sd + "." + img_time[-1].ljust(6, "0")
-    return datetime.fromisoformat(sd)
+    return parse_acq_datetime(reader.GetMetaData('0008|0022'),
+                              reader.GetMetaData('0008|0032'))
 
 
 def shift_time(y: list[float], t: list[float],
@@ -62,13 +82,148 @@ def shift_time(y: list[float], t: list[float],
     return list(np.interp(t_inter, t, y))
 
 
-def save_tac(tac: dict[Union[str, int], list[float]], path: str):
+class TAC(Mapping[str, npt.NDArray[np.float64]]):
+    """A TAC dataset, i.e. a set of labelled columns of the same length (e.g.
+    the acquisition times and the ROI means of a dynamic series). All the
+    columns are stored in one contiguous 2D array with a row for each label,
+    so a column is a view of the array, and a time window of all the columns
+    is a view as well. The dataset behaves as a read-only dict with the labels
+    as keys and the columns as values (arrays), so it can be used wherever a
+    dict of columns is expected.
+
+    Arguments:
+    data    --  The columns as a 2D array with one row per label.
+    labels  --  The labels of the columns.
+    """
+
+    def __init__(self, data: npt.ArrayLike, labels: Sequence[str]):
+
+        self.data: npt.NDArray[np.float64] = np.asarray(data,
+                                                        dtype=np.float64)
+        self.labels = [str(label) for label in labels]
+        if self.data.ndim != 2 or self.data.shape[0] != len(self.labels):
+            raise ValueError("The TAC data must have a row for each label.")
+        self._index = {label: i for i, label in enumerate(self.labels)}
+        if len(self._index) != len(self.labels):
+            raise ValueError("The labels of a TAC must be unique.")
+
+    @classmethod
+    def from_dict(cls, tac: Mapping[Any, npt.ArrayLike]) -> 'TAC':
+        """Creates a TAC dataset from a dict with labels as keys and columns
+        as values (e.g. lists). The labels are converted to strings. A TAC
+        dataset is returned as it is.
+
+        Arguments:
+        tac --  The TAC-data.
+
+        Return value:
+        The TAC dataset.
+        """
+
+        if isinstance(tac, TAC):
+            return tac
+        if len(tac) == 0:
+            return cls(np.zeros((0, 0)), [])
+        return cls(np.stack([np.asarray(col, dtype=np.float64)
+                             for col in tac.values()]),
+                   [str(label) for label in tac])
+
+    def __getitem__(self, label: str) -> npt.NDArray[np.float64]:
+        col: npt.NDArray[np.float64] = self.data[self._index[label]]
+        return col
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.labels)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return set(self) == set(other) and all(
+            np.array_equal(self[label], np.asarray(other[label]))
+            for label in self)
+
+    def __repr__(self) -> str:
+        return 'TAC(' + repr({label: list(self[label])
+                              for label in self}) + ')'
+
+    @property
+    def rows(self) -> int:
+        """The number of rows (time points) of the dataset."""
+
+        return int(self.data.shape[1])
+
+    def window(self, start: Optional[int] = None,
+               stop: Optional[int] = None) -> 'TAC':
+        """The rows start:stop of all columns as a new dataset. The data of
+        the new dataset is a view of the data of this dataset.
+
+        Arguments:
+        start   --  The first row. By default the first row of the dataset.
+        stop    --  The row after the last row. By default the end of the
+                    dataset.
+
+        Return value:
+        The TAC dataset of the rows.
+        """
+
+        return TAC(self.data[:, start:stop], self.labels)
+
+    def time_window(self, t_min: float, t_max: float,
+                    time_label: str = 'tacq') -> 'TAC':
+        """The rows with a time between t_min and t_max (both included) as a
+        new dataset (see window). The times must be sorted.
+
+        Arguments:
+        t_min       --  The earliest time.
+        t_max       --  The latest time.
+        time_label  --  The label of the time column.
+
+        Return value:
+        The TAC dataset of the rows.
+        """
+
+        t = self[time_label]
+        return self.window(int(np.searchsorted(t, t_min, side='left')),
+                           int(np.searchsorted(t, t_max, side='right')))
+
+    def to_dict(self) -> dict[str, list[float]]:
+        """The dataset as a dict with the columns as lists."""
+
+        return {label: [float(v) for v in self[label]] for label in self}
+
+
+# The first bytes of a binary TAC-file
+_TAC_MAGIC = b'\x89DYNTAC\n'
+
+# Version of the binary TAC-file format
+_TAC_VERSION = 1
+
+
+def save_tac(tac: Mapping[Any, Any],
+             path: str,
+             binary: bool = False,
+             units: Optional[dict[str, str]] = None,
+             metadata: Optional[dict[str, Any]] = None):
     """Saves the output from a function calculating ROI-means into a text file
     using numpy.savetxt.
+    Optionally the TAC is saved in a binary format instead, which can be
+    loaded much faster (see load_tac). A binary TAC-file starts with the
+    bytes '\\x89DYNTAC\\n', followed by the length of a JSON header (a
+    little-endian 32 bit unsigned integer), the JSON header and the columns
+    of the TAC as contiguous little-endian 64 bit floats. The header holds
+    the labels, the number of rows and the units and metadata (e.g. the
+    provenance of the data), which are only saved in the binary format.
 
     Arguments:
-    tac     --  The TAC-data (e.g. from lazy_series_roi_means)
-    path    --  The filename where the data will be saved.
+    tac         --  The TAC-data (e.g. from lazy_series_roi_means), as a
+                    TAC dataset or a dict of columns.
+    path        --  The filename where the data will be saved.
+    binary      --  Whether to save the binary format (default False).
+    units       --  The units of the columns (stored by label). Optional.
+    metadata    --  Any JSON serializable metadata. Optional.
     """
 
     # Put data and header text into appropriate containers
@@ -80,30 +235,274 @@ def save_tac(tac: dict[Union[str, int], list[float]], path: str):
 
     # Put data into columns and save to file
     data = np.column_stack(columns)
-    np.savetxt(path, data, header=header)
+    if not binary:
+        np.savetxt(path, data, header=header)
+        return
+
+    with open(path, 'wb') as f:
+        f.write(_tac_bytes([str(label) for label in tac], data, units,
+                           metadata))
+
+
+def _tac_bytes(labels: list[str],
+               data: npt.NDArray[Any],
+               units: Optional[dict[str, str]],
+               metadata: Optional[dict[str, Any]]) -> bytes:
+    """The contents of a binary TAC-file (see save_tac) with the given
+    labels and data (one column per label). The length is a multiple of 8
+    bytes.
+    """
+
+    info = {'version': _TAC_VERSION,
+            'labels': labels,
+            'rows': data.shape[0],
+            'units': units if units is not None else {},
+            'metadata': metadata if metadata is not None else {}}
+    head = json.dumps(info).encode()
+    # Pad the header with spaces, so that the columns are 8-byte aligned
+    head += b' ' * (-(len(_TAC_MAGIC) + 4 + len(head)) % 8)
+    return _TAC_MAGIC + struct.pack('<I', len(head)) + head + \
+        np.ascontiguousarray(data.T, dtype='<f8').tobytes()
+
 
+def _tac_header(buf: bytes) -> tuple[dict[str, Any], int]:
+    """Reads the JSON header of a binary TAC-file (see save_tac).
+
+    Return value:
+    A tuple with the header and the offset of the columns in the file.
+    """
+
+    start = len(_TAC_MAGIC) + 4
+    (n,) = struct.unpack('<I', buf[len(_TAC_MAGIC):start])
+    info: dict[str, Any] = json.loads(buf[start:start + n])
+    if info.get('version') != _TAC_VERSION:
+        raise ValueError("Unknown binary TAC-file version.")
+    return info, start + n
 
-def load_tac(path: str) -> dict[str, list[float]]:
-    """Loads a TAC-file saved with dynamit1.save_tac.
+
+def load_tac(path: str) -> TAC:
+    """Loads a TAC-file saved with dynamit1.save_tac. The file is read once,
+    and the format (text or binary) is detected from the first bytes of the
+    file. The data of a binary file is not copied, so the columns of the
+    returned dataset are read-only views of the file data.
 
     Arguments:
     path    --  The filename of the TAC-file.
 
     Return value:
-    A dict object with column headers as keys and data as values.
+    A TAC dataset with column headers as labels.
     """
 
+    with open(path, 'rb') as f:
+        buf = f.read()
+
+    if buf.startswith(_TAC_MAGIC):
+        info, offset = _tac_header(buf)
+        n_cols = len(info['labels'])
+        data = np.frombuffer(buf, dtype='<f8', count=n_cols * info['rows'],
+                             offset=offset).reshape(n_cols, info['rows'])
+        return TAC(data, info['labels'])
+
     # Read labels from file
-    with open(path) as f:
-        header = f.readline()
-    header_cols = header.split()
+    text = buf.decode()
+    header_cols = text.split('\n', 1)[0].split()
     header_cols = header_cols[1:]
 
-    # Load data (excluding header)
-    data = np.loadtxt(path)
+    # Load data (excluding header), with the columns stored contiguously
+    data = np.loadtxt(io.StringIO(text), ndmin=2)
+    return TAC(np.ascontiguousarray(data.T), header_cols)
+
+
+def load_tac_info(path: str) -> dict[str, Any]:
+    """Reads the labels, units and metadata of a binary TAC-file (see
+    save_tac) without reading the data.
+
+    Arguments:
+    path    --  The filename of the binary TAC-file.
+
+    Return value:
+    A dict object with the keys 'labels', 'rows', 'units' and 'metadata'.
+    """
+
+    with open(path, 'rb') as f:
+        prefix = f.read(len(_TAC_MAGIC) + 4)
+        if not prefix.startswith(_TAC_MAGIC):
+            raise ValueError(path + " is not a binary TAC-file.")
+        (n,) = struct.unpack('<I', prefix[len(_TAC_MAGIC):])
+        info, _ = _tac_header(prefix + f.read(n))
+    return {key: info[key] for key in ('labels', 'rows', 'units', 'metadata')}
+
+
+# The first bytes and the last bytes of a TAC archive
+_ARCHIVE_MAGIC = b'\x89DYNTAR\n'
+_ARCHIVE_TRAILER = b'DYNTARIX'
+
+# Version of the TAC archive index
+_ARCHIVE_VERSION = 1
+
+
+def _read_archive_index(f: BinaryIO) -> tuple[dict[str, list[int]], int]:
+    """Reads the index of an open TAC archive (see append_tac_archive).
+
+    Return value:
+    A tuple with the index (the offset and length of each dataset stored by
+    key) and the offset of the index in the file.
+    """
+
+    f.seek(0)
+    if f.read(len(_ARCHIVE_MAGIC)) != _ARCHIVE_MAGIC:
+        raise ValueError("The file is not a TAC archive.")
+    f.seek(-16, os.SEEK_END)
+    footer = f.read(16)
+    if footer[8:] != _ARCHIVE_TRAILER:
+        raise ValueError("The TAC archive has no index (it may be "
+                         "incompletely written).")
+    (offset,) = struct.unpack('<Q', footer[:8])
+    f.seek(offset)
+    index = json.loads(f.read()[:-16])
+    if index.get('version') != _ARCHIVE_VERSION:
+        raise ValueError("Unknown TAC archive version.")
+    entries: dict[str, list[int]] = index['entries']
+    return entries, offset
+
+
+def append_tac_archive(path: str,
+                       tacs: Mapping[str, Mapping[Any, Any]],
+                       replace: bool = False,
+                       units: Optional[dict[str, str]] = None,
+                       metadata: Optional[dict[str, Any]] = None):
+    """Appends many TAC datasets (e.g. one per patient or study) to a TAC
+    archive, which is created if it does not exist. An archive is a single
+    file with the datasets stored one after the other in the binary TAC
+    format (see save_tac), followed by an index with the offset of each
+    dataset stored by its key. A dataset can therefore be read without
+    reading the rest of the archive (see load_tac_archive). When datasets are
+    appended, they and a new index are written after the end of the file,
+    so the existing datasets are not rewritten, and the archive stays
+    readable with the old index if the append fails. A replaced dataset and
+    the old indices still take up space in the archive (the archive can be
+    rewritten without them by loading the datasets and appending them to a
+    new archive).
+
+    Arguments:
+    path        --  The filename of the archive.
+    tacs        --  The TAC datasets (or dicts of columns) stored by key (e.g.
+                    a patient or study ID).
+    replace     --  Whether datasets with keys already in the archive are
+                    replaced. By default this raises a ValueError.
+    units       --  The units of the columns (see save_tac). Optional.
+    metadata    --  Metadata stored with each dataset (see save_tac).
+                    Optional.
+    """
+
+    # Build every dataset before the archive is changed, so invalid data
+    # cannot leave a partly written archive
+    blobs = []
+    for key, tac in tacs.items():
+        dataset = TAC.from_dict(tac)
+        blobs.append((str(key), _tac_bytes(dataset.labels, dataset.data.T,
+                                           units, metadata)))
+
+    entries: dict[str, list[int]] = {}
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            entries, _ = _read_archive_index(f)
+
+    for key, _ in blobs:
+        if key in entries and not replace:
+            raise ValueError("The key " + key + " is already in the TAC "
+                             "archive " + path + ".")
+
+    with open(path, 'ab') as f:
+        end = f.tell()
+        try:
+            if end == 0:
+                f.write(_ARCHIVE_MAGIC)
+            # Append the new datasets after the old footer, so the old index
+            # stays valid until the new footer is written
+            for key, blob in blobs:
+                entries[key] = [f.tell(), len(blob)]
+                f.write(blob)
+
+            # Write the new index and the footer pointing to it
+            offset = f.tell()
+            f.write(json.dumps({'version': _ARCHIVE_VERSION,
+                                'entries': entries}).encode())
+            f.write(struct.pack('<Q', offset) + _ARCHIVE_TRAILER)
+            f.flush()
+        except BaseException:
+            # Restore the archive as it was before the append
+            f.truncate(end)
+            raise
+
+
+def tac_archive_keys(path: str) -> list[str]:
+    """The keys of the TAC datasets in a TAC archive (see
+    append_tac_archive), in the order they were appended.
+
+    Arguments:
+    path    --  The filename of the archive.
+
+    Return value:
+    A list with the keys.
+    """
+
+    with open(path, 'rb') as f:
+        entries, _ = _read_archive_index(f)
+    return sorted(entries, key=lambda key: entries[key][0])
+
+
+def load_tac_archive(path: str, key: str) -> TAC:
+    """Loads a single TAC dataset from a TAC archive (see append_tac_archive).
+    Only the index and the dataset are read: the dataset is memory-mapped, so
+    the columns are read-only views of the file.
+
+    Arguments:
+    path    --  The filename of the archive.
+    key     --  The key of the dataset.
+
+    Return value:
+    The TAC dataset.
+    """
+
+    with open(path, 'rb') as f:
+        entries, _ = _read_archive_index(f)
+    if key not in entries:
+        raise KeyError("The key " + key + " is not in the TAC archive " +
+                       path + ".")
+    start, length = entries[key]
+    blob = np.memmap(path, dtype=np.uint8, mode='r', offset=start,
+                     shape=(length,))
+    (n,) = struct.unpack('<I', bytes(blob[len(_TAC_MAGIC):
+                                          len(_TAC_MAGIC) + 4]))
+    info, offset = _tac_header(bytes(blob[:len(_TAC_MAGIC) + 4 + n]))
+    n_cols = len(info['labels'])
+    data = blob[offset:offset + 8 * n_cols * info['rows']].view('<f8')
+    return TAC(data.reshape(n_cols, info['rows']), info['labels'])
+
+
+def export_tac_archive(path: str,
+                       out_dir: str,
+                       binary: bool = False) -> list[str]:
+    """Saves every TAC dataset of a TAC archive (see append_tac_archive) to
+    its own TAC-file (see save_tac) in a folder. The files are named after the
+    keys of the datasets, with the extension .txt (or .tac for the binary
+    format).
+
+    Arguments:
+    path    --  The filename of the archive.
+    out_dir --  The folder where the TAC-files are saved.
+    binary  --  Whether to save the binary format (default False).
+
+    Return value:
+    A list with the filenames of the saved TAC-files.
+    """
 
-    # Put data into a dict object with correct labels
-    data_dict = {}
-    for i in range(len(header_cols)):
-        data_dict[header_cols[i]] = list(data[:, i])
-    return data_dict
+    paths = []
+    for key in tac_archive_keys(path):
+        tac = load_tac_archive(path, key)
+        out_path = os.path.join(out_dir, key + ('.tac' if binary else '.txt'))
+        os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+        save_tac(tac, out_path, binary=binary)
+        paths.append(out_path)
+    return paths
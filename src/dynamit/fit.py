@@ -0,0 +1,279 @@
+import concurrent.futures
+from typing import Any, Callable, Mapping, Optional
+
+import dynamit
+import lmfit
+import numpy as np
+import numpy.typing as npt
+import scipy
+
+
+def fit_models() -> dict[str, tuple[Callable[..., Any],
+                                    Callable[..., npt.NDArray[np.float64]]]]:
+    """The models available for fitting (see tac_fit and
+    dynamit.parametric_map), and their Jacobians.
+
+    Return value:
+    A dict object with a tuple of the model function and its Jacobian stored
+    under the model name used in the xml task files.
+    """
+
+    return {
+        'step2': (dynamit.model_step_2, dynamit.model_step_2_jac),
+        'fermi2': (dynamit.model_fermi_2, dynamit.model_fermi_2_jac),
+        'step_fermi': (dynamit.model_step_fermi,
+                       dynamit.model_step_fermi_jac),
+        'step': (dynamit.model_step, dynamit.model_step_jac),
+        'patlak': (dynamit.model_patlak, dynamit.model_patlak_jac)
+    }
+
+
+def _jacobian_dfun(jac: Callable[..., npt.NDArray[np.float64]],
+                   param_names: list[str]) -> Callable[..., Any]:
+    """Wraps a model Jacobian (e.g. dynamit.model_step_jac) into a function
+    that can be passed to an lmfit fit as the Dfun keyword argument. The
+    residual of an lmfit.Model fit is (data - model) * weights, so its Jacobian
+    is minus the model Jacobian with the rows scaled by the weights and the
+    columns restricted to the varying parameters.
+
+    Arguments:
+    jac         --  The model Jacobian.
+    param_names --  The parameter names of the model in the order of the
+                    Jacobian columns.
+
+    Return value:
+    The Jacobian function of the residual.
+    """
+
+    def dfun(pars: lmfit.Parameters,
+             data: npt.NDArray[np.float64],
+             weights: Optional[npt.NDArray[np.float64]],
+             **kwargs: Any) -> npt.NDArray[np.float64]:
+        values = {name: pars[name].value for name in param_names}
+        cols = [param_names.index(name) for name in pars
+                if pars[name].vary and pars[name].expr is None]
+        res = -jac(**kwargs, **values)[:, cols]
+        if weights is not None:
+            res = res * np.asarray(weights)[:, None]
+        return res
+
+    return dfun
+
+
+def tac_fit(tac: Mapping[str, npt.ArrayLike],
+            time_label: str,
+            inp_label: str,
+            tis_label: str,
+            fit_model: str,
+            params: dict[str, dict[str, float]],
+            t_cut: Optional[int] = None) -> lmfit.model.ModelResult:
+    """Fits model parameters to a measured TAC. The fit uses the analytic
+    Jacobian of the model.
+
+    Arguments:
+    tac         --  The TAC-data (e.g. from load_tac), as a TAC dataset or a
+                    dict of columns.
+    time_label  --  The label of the time data.
+    inp_label   --  The label of the input function data.
+    tis_label   --  The label of the tissue data.
+    fit_model   --  The name of the model ('step', 'step2', 'step_fermi',
+                    'fermi2' or 'patlak').
+    params      --  The model parameters. The keys are the parameter names,
+                    and the values are dicts with the key 'value' (the initial
+                    value) and optionally the keys 'min' and 'max'.
+    t_cut       --  Only the first t_cut time points are fitted. By default
+                    all time points are used.
+
+    Return value:
+    The lmfit fit result.
+    """
+
+    # Use the columns as array views of the fitted time points
+    data = dynamit.TAC.from_dict(tac).window(0, t_cut)
+
+    model_func, jac = dynamit.fit_models()[fit_model]
+
+    # Create lmfit Parameters-object
+    parameters = lmfit.create_params(**params)
+
+    # Define model to fit
+    model = lmfit.Model(model_func, independent_vars=['t', 'in_func'])
+    # Run fit from initial values using the analytic model Jacobian
+    dfun = _jacobian_dfun(jac, model.param_names)
+    return model.fit(data[tis_label], t=data[time_label],
+                     in_func=data[inp_label],
+                     params=parameters,
+                     fit_kws={'Dfun': dfun})
+
+
+def tac_fit_uncertainty(res: lmfit.model.ModelResult,
+                        fit_model: str,
+                        sigma: float = 2.0) \
+        -> tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+    """Calculates the confidence and prediction intervals of a fitted model
+    from the model Jacobian at the best fit parameters. This gives the same
+    result as lmfit.model.ModelResult.eval_uncertainty, but without
+    evaluating the model with stepped parameter values.
+
+    Arguments:
+    res         --  The fit result (e.g. from tac_fit).
+    fit_model   --  The name of the fitted model.
+    sigma       --  The confidence level in number of standard deviations.
+
+    Return value:
+    A tuple with the half-width of the confidence interval and of the
+    prediction interval at each time point.
+    """
+
+    jac = dynamit.fit_models()[fit_model][1](
+        t=res.userkws['t'], in_func=res.userkws['in_func'],
+        **res.best_values)
+
+    # Without a covariance matrix there is no uncertainty estimate
+    if res.covar is None:
+        zeros = np.zeros(jac.shape[0])
+        return zeros, zeros
+
+    # Keep only the columns of the varying parameters
+    cols = [res.model.param_names.index(name) for name in res.var_names]
+    j = jac[:, cols]
+    df2 = np.einsum('ij,jk,ik->i', j, res.covar, j)
+
+    prob = scipy.special.erf(sigma / np.sqrt(2.0))
+    scale = scipy.stats.t.ppf((prob + 1.0) / 2.0, res.ndata - res.nvarys)
+    return scale * np.sqrt(df2), scale * np.sqrt(df2 + res.redchi)
+
+
+def _tac_fit_file(tac_path: str,
+                  time_label: str,
+                  inp_label: str,
+                  tis_label: str,
+                  fit_model: str,
+                  params: dict[str, dict[str, float]],
+                  t_cut: Optional[int]) -> dict[str, Any]:
+    """Loads a TAC-file and fits model parameters to it (see tac_fit). This is
+    the work done by each worker process in tac_fit_batch, so it returns a
+    plain dict instead of the lmfit fit result.
+
+    Return value:
+    A dict with the keys 'tac_path', 'success', 'nfev', 'chisqr' and 'redchi'
+    and, for each parameter, the best fit value under the parameter name and
+    the standard error under the parameter name with the suffix '_stderr'.
+    If the fit fails, the error message is stored under the key 'error'.
+    """
+
+    summary: dict[str, Any] = {'tac_path': tac_path}
+    try:
+        tac = dynamit.load_tac(tac_path)
+        res = tac_fit(tac, time_label, inp_label, tis_label, fit_model,
+                      params, t_cut=t_cut)
+    except Exception as e:
+        summary['success'] = False
+        summary['error'] = str(e)
+        return summary
+
+    summary.update(fit_summary(res))
+    return summary
+
+
+def fit_summary(res: lmfit.model.ModelResult) -> dict[str, Any]:
+    """Collects the main numbers of a fit result in a plain dict, which
+    (unlike the fit result) can be saved to json or sent between processes.
+
+    Arguments:
+    res --  The fit result (e.g. from tac_fit).
+
+    Return value:
+    A dict with the keys 'success', 'nfev', 'chisqr' and 'redchi' and, for
+    each parameter, the best fit value under the parameter name and the
+    standard error under the parameter name with the suffix '_stderr'.
+    """
+
+    summary: dict[str, Any] = {'success': bool(res.success),
+                               'nfev': res.nfev,
+                               'chisqr': res.chisqr,
+                               'redchi': res.redchi}
+    for name, par in res.params.items():
+        summary[name] = par.value
+        summary[name + '_stderr'] = par.stderr
+    return summary
+
+
+def tac_fit_batch(tac_paths: list[str],
+                  time_label: str,
+                  inp_label: str,
+                  tis_label: str,
+                  fit_model: str,
+                  params: dict[str, dict[str, float]],
+                  t_cut: Optional[int] = None,
+                  workers: int = 1) -> list[dict[str, Any]]:
+    """Fits the same model with the same initial parameters to many TAC-files
+    (see tac_fit). The fits are spread over a number of worker processes.
+    The results are returned in the same order as the files, no matter in
+    which order the fits finish, so the output is deterministic.
+    A failing fit does not stop the other fits, but is reported in the result
+    of that file.
+
+    Arguments:
+    tac_paths   --  The paths to the TAC-files.
+    time_label  --  The label of the time data.
+    inp_label   --  The label of the input function data.
+    tis_label   --  The label of the tissue data.
+    fit_model   --  The name of the model.
+    params      --  The model parameters (see tac_fit).
+    t_cut       --  Only the first t_cut time points are fitted. By default
+                    all time points are used.
+    workers     --  The number of worker processes. With a single worker the
+                    fits are run in the calling process.
+
+    Return value:
+    A list with a dict for each TAC-file with the keys 'tac_path', 'success',
+    'nfev', 'chisqr' and 'redchi' and, for each parameter, the best fit value
+    under the parameter name and the standard error under the parameter name
+    with the suffix '_stderr'. If a fit fails, the error message is stored
+    under the key 'error'.
+    """
+
+    if workers <= 1:
+        return [_tac_fit_file(path, time_label, inp_label, tis_label,
+                              fit_model, params, t_cut)
+                for path in tac_paths]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as ex:
+        futures = [ex.submit(_tac_fit_file, path, time_label, inp_label,
+                             tis_label, fit_model, params, t_cut)
+                   for path in tac_paths]
+        return [future.result() for future in futures]
+
+
+def save_fit_table(results: list[dict[str, Any]],
+                   param_names: list[str],
+                   path: str):
+    """Saves the results of tac_fit_batch to a tab-separated text file with
+    one row per TAC-file. Missing values (e.g. from failed fits or parameters
+    without a standard error) are written as nan.
+
+    Arguments:
+    results     --  The results from tac_fit_batch.
+    param_names --  The names of the parameters to include in the table.
+    path        --  The filename where the table will be saved.
+    """
+
+    columns = ['tac_path', 'success', 'nfev', 'chisqr', 'redchi']
+    for name in param_names:
+        columns.append(name)
+        columns.append(name + '_stderr')
+
+    with open(path, 'w') as f:
+        f.write('\t'.join(columns) + '\n')
+        for result in results:
+            row = []
+            for col in columns:
+                value = result.get(col)
+                if value is None:
+                    row.append('nan')
+                elif isinstance(value, float):
+                    row.append(repr(value))
+                else:
+                    row.append(str(value))
+            f.write('\t'.join(row) + '\n')
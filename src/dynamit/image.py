@@ -1,10 +1,257 @@
 import SimpleITK as sitk
-from collections import defaultdict
+import concurrent.futures
+from collections import OrderedDict, defaultdict, deque
+from datetime import datetime
 import dynamit
-from typing import Any, Optional
+import functools
+import hashlib
+import json
+import numpy as np
+import numpy.typing as npt
+import os
+import scipy
+import threading
+import time
+from typing import Any, Callable, Iterable, Optional, Sequence, Union
 
+# Version of the series index file format. Index files with another version
+# are ignored.
+_SERIES_INDEX_VERSION = 1
+# The maximum total size of the series index files in bytes
+_SERIES_INDEX_SIZE = 64 * 1024 * 1024
 
-def load_dynamic_series(dicom_path: str) -> dict[str, Any]:
+
+def default_cache_dir() -> str:
+    """The directory where dynamit stores cached data by default (e.g. the
+    series index, see scan_dynamic_series). This is the directory given by the
+    environment variable DYNAMIT_CACHE_DIR, or else the folder 'dynamit' in
+    the user cache directory.
+
+    Return value:
+    The path of the cache directory.
+    """
+
+    if 'DYNAMIT_CACHE_DIR' in os.environ:
+        return os.environ['DYNAMIT_CACHE_DIR']
+    cache_home = os.environ.get('XDG_CACHE_HOME',
+                                os.path.join(os.path.expanduser('~'),
+                                             '.cache'))
+    return os.path.join(cache_home, 'dynamit')
+
+
+def _evict_cache_files(cache_dir: str, max_size: int):
+    """Removes the least recently used files of a cache folder until the
+    total size of the files is at most max_size bytes. The files are ordered
+    by modification time, so a file is marked as used by updating its
+    modification time.
+    """
+
+    files = []
+    total = 0
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                # Temporary files are still being written by a process
+                if entry.is_file() and '.tmp' not in entry.name:
+                    st = entry.stat()
+                    files.append((st.st_mtime_ns, st.st_size, entry.path))
+                    total += st.st_size
+    except OSError:
+        return
+
+    for _, size, path in sorted(files):
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+def _series_index_path(dicom_path: str, index_dir: Optional[str]) -> str:
+    """The path of the index file of a dynamic image series. The index files
+    are stored in index_dir (by default the folder 'series_index' in the
+    dynamit cache directory) with a name derived from the absolute path of
+    the series.
+    """
+
+    if index_dir is None:
+        index_dir = os.path.join(default_cache_dir(), 'series_index')
+    key = hashlib.sha1(os.path.abspath(dicom_path).encode()).hexdigest()
+    return os.path.join(index_dir, key + '.json')
+
+
+def _directory_stats(dicom_path: str) -> dict[str, list[int]]:
+    """The modification time (in ns) and size of every file in a folder, stored
+    by file name. This is used to decide if a series index is up to date.
+    """
+
+    stats = {}
+    with os.scandir(dicom_path) as it:
+        for entry in it:
+            if entry.is_file():
+                st = entry.stat()
+                stats[entry.name] = [st.st_mtime_ns, st.st_size]
+    return stats
+
+
+def _scan_series_headers(dicom_path: str) -> dict[str, Any]:
+    """Reads the headers of all dicom files of a dynamic image series (see
+    scan_dynamic_series).
+    """
+
+    # Prepare reader
+    reader = sitk.ImageSeriesReader()
+
+    # Get dicom file names in folder
+    dcm_names = reader.GetGDCMSeriesFileNames(dicom_path)
+
+    # Read the header of every file
+    file_reader = sitk.ImageFileReader()
+    acq_dt = []
+    geometry: dict[str, Any] = {}
+    for name in dcm_names:
+        file_reader.SetFileName(name)
+        file_reader.ReadImageInformation()
+        acq_dt.append(dynamit.parse_acq_datetime(
+            file_reader.GetMetaData('0008|0022'),
+            file_reader.GetMetaData('0008|0032')))
+        if not geometry:
+            geometry = {'size': file_reader.GetSize(),
+                        'spacing': file_reader.GetSpacing(),
+                        'origin': file_reader.GetOrigin(),
+                        'direction': file_reader.GetDirection()}
+
+    # Sort according to acquisition time
+    order = sorted(range(len(dcm_names)), key=lambda i: acq_dt[i])
+    acq0 = acq_dt[order[0]]
+
+    return {'files': [dcm_names[i] for i in order],
+            'acq': [(acq_dt[i] - acq0).total_seconds() for i in order],
+            'geometry': geometry}
+
+
+def scan_dynamic_series(dicom_path: str,
+                        use_index: bool = True,
+                        index_dir: Optional[str] = None) -> dict[str, Any]:
+    """Scans the dicom files of a dynamic image series without loading the
+    pixel data. Only the header of each file is read, which gives the
+    acquisition time and the geometry of each image.
+    The result is stored in a dictionary object with the keys 'files', 'acq'
+    and 'geometry':
+    Under the key 'files' the file names are stored in a list in order of
+    acquisition time.
+    Under the key 'acq' the relative acquisition times are stored in seconds,
+    in the same order.
+    Under the key 'geometry' the geometry of the images is stored as a dict
+    object with the keys 'size', 'spacing', 'origin' and 'direction' (taken
+    from the first image).
+    The result is stored in an index file, and later scans of the same series
+    read the index file instead of the dicom headers. The index is only used
+    if no file in the series folder has been added, removed or changed (in
+    modification time or size) since the index was written. If the index
+    file cannot be written, the series is simply scanned every time. When
+    the index files of all series take up more than 64 MB, the least
+    recently used index files are removed.
+
+    Arguments:
+    dicom_path  --  The path to the dicom files
+    use_index   --  Whether to use (and update) the series index.
+    index_dir   --  The folder where the index files are stored. By default
+                    the folder 'series_index' in the dynamit cache directory
+                    (given by the environment variable DYNAMIT_CACHE_DIR, or
+                    else ~/.cache/dynamit) is used.
+
+    Return value:
+    A dict-object with keys 'files' (file names in a list), 'acq'
+    (acquisition times in seconds in a list) and 'geometry' (a dict).
+    """
+
+    if not use_index:
+        return _scan_series_headers(dicom_path)
+
+    index_path = _series_index_path(dicom_path, index_dir)
+    stats = _directory_stats(dicom_path)
+
+    # Use the index if it is up to date
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+        if index['version'] == _SERIES_INDEX_VERSION \
+                and index['stats'] == stats:
+            # Mark the index as recently used
+            os.utime(index_path)
+            return {'files': [os.path.join(dicom_path, name)
+                              for name in index['files']],
+                    'acq': index['acq'],
+                    'geometry': {key: tuple(value) for key, value
+                                 in index['geometry'].items()}}
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    scan = _scan_series_headers(dicom_path)
+
+    # Write the index to a temporary file first, so that other processes never
+    # read a partially written index
+    index = {'version': _SERIES_INDEX_VERSION,
+             'stats': stats,
+             'files': [os.path.basename(name) for name in scan['files']],
+             'acq': scan['acq'],
+             'geometry': scan['geometry']}
+    tmp_path = index_path + '.' + str(os.getpid()) + '.tmp'
+    try:
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        pass
+    _evict_cache_files(os.path.dirname(index_path), _SERIES_INDEX_SIZE)
+
+    return scan
+
+
+def _geometry_resampler(geometry: dict[str, Any]) -> sitk.ResampleImageFilter:
+    """Prepares a nearest-neighbour resampler to the geometry of a dynamic
+    series (see scan_dynamic_series).
+    """
+
+    resampler = sitk.ResampleImageFilter()
+    resampler.SetSize(geometry['size'])
+    resampler.SetOutputSpacing(geometry['spacing'])
+    resampler.SetOutputOrigin(geometry['origin'])
+    resampler.SetOutputDirection(geometry['direction'])
+    resampler.SetInterpolator(sitk.sitkNearestNeighbor)
+    return resampler
+
+
+def _geometry_image(geometry: dict[str, Any]) -> sitk.Image:
+    """Creates an empty image with the geometry of a dynamic series (see
+    scan_dynamic_series), which can be used as a reference image.
+    """
+
+    img = sitk.Image(geometry['size'], sitk.sitkUInt8)
+    img.SetSpacing(geometry['spacing'])
+    img.SetOrigin(geometry['origin'])
+    img.SetDirection(geometry['direction'])
+    return img
+
+
+def _image_array(img: Union[sitk.Image, npt.NDArray[Any]]) \
+        -> npt.NDArray[Any]:
+    """The voxel values of an image as a (zero-copy) array. The image can be
+    a SimpleITK Image or an array (e.g. a frame of a memory-mapped series, see
+    load_series_memmap).
+    """
+
+    if isinstance(img, sitk.Image):
+        return sitk.GetArrayViewFromImage(img)
+    return np.asarray(img)
+
+
+def load_dynamic_series(dicom_path: str,
+                        index_dir: Optional[str] = None) -> dict[str, Any]:
     """Loads a dynamic image series. The images and their relative acquisition
     times are stored in a dictionary object. The keys 'img' and 'acq' are
     available:
@@ -13,64 +260,919 @@ def load_dynamic_series(dicom_path: str) -> dict[str, Any]:
     Under the key 'acq' the relative acquisition times are stored in seconds.
     This means: result['img'][i] is acquired result['acq'][i] seconds after
     result['img'][0].
+    The acquisition times are read from the file headers (see
+    scan_dynamic_series), so the pixel data of each image is only read once.
+    The scan is stored in the series index, so loading the same series again
+    does not read the headers again.
+    The series can also be a single multi-frame dicom file (see
+    load_multiframe_series).
 
     Arguments:
-    dicom_path  --  The path to the dicom files
+    dicom_path  --  The path to the dicom files, or the filename of a
+                    multi-frame dicom file
+    index_dir   --  The folder where the series index is stored (see
+                    scan_dynamic_series).
 
     Return value:
     A dict-object with keys 'img' (SimpleITK Images in a list) and 'acq'
     (acquisition times in seconds in a list).
     """
 
-    # Prepare reader
-    reader = sitk.ImageSeriesReader()
+    if os.path.isfile(dicom_path):
+        series = load_multiframe_series(dicom_path)
+        return {'img': list(series['img']),
+                'acq': series['acq']}
 
-    # Get dicom file names in folder sorted according to acquisition time.
-    dcm_names = reader.GetGDCMSeriesFileNames(dicom_path)
+    scan = scan_dynamic_series(dicom_path, index_dir=index_dir)
 
-    img_arr = []
-    acq_arr = []
+    # Load images in order of acquisition
+    img_arr = [sitk.ReadImage(name) for name in scan['files']]
 
-    # Get acquisition time of first image
-    acq0 = dynamit.get_acq_datetime(dcm_names[0])
+    return {'img': img_arr,
+            'acq': scan['acq']}
 
-    for name in dcm_names:
-        # Load image and read acquisition time of each image and store in list
-        img = sitk.ReadImage(name)
-        img_arr.append(img)
-        acq_arr.append((dynamit.get_acq_datetime(name)-acq0).total_seconds())
 
-    return {'img': img_arr,
-            'acq': acq_arr}
+# Version of the memory-mapped series metadata format
+_SERIES_MEMMAP_VERSION = 1
+
+
+def _memmap_metadata_path(path: str) -> str:
+    """The path of the metadata file of a memory-mapped series."""
+
+    return path + '.json'
+
+
+def save_series_memmap(dicom_path: str,
+                       path: str,
+                       index_dir: Optional[str] = None):
+    """Converts a dynamic image series to a memory-mapped series. The images
+    are stored in order of acquisition time as one contiguous 4D array (time,
+    z, y, x) in a numpy .npy file, with the pixel type of the images. The
+    acquisition times and the geometry of the images are stored in a small
+    metadata file next to it (with the extension .json added to the path).
+    The images are converted one at a time, so only one image is in memory at
+    a time. A memory-mapped series can be loaded with load_series_memmap
+    without decoding the dicom files again.
+
+    Arguments:
+    dicom_path  --  The path to the dicom files, or the filename of a
+                    multi-frame dicom file (see load_multiframe_series)
+    path        --  The filename of the memory-mapped series (usually with the
+                    extension .npy).
+    index_dir   --  The folder where the series index is stored (see
+                    scan_dynamic_series).
+    """
+
+    frames: Iterable[npt.NDArray[Any]]
+    if os.path.isfile(dicom_path):
+        scan = load_multiframe_series(dicom_path)
+        frames = scan['data']
+    else:
+        scan = scan_dynamic_series(dicom_path, index_dir=index_dir)
+        frames = (sitk.GetArrayFromImage(sitk.ReadImage(name))
+                  for name in scan['files'])
+
+    # Write to temporary files first, so that a partially written series is
+    # never loaded
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    metadata_path = _memmap_metadata_path(path)
+    tmp_metadata_path = metadata_path + '.' + str(os.getpid()) + '.tmp'
+    data = None
+    try:
+        for i, frame in enumerate(frames):
+            if data is None:
+                data = np.lib.format.open_memmap(
+                    tmp_path, mode='w+', dtype=frame.dtype,
+                    shape=(len(scan['acq']),) + frame.shape)
+            if frame.shape != data.shape[1:]:
+                raise ValueError("The images of the series do not have the "
+                                 "same size.")
+            data[i] = frame
+        if data is None:
+            raise ValueError("The series has no images.")
+        data.flush()
+        del data
+
+        metadata = {'version': _SERIES_MEMMAP_VERSION,
+                    'acq': scan['acq'],
+                    'geometry': scan['geometry']}
+        with open(tmp_metadata_path, 'w') as f:
+            json.dump(metadata, f)
+
+        # Publish the metadata before the images. A reader between the two
+        # steps finds metadata that does not match the old images (or no
+        # images), which load_series_memmap reports as an error.
+        os.replace(tmp_metadata_path, metadata_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        for name in (tmp_path, tmp_metadata_path):
+            if os.path.exists(name):
+                os.remove(name)
+        raise
+
+
+class _MemmapFrames(Sequence[sitk.Image]):
+    """The images of a memory-mapped series as a sequence of SimpleITK Images.
+    An image is only created (by copying it from the memory-mapped array) when
+    it is accessed.
+    """
+
+    def __init__(self, data: npt.NDArray[Any], geometry: dict[str, Any]):
+        self._data = data
+        self._geometry = geometry
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _frame(self, i: int) -> sitk.Image:
+        img = sitk.GetImageFromArray(self._data[i])
+        img.SetSpacing(self._geometry['spacing'])
+        img.SetOrigin(self._geometry['origin'])
+        img.SetDirection(self._geometry['direction'])
+        return img
+
+    def __getitem__(self, i: Any) -> Any:
+        if isinstance(i, slice):
+            return [self._frame(j) for j in range(*i.indices(len(self)))]
+        return self._frame(range(len(self))[i])
+
+
+def load_series_memmap(path: str) -> dict[str, Any]:
+    """Loads a memory-mapped series (see save_series_memmap). The images are
+    not read, but mapped into memory read-only, so loading is almost instant
+    and the memory pages are shared between processes using the same series.
+    The result is stored in a dictionary object with the same keys 'img' and
+    'acq' as from load_dynamic_series, and the keys 'data' and 'geometry':
+    Under the key 'img' the images are stored as a sequence of SimpleITK
+    Images, which are created when accessed.
+    Under the key 'acq' the relative acquisition times are stored in seconds.
+    Under the key 'data' the images are stored as a memory-mapped 4D array
+    (time, z, y, x). The images can be used directly from this array (e.g. in
+    series_roi_means) without copying.
+    Under the key 'geometry' the geometry of the images is stored (see
+    scan_dynamic_series).
 
+    A ValueError is raised if the images do not match the metadata (e.g.
+    because the series is being rewritten by save_series_memmap).
 
-def resample_series_to_reference(series: list[sitk.Image],
-                                 ref: sitk.Image) -> list[sitk.Image]:
+    Arguments:
+    path    --  The filename of the memory-mapped series.
+
+    Return value:
+    A dict-object with keys 'img', 'acq', 'data' and 'geometry'.
+    """
+
+    with open(_memmap_metadata_path(path)) as f:
+        metadata = json.load(f)
+    if metadata.get('version') != _SERIES_MEMMAP_VERSION:
+        raise ValueError("Unknown memory-mapped series version in " + path +
+                         ".")
+    geometry = {key: tuple(value)
+                for key, value in metadata['geometry'].items()}
+    data = np.load(path, mmap_mode='r')
+    if data.shape != (len(metadata['acq']),) \
+            + tuple(reversed(geometry['size'])):
+        raise ValueError("The images of the memory-mapped series " + path +
+                         " do not match its metadata (the series may be "
+                         "being written).")
+    return {'img': _MemmapFrames(data, geometry),
+            'acq': metadata['acq'],
+            'data': data,
+            'geometry': geometry}
+
+
+def _multiframe_times(reader: sitk.ImageFileReader,
+                      n_slices: int) -> list[float]:
+    """Reads the relative acquisition times (in seconds) of the time frames
+    of a multi-frame dicom file from its header (see load_multiframe_series).
+    """
+
+    def values(tag: str) -> list[float]:
+        return [float(v) for v in reader.GetMetaData(tag).split('\\')
+                if v.strip() != '']
+
+    if reader.HasMetaDataKey('0018|1065'):
+        # Frame Time Vector: the time increments (in ms) between the frames
+        times = np.cumsum(values('0018|1065'))
+    elif reader.HasMetaDataKey('0054|1300'):
+        # Frame Reference Time (in ms) of each frame
+        times = np.asarray(values('0054|1300'))
+    elif reader.HasMetaDataKey('0018|1063'):
+        # Frame Time: the (constant) time (in ms) between the frames
+        n_frames = n_slices
+        if reader.HasMetaDataKey('0054|0101'):
+            n_frames = int(reader.GetMetaData('0054|0101'))
+        times = np.arange(n_frames) * values('0018|1063')[0]
+    else:
+        raise ValueError("The dicom file has no frame timing information.")
+
+    return [float(t) for t in (times - times[0]) / 1000.0]
+
+
+def load_multiframe_series(path: str) -> dict[str, Any]:
+    """Loads a dynamic image series stored in a single multi-frame dicom file.
+    The file is decoded once into a single volume, and the images of the
+    series are slices of this volume, so no temporary files are created. The
+    volume must store the images one after the other, i.e. all the slices of
+    the first image, then all the slices of the second image and so on.
+    The number of images is read from the Number of Time Slices tag
+    (0054|0101), or else from the number of frame times. The acquisition
+    times are read from the per-frame timing tags of the header: the Frame
+    Time Vector (0018|1065), the Frame Reference Time (0054|1300) or the
+    Frame Time (0018|1063), in that order of preference.
+    The result is stored in a dictionary object with the same keys as from
+    load_series_memmap ('img', 'acq', 'data' and 'geometry'), and it can be
+    used in the same way.
+
+    Arguments:
+    path    --  The filename of the multi-frame dicom file.
+
+    Return value:
+    A dict-object with keys 'img', 'acq', 'data' and 'geometry'.
+    """
+
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(path)
+    reader.ReadImageInformation()
+    size = reader.GetSize()
+    acq = _multiframe_times(reader, size[2])
+    n_frames = len(acq)
+    if reader.HasMetaDataKey('0054|0101'):
+        n_frames = int(reader.GetMetaData('0054|0101'))
+    if n_frames != len(acq) or size[2] % n_frames != 0:
+        raise ValueError("The number of frames of " + path + " does not "
+                         "match its frame timing information.")
+
+    # Decode the volume once, and split it into the images without copying
+    volume = sitk.GetArrayFromImage(reader.Execute())
+    data = volume.reshape((n_frames, -1) + volume.shape[1:])
+    geometry = {'size': (size[0], size[1], size[2] // n_frames),
+                'spacing': reader.GetSpacing(),
+                'origin': reader.GetOrigin(),
+                'direction': reader.GetDirection()}
+    return {'img': _MemmapFrames(data, geometry),
+            'acq': acq,
+            'data': data,
+            'geometry': geometry}
+
+
+def load_series_file(path: str) -> dict[str, Any]:
+    """Loads a dynamic image series stored in a single file, which can be a
+    memory-mapped series (see load_series_memmap) or a multi-frame dicom file
+    (see load_multiframe_series). A memory-mapped series is recognised by its
+    metadata file.
+
+    Arguments:
+    path    --  The filename of the series.
+
+    Return value:
+    A dict-object with keys 'img', 'acq', 'data' and 'geometry'.
+    """
+
+    if os.path.isfile(_memmap_metadata_path(path)):
+        return load_series_memmap(path)
+    return load_multiframe_series(path)
+
+
+def _stored_values(arr: npt.NDArray[Any], reader: sitk.ImageFileReader) \
+        -> tuple[npt.NDArray[Any], float, float]:
+    """Converts the voxel values of a dicom image back to the stored integer
+    values, using the rescale slope and intercept of the dicom header
+    (value = slope * stored value + intercept). If the header has no rescale
+    tags, or the values cannot be converted exactly, the values are kept as
+    they are.
+
+    Return value:
+    A tuple with the stored values, the slope and the intercept.
+    """
+
+    tags = ['0028|1053', '0028|0100', '0028|0103']
+    if arr.dtype.kind != 'f' \
+            or not all(reader.HasMetaDataKey(tag) for tag in tags):
+        return arr, 1.0, 0.0
+    try:
+        slope = float(reader.GetMetaData('0028|1053'))
+        intercept = 0.0
+        if reader.HasMetaDataKey('0028|1052'):
+            intercept = float(reader.GetMetaData('0028|1052'))
+        bits = int(reader.GetMetaData('0028|0100'))
+        signed = int(reader.GetMetaData('0028|0103')) == 1
+        dtype = np.dtype(('i' if signed else 'u') + str(bits // 8))
+    except (ValueError, TypeError):
+        return arr, 1.0, 0.0
+    if slope == 0.0:
+        return arr, 1.0, 0.0
+
+    stored = np.rint((arr - intercept) / slope)
+    info = np.iinfo(dtype)
+    if stored.size > 0 \
+            and (stored.min() < info.min or stored.max() > info.max):
+        return arr, 1.0, 0.0
+    if not np.array_equal(stored * slope + intercept, arr):
+        return arr, 1.0, 0.0
+    return stored.astype(dtype), slope, intercept
+
+
+class DynamicSeries(Sequence[sitk.Image]):
+    """A dynamic image series with lazily loaded images. The images are only
+    read when they are accessed, and the most recently used images are kept
+    in a cache of a fixed size, so the memory usage does not grow with the
+    length of the series.
+    The images can be accessed by index (series[i]) or by slice (series[i:j],
+    which gives a list), and they are returned as SimpleITK Images with the
+    voxel values in physical units, like from load_dynamic_series. In the
+    cache the images are kept with the stored (integer) pixel type of the
+    dicom files together with the rescale slope and intercept, which uses
+    several times less memory than the rescaled values. The stored values can
+    be accessed with the method raw, so that computations can postpone the
+    rescaling (see e.g. series_roi_means).
+    The series can also be a memory-mapped series (see save_series_memmap),
+    in which case the images are read from the memory-mapped array, or a
+    multi-frame dicom file (see load_multiframe_series), in which case the
+    images are slices of the decoded volume.
+
+    Arguments:
+    path        --  The path to the dicom files, or the filename of a
+                    memory-mapped series or a multi-frame dicom file.
+    cache_size  --  The number of images kept in the cache.
+    index_dir   --  The folder where the series index is stored (see
+                    scan_dynamic_series).
+    """
+
+    def __init__(self, path: str, cache_size: int = 4,
+                 index_dir: Optional[str] = None):
+
+        self._data: Optional[npt.NDArray[Any]] = None
+        if os.path.isfile(path):
+            mm = load_series_file(path)
+            self._data = mm['data']
+            self.files: list[str] = []
+            acq = mm['acq']
+            self.geometry: dict[str, Any] = mm['geometry']
+        else:
+            scan = scan_dynamic_series(path, index_dir=index_dir)
+            self.files = scan['files']
+            acq = scan['acq']
+            self.geometry = scan['geometry']
+        self.acq: npt.NDArray[np.float64] = np.asarray(acq, dtype=np.float64)
+        self.cache_size = cache_size
+
+        self._cache: OrderedDict[int, tuple[npt.NDArray[Any], float, float]] \
+            = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.acq)
+
+    def _decode(self, i: int) -> tuple[npt.NDArray[Any], float, float]:
+        """Reads an image and converts it to the stored values."""
+
+        reader = sitk.ImageFileReader()
+        reader.SetFileName(self.files[i])
+        img = reader.Execute()
+        return _stored_values(sitk.GetArrayFromImage(img), reader)
+
+    def raw(self, i: int) -> tuple[npt.NDArray[Any], float, float]:
+        """Get an image of the series with the stored pixel values.
+
+        Arguments:
+        i   --  The index of the image.
+
+        Return value:
+        A tuple with an array with the stored pixel values, the rescale slope
+        and the rescale intercept. The voxel values in physical units are
+        slope * stored value + intercept. The array must not be changed.
+        """
+
+        i = range(len(self))[i]
+        if self._data is not None:
+            return self._data[i], 1.0, 0.0
+
+        with self._lock:
+            if i in self._cache:
+                self._cache.move_to_end(i)
+                return self._cache[i]
+
+        # Decode outside the lock, so that several threads can decode images
+        # at the same time
+        frame = self._decode(i)
+
+        with self._lock:
+            self._cache[i] = frame
+            self._cache.move_to_end(i)
+            while len(self._cache) > max(self.cache_size, 0):
+                self._cache.popitem(last=False)
+        return frame
+
+    def _frame(self, i: int) -> sitk.Image:
+        arr, slope, intercept = self.raw(i)
+        if slope != 1.0 or intercept != 0.0:
+            arr = arr * slope + intercept
+        img = sitk.GetImageFromArray(arr)
+        img.SetSpacing(self.geometry['spacing'])
+        img.SetOrigin(self.geometry['origin'])
+        img.SetDirection(self.geometry['direction'])
+        return img
+
+    def __getitem__(self, i: Any) -> Any:
+        if isinstance(i, slice):
+            return [self._frame(j) for j in range(*i.indices(len(self)))]
+        return self._frame(i)
+
+
+def _geometry_key(img: sitk.Image) -> list[Any]:
+    """The geometry of an image (size, spacing, origin and direction) as a
+    list, which can be used to build a cache key.
+    """
+
+    return [list(img.GetSize()), list(img.GetSpacing()),
+            list(img.GetOrigin()), list(img.GetDirection())]
+
+
+class NearestNeighbourResampler:
+    """Precomputed nearest-neighbour resampling from the space of one image
+    geometry (the source) to the space of a reference image.
+    The voxel-to-voxel mapping is the same for all images with the source
+    geometry, e.g. all images of a dynamic series, so it is computed once as
+    an index map: for every voxel of the reference, the (flat) index of the
+    source voxel whose value it takes. Each image is then resampled with a
+    single gather of its voxel values. The mapping is computed by resampling
+    an image of voxel indices with sitk.ResampleImageFilter, so the result is
+    exactly the same as resampling the image with the filter (with the
+    default value 0 outside the source image).
+    The index map can optionally be cached on disk, keyed by the source and
+    reference geometries, so later series with the same geometries do not
+    compute it again. Each cached map takes up as much space as a volume of
+    the reference with 32-bit voxels, so the least recently used maps are
+    removed when the cache grows larger than cache_size bytes.
+
+    Arguments:
+    source      --  An image with the geometry of the images to resample.
+    reference   --  The reference image.
+    use_cache   --  Whether to use (and update) the disk cache (default
+                    False).
+    cache_dir   --  The folder where the index maps are cached. By default
+                    the folder 'nn_index' in the dynamit cache directory (see
+                    scan_dynamic_series) is used.
+    cache_size  --  The maximum size of the disk cache in bytes (default
+                    512 MB).
+    """
+
+    def __init__(self, source: sitk.Image, reference: sitk.Image,
+                 use_cache: bool = False, cache_dir: Optional[str] = None,
+                 cache_size: int = 512 * 1024 * 1024):
+
+        self.source = source
+        self.reference = reference
+        self.shape = sitk.GetArrayViewFromImage(reference).shape
+
+        index_map = None
+        cache_path = None
+        if use_cache:
+            if cache_dir is None:
+                cache_dir = os.path.join(default_cache_dir(), 'nn_index')
+            key = json.dumps([_geometry_key(source),
+                              _geometry_key(reference)])
+            cache_path = os.path.join(
+                cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.npy')
+            try:
+                index_map = np.load(cache_path)
+            except (OSError, ValueError):
+                index_map = None
+            if index_map is not None \
+                    and index_map.size != int(np.prod(self.shape)):
+                index_map = None
+            if index_map is not None:
+                # Mark the map as recently used
+                try:
+                    os.utime(cache_path)
+                except OSError:
+                    pass
+
+        if index_map is None:
+            index_map = self._compute_index_map()
+            if cache_path is not None:
+                # Write the index map to a temporary file first, so that other
+                # processes never read a partially written file
+                tmp_path = cache_path + '.' + str(os.getpid()) + '.tmp.npy'
+                try:
+                    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                    np.save(tmp_path, index_map)
+                    os.replace(tmp_path, cache_path)
+                except OSError:
+                    pass
+                _evict_cache_files(os.path.dirname(cache_path), cache_size)
+
+        # Voxels outside the source image take the value 0. They are pointed
+        # to an extra voxel appended to the source voxels, so that each image
+        # is resampled with a single gather.
+        self._n_source = int(np.prod(sitk.GetArrayViewFromImage(source).shape))
+        self._index = np.where(index_map >= 0, index_map,
+                               self._n_source).astype(np.intp)
+
+    def _compute_index_map(self) -> npt.NDArray[np.int64]:
+        """Computes the index map by resampling an image of voxel indices."""
+
+        shape = sitk.GetArrayViewFromImage(self.source).shape
+        n_voxels = int(np.prod(shape))
+        index_img = sitk.GetImageFromArray(
+            np.arange(n_voxels, dtype=np.int64).reshape(shape))
+        index_img.CopyInformation(self.source)
+        index_img = sitk.Resample(index_img, self.reference, sitk.Transform(),
+                                  sitk.sitkNearestNeighbor, -1.0,
+                                  sitk.sitkInt64)
+        index_map: npt.NDArray[np.int64] = \
+            sitk.GetArrayFromImage(index_img).ravel()
+
+        # Store the map compactly if possible
+        if n_voxels < np.iinfo(np.int32).max:
+            return index_map.astype(np.int32)
+        return index_map
+
+    def execute(self, img: Union[sitk.Image, npt.NDArray[Any]]) \
+            -> sitk.Image:
+        """Resamples an image to the reference space. The pixel type of the
+        image is kept.
+
+        Arguments:
+        img --  The image. It must have the source geometry. It can also be
+                given as an array of voxel values (in the source geometry).
+
+        Return value:
+        The resampled image.
+        """
+
+        if isinstance(img, sitk.Image) \
+                and not _same_geometry(img, self.source):
+            raise ValueError("The image does not have the geometry of the "
+                             "resampler source.")
+        arr = _image_array(img)
+        if arr.shape != sitk.GetArrayViewFromImage(self.source).shape:
+            raise ValueError("The image does not have the size of the "
+                             "resampler source.")
+        flat = arr.ravel()
+        extended = np.zeros(self._n_source + 1, dtype=flat.dtype)
+        extended[:self._n_source] = flat
+        res = sitk.GetImageFromArray(
+            np.take(extended, self._index).reshape(self.shape))
+        res.CopyInformation(self.reference)
+        return res
+
+
+def resample_series_to_reference(series: Sequence[sitk.Image],
+                                 ref: sitk.Image,
+                                 use_cache: bool = False,
+                                 cache_dir: Optional[str] = None) \
+        -> list[sitk.Image]:
     """Resample each image in an image series to the same physical space as
     a reference image. The pixel values in the resampled images will be
     interpolated according to the nearest-neighbour principle.
+    The series can also be a DynamicSeries.
 
     Arguments:
-    series  --  The image series.
-    ref     --  The reference image.
+    series      --  The image series.
+    ref         --  The reference image.
+    use_cache   --  Whether to cache the voxel mapping on disk (see
+                    NearestNeighbourResampler, default False).
+    cache_dir   --  The folder of the cached voxel mappings. Optional.
 
     Return value:
     A list containing each resampled image in the same order.
     """
 
+    # The images of a DynamicSeries all have the geometry of the series
+    if isinstance(series, DynamicSeries):
+        nn_resampler = NearestNeighbourResampler(
+            _geometry_image(series.geometry), ref, use_cache=use_cache,
+            cache_dir=cache_dir)
+        return [nn_resampler.execute(img) for img in series]
+
+    # Fast path: all images have the same geometry, so the voxel mapping is
+    # computed once (see NearestNeighbourResampler)
+    if len(series) > 0 \
+            and series[0].GetNumberOfComponentsPerPixel() == 1 \
+            and all(_same_geometry(img, series[0]) for img in series[1:]):
+        nn_resampler = NearestNeighbourResampler(
+            series[0], ref, use_cache=use_cache, cache_dir=cache_dir)
+        return [nn_resampler.execute(img) for img in series]
+
     resampler = sitk.ResampleImageFilter()
     resampler.SetReferenceImage(ref)
     resampler.SetInterpolator(sitk.sitkNearestNeighbor)
     return [resampler.Execute(img) for img in series]
 
 
-def series_roi_means(series: list[sitk.Image],
+class LabelIndex:
+    """Precomputed index of the voxels of a ROI labelmap, used to compute the
+    mean image value in each ROI of many images.
+    The labelmap is flattened once, and the positions of the labelled
+    (nonzero) voxels are stored together with a compact index of their label.
+    The sum of the image values in each ROI is then computed with a single
+    weighted bincount over the labelled voxels of a zero-copy view of the
+    image. The background (label 0) is found as the sum over the whole image
+    minus the sums of the other labels, so the labelmap is never scanned
+    again. The result is the same as from sitk.LabelStatisticsImageFilter, but
+    with the labels in increasing order.
+    The images must have the same size as the labelmap, and are assumed to be
+    in the same physical space.
+
+    Arguments:
+    roi         --  The ROI labelmap image.
+    background  --  Whether to include the background (label 0) in the
+                    results.
+    """
+
+    def __init__(self, roi: sitk.Image, background: bool = True):
+
+        arr = sitk.GetArrayViewFromImage(roi)
+        self.shape = arr.shape
+        flat = arr.ravel()
+
+        # Labelled voxels and the compact index of their label
+        self._voxels = np.flatnonzero(flat)
+        labels, inverse, counts = np.unique(flat[self._voxels],
+                                            return_inverse=True,
+                                            return_counts=True)
+        self._inverse = inverse.astype(np.intp).ravel()
+
+        # Put the background first if there are any background voxels
+        n_background = flat.size - len(self._voxels)
+        self._background = background and n_background > 0
+        if self._background:
+            labels = np.concatenate(([0], labels))
+            counts = np.concatenate(([n_background], counts))
+        self.labels: list[int] = [int(label) for label in labels]
+        self.counts: npt.NDArray[np.int64] = counts.astype(np.int64)
+
+    def sums(self, img: Union[sitk.Image, npt.NDArray[Any]]) \
+            -> npt.NDArray[np.float64]:
+        """Compute the sum of the image values in each ROI.
+
+        Arguments:
+        img --  The image (a SimpleITK Image or an array of voxel values).
+
+        Return value:
+        An array with the sum in each ROI in the order of the attribute
+        labels.
+        """
+
+        arr = _image_array(img)
+        if arr.shape != self.shape:
+            raise ValueError("The image and the ROI labelmap must have the "
+                             "same size.")
+        flat = arr.ravel()
+
+        sums = np.bincount(self._inverse, weights=flat[self._voxels],
+                           minlength=len(self.labels) - self._background)
+        if self._background:
+            total = np.sum(flat, dtype=np.float64)
+            sums = np.concatenate(([total - np.sum(sums)], sums))
+        res: npt.NDArray[np.float64] = sums.astype(np.float64, copy=False)
+        return res
+
+    def means(self, img: Union[sitk.Image, npt.NDArray[Any]]) \
+            -> dict[int, float]:
+        """Compute the mean image value in each ROI.
+
+        Arguments:
+        img --  The image (a SimpleITK Image or an array of voxel values).
+
+        Return value:
+        A dict object with the ROI labels as keys and the ROI mean values as
+        values.
+        """
+
+        means = self.sums(img) / self.counts
+        return {label: float(mean) for label, mean in zip(self.labels, means)}
+
+
+def _same_geometry(img1: sitk.Image, img2: sitk.Image) -> bool:
+    """Checks if two images have the same size, origin, spacing and
+    direction.
+    """
+
+    return img1.GetSize() == img2.GetSize() \
+        and np.allclose(img1.GetOrigin(), img2.GetOrigin()) \
+        and np.allclose(img1.GetSpacing(), img2.GetSpacing()) \
+        and np.allclose(img1.GetDirection(), img2.GetDirection())
+
+
+class RoiWeights:
+    """A set of ROIs stored as a sparse ROI-by-voxel weight matrix. Each ROI
+    is a row of the matrix, and the mean image value in a ROI is the weighted
+    mean of the voxel values with the weights in the row. This allows
+    overlapping ROIs (e.g. the cortex and the whole kidney) and fractional
+    ROIs (e.g. partial-volume or probability maps), which cannot be stored in
+    a single labelmap.
+    The ROIs are added from labelmaps (each nonzero label becomes a ROI with
+    weight 1 in its voxels) or from weight maps (the voxel values are the
+    weights). All ROIs are defined in the space of a reference image, and ROI
+    images in another space are resampled to it (nearest-neighbour for
+    labelmaps and linear for weight maps).
+    Only the voxels with a nonzero weight in some ROI are read from each
+    image, and the means of all ROIs in all images are computed with one
+    sparse matrix product over the stacked images.
+
+    Arguments:
+    reference   --  The image defining the space of the ROIs.
+    """
+
+    def __init__(self, reference: sitk.Image):
+
+        self.reference = reference
+        self.shape = sitk.GetArrayViewFromImage(reference).shape
+        self.names: list[str] = []
+        self._rows: list[Any] = []
+        self._sources: list[tuple[str, sitk.Image, Any]] = []
+        self._matrix: Optional[tuple[Any, npt.NDArray[np.intp],
+                                     npt.NDArray[np.float64]]] = None
+
+    def _resample(self, img: sitk.Image, interpolator: int,
+                  pixel_type: int) -> sitk.Image:
+        """Resamples an image to the reference space, if it is not already in
+        the reference space.
+        """
+
+        if _same_geometry(img, self.reference):
+            return img
+        return sitk.Resample(img, self.reference, sitk.Transform(),
+                             interpolator, 0.0, pixel_type)
+
+    def _add_row(self, name: str, voxels: npt.NDArray[np.intp],
+                 weights: npt.NDArray[np.float64]):
+        """Adds a ROI with the given weights in the given (flat) voxels."""
+
+        if name in self.names:
+            raise ValueError("A ROI with the name " + name + " already "
+                             "exists.")
+        n_voxels = int(np.prod(self.shape))
+        self._rows.append(scipy.sparse.csr_matrix(
+            (weights, (np.zeros(len(voxels), dtype=np.intp), voxels)),
+            shape=(1, n_voxels)))
+        self.names.append(name)
+        self._matrix = None
+
+    def add_labelmap(self, roi: sitk.Image,
+                     labels: Optional[dict[str, str]] = None):
+        """Adds a ROI for each nonzero label of a labelmap.
+
+        Arguments:
+        roi     --  The ROI labelmap image.
+        labels  --  Names of the ROIs. By default the label value is used as
+                    the name of each ROI. A dictionary can be inserted here to
+                    replace those names (see lazy_series_roi_means).
+        """
+
+        if labels is None:
+            labels = {}
+        self._sources.append(('labelmap', roi, labels))
+
+        roi = self._resample(roi, sitk.sitkNearestNeighbor, roi.GetPixelID())
+        flat = sitk.GetArrayViewFromImage(roi).ravel()
+        voxels = np.flatnonzero(flat)
+        values = flat[voxels]
+        for label in np.unique(values):
+            name = labels.get(str(label), str(label))
+            self._add_row(name, voxels[values == label],
+                          np.ones(np.count_nonzero(values == label)))
+
+    def add_weight_map(self, weight_map: sitk.Image, name: str):
+        """Adds a ROI with the voxel values of an image as weights.
+
+        Arguments:
+        weight_map  --  The image with the voxel weights (e.g. a probability
+                        map).
+        name        --  The name of the ROI.
+        """
+
+        self._sources.append(('weight_map', weight_map, name))
+
+        weight_map = self._resample(weight_map, sitk.sitkLinear,
+                                    sitk.sitkFloat64)
+        flat = sitk.GetArrayViewFromImage(weight_map).ravel()
+        voxels = np.flatnonzero(flat)
+        self._add_row(name, voxels, flat[voxels].astype(np.float64))
+
+    def resampled(self, reference: sitk.Image) -> 'RoiWeights':
+        """Creates the same set of ROIs in the space of another reference
+        image, by resampling the ROI images they were created from.
+
+        Arguments:
+        reference   --  The image defining the new space of the ROIs.
+
+        Return value:
+        The new set of ROIs.
+        """
+
+        res = RoiWeights(reference)
+        for kind, img, arg in self._sources:
+            if kind == 'labelmap':
+                res.add_labelmap(img, arg)
+            else:
+                res.add_weight_map(img, arg)
+        return res
+
+    def _weights(self) -> tuple[Any, npt.NDArray[np.intp],
+                                npt.NDArray[np.float64]]:
+        """The weight matrix restricted to the voxels with a nonzero weight,
+        the (flat) positions of those voxels, and the total weight of each
+        ROI.
+        """
+
+        if self._matrix is None:
+            n_voxels = int(np.prod(self.shape))
+            if self._rows:
+                matrix = scipy.sparse.vstack(self._rows, format='csr')
+            else:
+                matrix = scipy.sparse.csr_matrix((0, n_voxels))
+            support = np.unique(matrix.indices).astype(np.intp)
+            total = np.asarray(matrix.sum(axis=1), dtype=np.float64).ravel()
+            self._matrix = (matrix[:, support].tocsr(), support, total)
+        return self._matrix
+
+    def voxels(self) -> npt.NDArray[np.intp]:
+        """The (flat) positions of the voxels with a nonzero weight in some
+        ROI.
+        """
+
+        return self._weights()[1]
+
+    def gather(self, img: Union[sitk.Image, npt.NDArray[Any]]) \
+            -> npt.NDArray[np.float64]:
+        """Reads the values of the voxels with a nonzero weight in some ROI
+        from an image.
+
+        Arguments:
+        img --  The image (a SimpleITK Image or an array of voxel values). It
+                must be in the reference space.
+
+        Return value:
+        An array with the voxel values.
+        """
+
+        arr = _image_array(img)
+        if arr.shape != self.shape:
+            raise ValueError("The image and the ROIs must have the same "
+                             "size.")
+        values = arr.ravel()[self.voxels()]
+        res: npt.NDArray[np.float64] = values.astype(np.float64)
+        return res
+
+    def means_from_values(self, values: Iterable[npt.NDArray[np.float64]]) \
+            -> dict[str, list[float]]:
+        """Computes the ROI means of a series of images from the voxel values
+        read with gather.
+
+        Arguments:
+        values  --  The voxel values of each image (from gather).
+
+        Return value:
+        A dict object with the ROI names as keys and a list with the ROI mean
+        values for every image as values.
+        """
+
+        matrix, support, total = self._weights()
+        columns = list(values)
+        if columns:
+            stacked = np.column_stack(columns)
+        else:
+            stacked = np.zeros((len(support), 0))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = (matrix @ stacked) / total[:, None]
+        return {name: [float(mean) for mean in row]
+                for name, row in zip(self.names, means)}
+
+    def series_means(self,
+                     series: Iterable[Union[sitk.Image, npt.NDArray[Any]]]) \
+            -> dict[str, list[float]]:
+        """Computes the mean image value in each ROI for every image in a
+        series.
+
+        Arguments:
+        series  --  The image series. The images must be in the reference
+                    space.
+
+        Return value:
+        A dict object with the ROI names as keys and a list with the ROI mean
+        values for every image as values.
+        """
+
+        return self.means_from_values(self.gather(img) for img in series)
+
+
+def series_roi_means(series: Union[Sequence[sitk.Image], npt.NDArray[Any],
+                                   DynamicSeries],
                      roi: sitk.Image) -> dict[int, list[float]]:
     """Compute mean image values in a ROI set.
     This function computes the mean image values in a given ROI for every time
     point in the dynamic series.
     The ROI and image should be in the same physical space. The ROI is treated
     as a labelmap with each label value being treated as a seperate ROI.
+    The series can also be given as a 4D array with one image per row (e.g.
+    the 'data' of a memory-mapped series, see load_series_memmap), in which
+    case the images are used without copying, or as a DynamicSeries, in which
+    case the ROI sums are computed from the stored pixel values and rescaled
+    afterwards.
 
     Arguments:
     dyn --  The dynamic image series of interes
@@ -83,47 +1185,436 @@ def series_roi_means(series: list[sitk.Image],
 
     res = defaultdict(list)
 
-    # Get the number of time points in the dynamic series
-    n_frames = len(series)
-
-    label_stats_filter = sitk.LabelStatisticsImageFilter()
+    # Index the ROI labelmap once for all images
+    label_index = LabelIndex(roi)
 
-    for i in range(n_frames):
+    if isinstance(series, DynamicSeries):
+        for i in range(len(series)):
+            arr, slope, intercept = series.raw(i)
+            means = label_index.sums(arr) * slope / label_index.counts
+            for label, mean in zip(label_index.labels, means + intercept):
+                res[label].append(float(mean))
+        return res
 
-        # Get label stats for the i'th image in the series for all labels
-        label_stats_filter.Execute(series[i], roi)
+    for img in series:
 
-        for label in label_stats_filter.GetLabels():
+        # Get the ROI means for the image for all labels
+        for label, mean in label_index.means(img).items():
             # Append the mean value to the list for each label.
-            res[label].append(label_stats_filter.GetMean(label))
+            res[label].append(mean)
 
     return res
 
 
+def _bounding_box(mask: npt.NDArray[np.bool_]) \
+        -> Optional[tuple[list[int], list[int]]]:
+    """Finds the bounding box of the nonzero voxels of a mask array (in the
+    numpy axis order z, y, x).
+
+    Return value:
+    A tuple with the index and the size of the bounding box in the SimpleITK
+    axis order (x, y, z), or None if the mask is empty.
+    """
+
+    index = []
+    size = []
+    for axis in range(mask.ndim):
+        # Project the mask onto the axis
+        others = tuple(i for i in range(mask.ndim) if i != axis)
+        nonzero = np.flatnonzero(np.any(mask, axis=others))
+        if len(nonzero) == 0:
+            return None
+        index.append(int(nonzero[0]))
+        size.append(int(nonzero[-1] - nonzero[0] + 1))
+    return index[::-1], size[::-1]
+
+
+def _covering_region(img: sitk.Image, geometry: dict[str, Any]) \
+        -> tuple[list[int], list[int]]:
+    """Finds the region of the images of a dynamic series (with the geometry
+    from scan_dynamic_series) that covers the physical extent of an image.
+    The region has a margin of one voxel, so that it contains all the voxels
+    used when the images are resampled to the image with nearest-neighbour
+    interpolation. The region is clipped to the images of the series.
+
+    Return value:
+    A tuple with the index and the size of the region.
+    """
+
+    ref = _geometry_image(geometry)
+    size = img.GetSize()
+
+    # Map the corners of the image onto the series image grid
+    corners = []
+    for corner in np.ndindex(*([2] * img.GetDimension())):
+        cont_index = [-0.5 + c * n for c, n in zip(corner, size)]
+        point = img.TransformContinuousIndexToPhysicalPoint(cont_index)
+        corners.append(ref.TransformPhysicalPointToContinuousIndex(point))
+    lower = np.floor(np.min(corners, axis=0)).astype(int) - 1
+    upper = np.ceil(np.max(corners, axis=0)).astype(int) + 1
+    lower = np.maximum(lower, 0)
+    upper = np.minimum(upper, np.array(geometry['size']) - 1)
+    return [int(i) for i in lower], [int(n) for n in upper - lower + 1]
+
+
+def _read_frame(name: str,
+                region: Optional[tuple[list[int], list[int]]]) -> sitk.Image:
+    """Reads an image, or only a region of it given as a tuple with the index
+    and the size of the region.
+    """
+
+    if region is None:
+        return sitk.ReadImage(name)
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(name)
+    reader.SetExtractIndex(region[0])
+    reader.SetExtractSize(region[1])
+    img: sitk.Image = reader.Execute()
+    return img
+
+
+def _memmap_frame(data: npt.NDArray[Any],
+                  i: int,
+                  region: Optional[tuple[list[int], list[int]]]) \
+        -> npt.NDArray[Any]:
+    """Reads an image of a memory-mapped series as a (zero-copy) array, or
+    only a region of it given as a tuple with the index and the size of the
+    region.
+    """
+
+    frame: npt.NDArray[Any] = data[i]
+    if region is None:
+        return frame
+    index, size = region
+    crop: npt.NDArray[Any] = frame[tuple(
+        slice(j, j + n) for j, n in zip(index[::-1], size[::-1]))]
+    return crop
+
+
+def _prepare_roi_set(roi_set: dict[str, Any],
+                     geometry: dict[str, Any],
+                     use_cache: bool = False,
+                     cache_dir: Optional[str] = None) -> dict[str, Any]:
+    """Prepares a ROI set (see lazy_series_roi_set_means) for a dynamic series
+    with the given geometry (see scan_dynamic_series). The ROI is read,
+    resampled and cropped as chosen, and the label index or ROI weights and
+    the resampler of the images are created. The voxel mapping of the
+    resampler is cached on disk if chosen (see NearestNeighbourResampler).
+
+    Return value:
+    A dict object with the keys 'reduce' (the function computing the result
+    of an image), 'resampler' (the resampler of the images, or None),
+    'region' (the region of the images used, or None for the whole image),
+    'weights' (the RoiWeights object, or None for a labelmap) and 'labels'
+    (the label substitutions).
+    """
+
+    resample = roi_set.get('resample')
+    crop = roi_set.get('crop', False)
+    labels = roi_set.get('labels')
+
+    # Input sanitation: if no label substitution is needed, the argument is
+    # just an empty dict
+    if labels is None:
+        labels = {}
+
+    weights: Optional[RoiWeights] = None
+    reduce: Callable[[Any], Any]
+    if isinstance(roi_set['roi'], RoiWeights):
+        # Resample the ROIs if chosen
+        weights = roi_set['roi']
+        if resample == 'roi':
+            weights = weights.resampled(_geometry_image(geometry))
+        roi = weights.reference
+        mask = np.zeros(weights.shape, dtype=bool)
+        mask.ravel()[weights.voxels()] = True
+    else:
+        # Read ROI image
+        roi = sitk.ReadImage(roi_set['roi'])
+
+        # Resample ROI if chosen
+        if resample == 'roi':
+            roi = _geometry_resampler(geometry).Execute(roi)
+        mask = sitk.GetArrayViewFromImage(roi) != 0
+
+    # Crop the ROIs to their bounding box, and find the region of the images
+    # that must be read
+    region: Optional[tuple[list[int], list[int]]] = None
+    if crop:
+        bbox = _bounding_box(mask)
+        if bbox is None:
+            raise ValueError("The ROI has no labelled voxels.")
+        roi = sitk.RegionOfInterest(roi, bbox[1], bbox[0])
+        if weights is not None:
+            weights = weights.resampled(roi)
+        if resample == 'img':
+            region = _covering_region(roi, geometry)
+        else:
+            region = bbox
+
+    if weights is not None:
+        reduce = weights.gather
+    else:
+        # Index the ROI labelmap once for all images
+        reduce = LabelIndex(roi, background=not crop).means
+
+    # Compute the voxel mapping from the image space to the ROI space once for
+    # all images
+    resampler: Optional[NearestNeighbourResampler] = None
+    if resample == 'img':
+        source = _geometry_image(geometry)
+        if region is not None:
+            source = sitk.RegionOfInterest(source, region[1], region[0])
+        resampler = NearestNeighbourResampler(source, roi,
+                                              use_cache=use_cache,
+                                              cache_dir=cache_dir)
+
+    return {'reduce': reduce,
+            'resampler': resampler,
+            'region': region,
+            'weights': weights,
+            'labels': labels}
+
+
+def _union_region(regions: list[Optional[tuple[list[int], list[int]]]]) \
+        -> Optional[tuple[list[int], list[int]]]:
+    """The smallest region containing all the given regions (index and size).
+    If one of the regions is None (the whole image), the result is None.
+    """
+
+    if len(regions) == 0 or any(region is None for region in regions):
+        return None
+    lower = np.min([region[0] for region in regions if region is not None],
+                   axis=0)
+    upper = np.max([np.add(region[0], region[1]) for region in regions
+                    if region is not None], axis=0)
+    return [int(i) for i in lower], [int(n) for n in upper - lower]
+
+
+def _frame_roi_means(load: Callable[[], Any],
+                     region: Optional[tuple[list[int], list[int]]],
+                     roi_sets: list[dict[str, Any]]) -> list[Any]:
+    """Loads a single image of a dynamic series and computes the mean image
+    value in each ROI of each ROI set (see lazy_series_roi_set_means). This
+    is the work done for each image by the worker threads in
+    lazy_series_roi_set_means. The label indices, ROI weights and resamplers
+    are only read, so they are shared between the threads.
+
+    Arguments:
+    load        --  The function loading the image (e.g. _read_frame with
+                    the file name and region).
+    region      --  The region of the image that is loaded (index and size),
+                    or None if the whole image is loaded.
+    roi_sets    --  The prepared ROI sets (see _prepare_roi_set).
+
+    Return value:
+    A list with the result of each ROI set for the image.
+    """
+
+    # Load image
+    img = load()
+    arr = _image_array(img)
+    offset = region[0] if region is not None else [0] * arr.ndim
+
+    results = []
+    for roi_set in roi_sets:
+        # Cut out the region used by the ROI set
+        frame = arr
+        if roi_set['region'] is not None:
+            index, size = roi_set['region']
+            frame = arr[tuple(slice(j - o, j - o + n) for j, o, n
+                              in zip(index[::-1], offset[::-1], size[::-1]))]
+
+        # Resample image if chosen
+        if roi_set['resampler'] is not None:
+            frame = roi_set['resampler'].execute(frame)
+
+        # Read ROI means
+        results.append(roi_set['reduce'](frame))
+    return results
+
+
+def lazy_series_roi_set_means(series_path: str,
+                              roi_sets: list[dict[str, Any]],
+                              workers: int = 1,
+                              index_dir: Optional[str] = None,
+                              use_cache: bool = False,
+                              cache_dir: Optional[str] = None) \
+        -> list['dynamit.TAC']:
+    """Do a lazy calculation of mean image values in several ROI sets (e.g.
+    ROI files) in a single pass over the images of a dynamic series. Each
+    image is read once, and the means of all ROI sets are computed from it,
+    so the reading of the images is shared between the ROI sets (see
+    lazy_series_roi_means for the calculation for a single ROI set).
+    Each ROI set is given as a dict object with the keys:
+    'roi'       --  The path to the ROI file, or a RoiWeights object.
+    'resample'  --  The resampling strategy (None, 'roi' or 'img'). Optional.
+    'labels'    --  The label substitutions. Optional.
+    'crop'      --  Whether to only use the bounding box of the ROIs.
+                    Optional.
+    (see the arguments of lazy_series_roi_means). If all ROI sets are
+    cropped, only the smallest region containing the bounding boxes of all
+    the ROI sets is read from each image.
+
+    Arguments:
+    series_path --  The path to the images series dicom files, or the
+                    filename of a memory-mapped series or a multi-frame dicom
+                    file
+    roi_sets    --  The ROI sets.
+    workers     --  The number of worker threads loading and processing
+                    images (default 1).
+    index_dir   --  The folder where the series index is stored (see
+                    scan_dynamic_series).
+    use_cache   --  Whether to cache the voxel mapping of the images resampled
+                    to the ROI space on disk (see NearestNeighbourResampler,
+                    default False).
+    cache_dir   --  The folder of the cached voxel mappings. Optional.
+
+    Return value:
+    A list with a TAC dataset for each ROI set (in the same order as the ROI
+    sets), with the results in the same format as from
+    lazy_series_roi_means.
+    """
+
+    # Get dicom file names sorted according to acquisition time, and the
+    # acquisition times, from the series index or the file headers, or from
+    # the metadata of a memory-mapped series or a multi-frame dicom file
+    memmap: Optional[dict[str, Any]] = None
+    if os.path.isfile(series_path):
+        memmap = load_series_file(series_path)
+        scan = memmap
+    else:
+        scan = scan_dynamic_series(series_path, index_dir=index_dir)
+
+    prepared = [_prepare_roi_set(roi_set, scan['geometry'],
+                                 use_cache=use_cache, cache_dir=cache_dir)
+                for roi_set in roi_sets]
+
+    # The region of the images needed by all ROI sets
+    region = _union_region([roi_set['region'] for roi_set in prepared])
+
+    loads: list[Callable[[], Any]] = []
+    for i in range(len(scan['acq'])):
+        if memmap is not None:
+            loads.append(functools.partial(_memmap_frame, memmap['data'], i,
+                                           region))
+        else:
+            loads.append(functools.partial(_read_frame, scan['files'][i],
+                                           region))
+
+    return _roi_set_means_of_frames(loads, scan['acq'], prepared, region,
+                                    workers)
+
+
+def _roi_set_means_of_frames(loads: list[Callable[[], Any]],
+                             acq: list[float],
+                             prepared: list[dict[str, Any]],
+                             region: Optional[tuple[list[int], list[int]]],
+                             workers: int) -> list['dynamit.TAC']:
+    """Computes the mean image values in the prepared ROI sets (see
+    _prepare_roi_set) for a list of images. This is the pass over the images
+    of lazy_series_roi_set_means.
+
+    Arguments:
+    loads       --  The functions loading each image.
+    acq         --  The acquisition time of each image.
+    prepared    --  The prepared ROI sets.
+    region      --  The region of the images that is loaded, or None.
+    workers     --  The number of worker threads.
+
+    Return value:
+    A list with a TAC dataset for each ROI set (see
+    lazy_series_roi_set_means).
+    """
+
+    res: list[dict[str, list[float]]] = []
+    values: list[list[npt.NDArray[np.float64]]] = []
+    for _ in prepared:
+        res_set: dict[str, list[float]] = defaultdict(list)
+        res_set['tacq'] = list(acq)
+        res.append(res_set)
+        values.append([])
+
+    def collect(frame: list[Any]):
+        for k, roi_set in enumerate(prepared):
+            if roi_set['weights'] is not None:
+                # Keep the voxel values for the matrix product over all
+                # images
+                values[k].append(frame[k])
+                continue
+            labels = roi_set['labels']
+            for label, mean in frame[k].items():
+                # Append the mean value to the list for each label.
+                res[k][labels.get(str(label), str(label))].append(mean)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as ex:
+        # Submit images in order, but never more than two per worker ahead of
+        # the image currently being collected.
+        pending: deque[concurrent.futures.Future[list[Any]]] = deque()
+        for load in loads:
+            pending.append(ex.submit(_frame_roi_means, load, region,
+                                     prepared))
+            if len(pending) >= 2 * workers:
+                collect(pending.popleft().result())
+        while pending:
+            collect(pending.popleft().result())
+
+    # Compute the means of all ROIs in all images at once
+    for k, roi_set in enumerate(prepared):
+        if roi_set['weights'] is not None:
+            res[k].update(roi_set['weights'].means_from_values(values[k]))
+
+    return [dynamit.TAC.from_dict(res_set) for res_set in res]
+
+
 def lazy_series_roi_means(series_path: str,
-                          roi_path: str,
+                          roi_path: Union[str, RoiWeights],
                           resample: Optional[str] = None,
-                          labels: Optional[dict[str, str]] = None)\
-        -> dict[str, list[float]]:
+                          labels: Optional[dict[str, str]] = None,
+                          workers: int = 1,
+                          index_dir: Optional[str] = None,
+                          crop: bool = False,
+                          use_cache: bool = False,
+                          cache_dir: Optional[str] = None)\
+        -> 'dynamit.TAC':
     """Do a lazy calculation of mean image values in a ROI. Lazy in this
     context means that the images are loaded one at a time and the mean values
     computed, before the image is removed from memory and the next image is
     loaded. This saves some memory usage compared to loading all images in a
     list and then computing ROI-means, but on the other hand no manipulation
     of the images can be performed after the call of this function.
+    The images can be loaded and processed by several worker threads at once.
+    At most two images per worker are loaded ahead of the image currently
+    being collected, so the memory usage stays bounded, and the results are
+    always collected in order of acquisition.
     The images or the ROI can be resampled before calculation of the mean by
     using the resample argument. To resample the ROI to the sace of the images
     set resample='roi', and to resample the images to the ROI space use
     resample='img'. In either case the resampling is done using
-    nearest-neighbour values.
-    The function returns a dictionary object. They keys in the object are
-    'tacq' which stores a list of acquisition times (relative to the first
-    image) and the labels of the ROI (integers) (see the keyword argument
-    'labels' for options).
+    nearest-neighbour values. When the images are resampled, the voxel
+    mapping is computed once for all images (see NearestNeighbourResampler).
+    The function returns a TAC dataset, which behaves as a dictionary object.
+    They keys in the object are 'tacq' which stores the acquisition times
+    (relative to the first image) and the labels of the ROI (integers) (see
+    the keyword argument 'labels' for options).
+    Instead of a ROI labelmap, a set of overlapping or fractional ROIs can be
+    given as a RoiWeights object. The ROI names of the object are then used as
+    the keys, and the labels argument is not used.
+    The series can also be a memory-mapped series (see save_series_memmap),
+    which is then used without decoding the dicom files. The images are read
+    directly from the memory-mapped array. Likewise, the series can be a
+    single multi-frame dicom file (see load_multiframe_series), which is
+    decoded once.
+    With crop=True only the bounding box of the ROIs is read from each image,
+    so the reading and the computations scale with the size of the ROIs and
+    not with the size of the images. The background (label 0) is then not
+    included in the result, since it covers the rest of the image.
 
     Arguments:
-    series_path --  The path to the images series dicom files
-    roi_path    --  The path to the ROI dicom files
+    series_path --  The path to the images series dicom files, or the
+                    filename of a memory-mapped series or a multi-frame dicom
+                    file
+    roi_path    --  The path to the ROI dicom files, or a RoiWeights object
     resample    --  The resmapling strategy. Allowed values are None (no
                     resampling, default value), 'roi' (resample ROI to image
                     space) or 'img' (resample images to ROI space).
@@ -133,62 +1624,287 @@ def lazy_series_roi_means(series_path: str,
                     for example the ROI label value '1' should be replaced with
                     'left' and the value '2' should be replaced with 'right'
                     use the argument labels={'1': 'left', '2': 'right'}.
+    workers     --  The number of worker threads loading and processing
+                    images (default 1).
+    index_dir   --  The folder where the series index is stored (see
+                    scan_dynamic_series).
+    crop        --  Whether to only read the bounding box of the ROIs from
+                    each image (default False).
+    use_cache   --  Whether to cache the voxel mapping of the images resampled
+                    with resample='img' on disk, so that it is reused by later
+                    calls with the same geometries (see
+                    NearestNeighbourResampler, default False).
+    cache_dir   --  The folder of the cached voxel mappings. Optional.
+
+    To compute the means of several ROI files in a single pass over the
+    images, use lazy_series_roi_set_means.
 
     Return value:
-    A dict object with ROI labels as keys and a list with ROI mean values for
-    every time point in the dynamic series as values. Furthermore the
-    acquisition times are stored in a list under the key 'tacq'.
+    A TAC dataset (see dynamit.TAC) with ROI labels as keys and the ROI mean
+    values for every time point in the dynamic series as values. Furthermore
+    the acquisition times are stored under the key 'tacq'.
     """
 
-    # Input sanitation: if no label substitution is needed, the argument is
-    # just an empty dict
-    if labels is None:
-        labels = {}
+    return lazy_series_roi_set_means(
+        series_path,
+        [{'roi': roi_path, 'resample': resample, 'labels': labels,
+          'crop': crop}],
+        workers=workers, index_dir=index_dir, use_cache=use_cache,
+        cache_dir=cache_dir)[0]
 
-    res: dict[str, list[float]] = defaultdict(list)
 
-    # Prepare series reader
-    reader = sitk.ImageSeriesReader()
+_ROI_MANIFEST_VERSION = 1
 
-    # Get dicom file names in folder sorted according to acquisition time.
-    dcm_names = reader.GetGDCMSeriesFileNames(series_path)
 
-    # Read ROI image
-    roi = sitk.ReadImage(roi_path)
+class _FrameReadError(Exception):
+    """Raised when the pixel data of an image of an incrementally processed
+    series cannot be read (see incremental_series_roi_means). The attribute
+    index is the position of the image among the new images.
+    """
 
-    # Resample ROI if chosen
-    if resample == 'roi':
-        resampler = sitk.ResampleImageFilter()
-        resampler.SetReferenceImage(sitk.ReadImage(dcm_names[0]))
-        resampler.SetInterpolator(sitk.sitkNearestNeighbor)
-        roi = resampler.Execute(roi)
+    def __init__(self, index: int):
+        super().__init__(index)
+        self.index = index
 
-    # Prepare label statistics filter
-    label_stats_filter = sitk.LabelStatisticsImageFilter()
 
-    # Get acquisition time of first image
-    acq0 = dynamit.get_acq_datetime(dcm_names[0])
+def _read_new_frame(index: int,
+                    name: str,
+                    region: Optional[tuple[list[int], list[int]]]) \
+        -> sitk.Image:
+    """Reads an image (see _read_frame), raising a _FrameReadError if it
+    cannot be read.
+    """
 
-    for name in dcm_names:
-        # Load images in order
-        img = sitk.ReadImage(name)
+    try:
+        return _read_frame(name, region)
+    except RuntimeError as e:
+        raise _FrameReadError(index) from e
 
-        # Resample image if chosen
-        if resample == 'img':
-            resampler = sitk.ResampleImageFilter()
-            resampler.SetReferenceImage(roi)
-            resampler.SetInterpolator(sitk.sitkNearestNeighbor)
-            img = resampler.Execute(img)
-
-        # Find acquisition time and store in list
-        res['tacq'].append(
-            (dynamit.get_acq_datetime(name) - acq0).total_seconds())
-
-        # Apply label stats filter and read ROI means
-        label_stats_filter.Execute(img, roi)
-        for label in label_stats_filter.GetLabels():
-            # Append the mean value to the list for each label.
-            res[labels.get(str(label), str(label))].append(
-                label_stats_filter.GetMean(label))
 
-    return res
+def _roi_manifest_path(out_path: str) -> str:
+    """The path of the manifest of an incrementally computed TAC-file (see
+    incremental_series_roi_means).
+    """
+
+    return out_path + '.manifest.json'
+
+
+def _new_series_frames(dicom_path: str,
+                       known: set[str],
+                       series_uid: Optional[str]) -> list[dict[str, Any]]:
+    """Reads the headers of the dicom files in a folder that are not among the
+    known file names. Files that cannot be read (e.g. files that are not
+    dicom files or that are still being written) and files of other series
+    than series_uid are skipped. If series_uid is None, the series of the
+    earliest file is used.
+
+    Return value:
+    A list with a dict object for each new file with the keys 'name' (the
+    file name), 'path', 'acq' (the acquisition datetime), 'uid' and
+    'geometry', sorted according to acquisition time.
+    """
+
+    reader = sitk.ImageFileReader()
+    frames: list[dict[str, Any]] = []
+    with os.scandir(dicom_path) as it:
+        names = sorted(entry.name for entry in it
+                       if entry.is_file() and entry.name not in known)
+    for name in names:
+        path = os.path.join(dicom_path, name)
+        try:
+            reader.SetFileName(path)
+            reader.ReadImageInformation()
+            acq = dynamit.parse_acq_datetime(reader.GetMetaData('0008|0022'),
+                                             reader.GetMetaData('0008|0032'))
+        except (RuntimeError, ValueError, IndexError):
+            continue
+        uid = reader.GetMetaData('0020|000e') \
+            if reader.HasMetaDataKey('0020|000e') else ''
+        frames.append({'name': name, 'path': path, 'acq': acq, 'uid': uid,
+                       'geometry': {'size': reader.GetSize(),
+                                    'spacing': reader.GetSpacing(),
+                                    'origin': reader.GetOrigin(),
+                                    'direction': reader.GetDirection()}})
+
+    frames.sort(key=lambda frame: frame['acq'])
+    if series_uid is None and len(frames) > 0:
+        series_uid = frames[0]['uid']
+    return [frame for frame in frames if frame['uid'] == series_uid]
+
+
+def incremental_series_roi_means(series_path: str,
+                                 roi_path: str,
+                                 out_path: str,
+                                 resample: Optional[str] = None,
+                                 labels: Optional[dict[str, str]] = None,
+                                 workers: int = 1,
+                                 crop: bool = False) -> int:
+    """Calculates the mean image values in a ROI (see lazy_series_roi_means)
+    for a dynamic series that is still being acquired, and saves the result
+    to a TAC-file (see save_tac). Next to the TAC-file a manifest is kept
+    with the names of the dicom files already processed. On later calls only
+    the files not in the manifest are read, and their rows are appended to
+    the TAC-file, so the cost of each call only depends on the number of new
+    images.
+    The TAC-file is computed from scratch if there is no valid manifest, if
+    the ROI file or any of the arguments have changed since the manifest was
+    written, if the TAC-file has been changed by something else, or if a new
+    image was acquired before the last processed image.
+    Files that cannot be read yet (e.g. because they are still being written)
+    are skipped until a later call, and so are the images acquired after
+    them, since the rows are appended in order of acquisition. The
+    acquisition times are relative to the first image of the series.
+
+    Arguments:
+    series_path --  The path to the images series dicom files.
+    roi_path    --  The path to the ROI file.
+    out_path    --  The filename of the TAC-file. The manifest is saved with
+                    the suffix '.manifest.json'.
+    resample    --  The resampling strategy (see lazy_series_roi_means).
+    labels      --  The label substitutions (see lazy_series_roi_means).
+    workers     --  The number of worker threads loading and processing
+                    images (default 1).
+    crop        --  Whether to only read the bounding box of the ROIs from
+                    each image (default False).
+
+    Return value:
+    The number of new images processed.
+    """
+
+    manifest_path = _roi_manifest_path(out_path)
+    roi_stat = os.stat(roi_path)
+    settings = {'series_path': os.path.abspath(series_path),
+                'roi_path': os.path.abspath(roi_path),
+                'roi_stat': [roi_stat.st_mtime_ns, roi_stat.st_size],
+                'resample': resample,
+                'labels': labels,
+                'crop': crop}
+
+    # Use the manifest if it belongs to the same calculation and the TAC-file
+    # has not been changed since it was written
+    manifest: Optional[dict[str, Any]] = None
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest is None or manifest['version'] != _ROI_MANIFEST_VERSION \
+                or manifest['settings'] != settings \
+                or manifest['tac_size'] != os.path.getsize(out_path):
+            manifest = None
+    except (OSError, ValueError, KeyError, TypeError):
+        manifest = None
+
+    if manifest is not None:
+        frames = _new_series_frames(series_path, set(manifest['files']),
+                                    manifest['series_uid'])
+        acq0 = datetime.fromisoformat(manifest['acq0'])
+        last = datetime.fromisoformat(manifest['last'])
+        if len(frames) > 0 and frames[0]['acq'] < last:
+            # An image was acquired before the last processed image, so the
+            # rows cannot simply be appended
+            manifest = None
+    if manifest is None:
+        frames = _new_series_frames(series_path, set(), None)
+        if len(frames) == 0:
+            return 0
+        acq0 = frames[0]['acq']
+    if len(frames) == 0:
+        return 0
+
+    # Compute the ROI means of the new images only
+    prepared = [_prepare_roi_set({'roi': roi_path, 'resample': resample,
+                                  'labels': labels, 'crop': crop},
+                                 frames[0]['geometry'])]
+    region = prepared[0]['region']
+    while True:
+        loads: list[Callable[[], Any]] = [
+            functools.partial(_read_new_frame, i, frame['path'], region)
+            for i, frame in enumerate(frames)]
+        acq = [(frame['acq'] - acq0).total_seconds() for frame in frames]
+        try:
+            tac = _roi_set_means_of_frames(loads, acq, prepared, region,
+                                           workers)[0]
+            break
+        except _FrameReadError as e:
+            # The pixel data of the image is not completely written yet. The
+            # rows are appended in order of acquisition, so the image and
+            # the later images are left for a later call.
+            frames = frames[:e.index]
+            if len(frames) == 0:
+                return 0
+
+    if manifest is None:
+        dynamit.save_tac(tac, out_path)
+        manifest = {'version': _ROI_MANIFEST_VERSION,
+                    'settings': settings,
+                    'series_uid': frames[0]['uid'],
+                    'acq0': acq0.isoformat(),
+                    'columns': list(tac),
+                    'files': []}
+    else:
+        # Append the new rows in the same format as save_tac
+        if sorted(tac) != sorted(manifest['columns']):
+            raise ValueError("The ROI labels of the new images do not match "
+                             "the TAC-file.")
+        data = np.column_stack([tac[col] for col in manifest['columns']])
+        with open(out_path, 'a') as f:
+            np.savetxt(f, data)
+    manifest['files'] += [frame['name'] for frame in frames]
+    manifest['last'] = frames[-1]['acq'].isoformat()
+    manifest['tac_size'] = os.path.getsize(out_path)
+
+    # Write the manifest to a temporary file first, so that it is never
+    # partially written
+    tmp_path = manifest_path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+    return len(frames)
+
+
+def watch_series_roi_means(series_path: str,
+                           roi_path: str,
+                           out_path: str,
+                           resample: Optional[str] = None,
+                           labels: Optional[dict[str, str]] = None,
+                           workers: int = 1,
+                           crop: bool = False,
+                           interval: float = 5.0,
+                           timeout: float = 60.0) -> int:
+    """Watches the folder of a dynamic series that is being acquired, and
+    appends a row to a TAC-file for every new image (see
+    incremental_series_roi_means). The folder is polled every interval
+    seconds, and the watch stops when no new images have arrived for timeout
+    seconds.
+
+    Arguments:
+    series_path --  The path to the images series dicom files.
+    roi_path    --  The path to the ROI file.
+    out_path    --  The filename of the TAC-file.
+    resample    --  The resampling strategy (see lazy_series_roi_means).
+    labels      --  The label substitutions (see lazy_series_roi_means).
+    workers     --  The number of worker threads loading and processing
+                    images (default 1).
+    crop        --  Whether to only read the bounding box of the ROIs from
+                    each image (default False).
+    interval    --  The time between polls of the folder in seconds.
+    timeout     --  The time without new images in seconds before the watch
+                    stops.
+
+    Return value:
+    The total number of new images processed.
+    """
+
+    total = 0
+    last_new = time.monotonic()
+    while True:
+        n = incremental_series_roi_means(series_path, roi_path, out_path,
+                                         resample=resample, labels=labels,
+                                         workers=workers, crop=crop)
+        total += n
+        now = time.monotonic()
+        if n > 0:
+            last_new = now
+        elif now - last_new >= timeout:
+            return total
+        time.sleep(interval)
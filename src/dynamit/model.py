@@ -1,51 +1,119 @@
+import functools
+from typing import Callable
+
 import numpy as np
+import numpy.typing as npt
 import scipy
 
 
-def _model_step_integrand(tau: float, t: float, amp: float, extent: float,
-                          tp: list[float], in_func: list[float]) -> float:
-    """Defines the integrand when the input response is a step function.
-    The response function is defined on the domain [0, infinty). It has value
-    amp on the interval [0, extent), and value 0 on the interval
-    [extent, infinity).
-    The integrand is the product of the response function evaluated at t-tau
-    and the input function evaluated at tau. The input function is interpolated
-    linearly between the sampled points.
+def _input_antiderivative(x: npt.ArrayLike, tp: npt.ArrayLike,
+                          in_func: npt.ArrayLike) -> npt.NDArray[np.float64]:
+    """Evaluates the integral of the input function from 0 to x.
+    The input function is interpolated linearly between the sampled points and
+    extrapolated with the value of the extreme samples outside the sampled
+    interval, exactly as numpy.interp does. Since the interpolated input
+    function is piecewise linear, its antiderivative is piecewise quadratic and
+    can be evaluated exactly at any number of points at once.
 
     Arguments:
-    tau     --  The integration variable
-    t       --  The time point at which the integral is evaluated
-    amp     --  The amplitude of the step function
-    extent  --  The length of the step function
-    tp      --  The time points of the input function samples
-    in_func --  The input function samples
+    x       --  The upper limits of integration.
+    tp      --  The time points of the input function samples.
+    in_func --  The input function samples.
 
     Return value:
-    The integrand evaluated at time point t and integration variable value tau.
+    An array with the integral of the input function from 0 to each x.
     """
 
-    # Compute response function value at t - tau
-    if t - tau < extent:
-        resp = amp
-    else:
-        resp = 0.0
+    tp_arr = np.asarray(tp, dtype=np.float64)
+    f_arr = np.asarray(in_func, dtype=np.float64)
+    x_arr = np.asarray(x, dtype=np.float64)
+
+    # Integral from the first sample point up to every sample point
+    # (trapezoidal rule is exact for a piecewise linear function)
+    h = np.diff(tp_arr)
+    cum = np.concatenate(
+        ([0.0], np.cumsum(0.5 * h * (f_arr[1:] + f_arr[:-1]))))
+
+    # Slope of each segment. The last entry is the constant extrapolation
+    # beyond the last sample point.
+    slope = np.zeros_like(tp_arr)
+    slope[:-1] = np.divide(np.diff(f_arr), h,
+                           out=np.zeros_like(h), where=h > 0.0)
+
+    def antiderivative(z: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+        # Index of the segment containing each z. Points before the first
+        # sample point are handled by the first segment with zero slope.
+        k = np.clip(np.searchsorted(tp_arr, z, side='right') - 1,
+                    0, len(tp_arr) - 1)
+        dz = z - tp_arr[k]
+        s = np.where(dz < 0.0, 0.0, slope[k])
+        return cum[k] + f_arr[k] * dz + 0.5 * s * dz * dz
+
+    return antiderivative(x_arr) - antiderivative(np.zeros(1))
+
+
+def _step_convolution(t: npt.NDArray[np.float64],
+                      tp: npt.ArrayLike,
+                      in_func: npt.ArrayLike,
+                      extent: float) -> npt.NDArray[np.float64]:
+    """Computes the convolution of the input function with a step function of
+    unit amplitude and length extent, evaluated at the time points t.
+    This equals the integral of the input function over the interval
+    [max(t-extent, 0), t], which is computed from the antiderivative of the
+    linearly interpolated input function.
+
+    Arguments:
+    t       --  The time points at which the convolution is evaluated.
+    tp      --  The time points of the input function samples.
+    in_func --  The input function samples.
+    extent  --  The length of the step function.
+
+    Return value:
+    An array with the convolution evaluated at each time point.
+    """
+
+    lower = np.minimum(np.maximum(t - extent, 0.0), t)
+    return (_input_antiderivative(t, tp, in_func) -
+            _input_antiderivative(lower, tp, in_func))
+
+
+def _step_convolution_derivative(t: npt.NDArray[np.float64],
+                                 tp: npt.ArrayLike,
+                                 in_func: npt.ArrayLike,
+                                 extent: float) -> npt.NDArray[np.float64]:
+    """Computes the derivative of _step_convolution with respect to the length
+    of the step function. Increasing the length moves the lower limit of the
+    integral, so the derivative is the input function evaluated at t - extent,
+    as long as the lower limit lies inside the interval (0, t).
+
+    Arguments:
+    t       --  The time points at which the convolution is evaluated.
+    tp      --  The time points of the input function samples.
+    in_func --  The input function samples.
+    extent  --  The length of the step function.
 
-    # Return integrand value.
-    # Numpy.interp returns an array, which is cast back to a float value.
-    return resp * float(np.interp(tau, tp, in_func))
+    Return value:
+    An array with the derivative evaluated at each time point.
+    """
+
+    inside = (t - extent > 0.0) & (extent > 0.0)
+    f_lower = np.interp(t - extent, np.asarray(tp, dtype=np.float64),
+                        np.asarray(in_func, dtype=np.float64))
+    return np.where(inside, f_lower, 0.0)
 
 
-def model_step(t: list[float], in_func: list[float],
-               amp: float, extent: float) -> list[float]:
+def model_step(t: npt.ArrayLike, in_func: npt.ArrayLike,
+               amp: float, extent: float) -> npt.NDArray[np.float64]:
     """Solves the model where the input response function is assumed to be a
     step function.
     This function calculates the convolution of a sampled input function with
     a step function. The step function has value amp on the interval
     [0, extent) and value 0 on the interval [extent, infinity).
     The convolution is evaluated at the same time points as the sampled
-    input function and returned as a list.
-    The convolution is performed numerically using scipy.integrate.quad and
-    the input function is interpolated linearly between sample points.
+    input function and returned as an array.
+    The input function is interpolated linearly between sample points, which
+    means that the convolution can be computed exactly as a difference of the
+    integrated input function at t and t - extent.
 
     Arguments:
     t       --  The time points of the input function samples.
@@ -54,70 +122,40 @@ def model_step(t: list[float], in_func: list[float],
     extent  --  The length of the step function.
 
     Return value:
-    A list containing the modeled values at each time point.
+    An array containing the modeled values at each time point.
     """
 
-    res = []
-    for ti in t:
-        # For each time point the integrand (see above) is integrated.
-        # We use a higher subproblem limit and higher error tolerances to avoid
-        # running into problems, since the functions are not necessarily very
-        # well-behaved.
-        y = scipy.integrate.quad(_model_step_integrand, 0, ti,
-                                 args=(ti, amp, extent, t, in_func),
-                                 limit=100,
-                                 epsabs=1e-2, epsrel=1e-4)
-        res.append(y[0])
-    return res
-
-
-def _model_step_2_integrand(tau: float, t: float,
-                            amp1: float,
-                            extent1: float,
-                            amp2: float,
-                            extent2: float,
-                            tp: list[float], in_func: list[float]) -> float:
-    """Defines the integrand when the input response is a 2-step function.
-    The response function is defined on the domain [0, infinty). It has value
-    amp1+amp2 on the interval [0, extent1), value amp2 on the interval
-    [extent1, extent2) and value 0 on the interval [extent2, infinity).
-    The integrand is the product of the response function evaluated at t-tau
-    and the input function evaluated at tau. The input function is interpolated
-    linearly between the sampled points.
+    t_arr = np.asarray(t, dtype=np.float64)
+    return amp * _step_convolution(t_arr, t_arr, in_func, extent)
+
+
+def model_step_jac(t: npt.ArrayLike, in_func: npt.ArrayLike,
+                   amp: float, extent: float) -> npt.NDArray[np.float64]:
+    """Computes the Jacobian of model_step with respect to its parameters.
 
     Arguments:
-    tau     --  The integration variable.
-    t       --  The time point at which the integral is evaluated.
-    amp1    --  The amplitude of the step function on [0, extent1).
-    extent1 --  The length of the first step function.
-    amp2    --  The amplitude of the step function on [0, extent2).
-    extent2 --  The length of the second step function.
-    tp      --  The time points of the input function samples.
+    t       --  The time points of the input function samples.
     in_func --  The input function samples.
+    amp     --  The amplitude of the step function.
+    extent  --  The length of the step function.
 
     Return value:
-    The integrand evaluated at time point t and integration variable value tau.
+    An array of shape (len(t), 2) with the derivatives with respect to amp and
+    extent in the columns.
     """
 
-    # Compute response function value at t - tau
-    if t - tau < extent1:
-        resp = amp1 + amp2
-    elif t - tau < extent2:
-        resp = amp2
-    else:
-        resp = 0.0
-
-    # Return integrand value.
-    # Numpy.interp returns an array, which is cast back to a float value.
-    return resp * float(np.interp(tau, tp, in_func))
+    t_arr = np.asarray(t, dtype=np.float64)
+    return np.column_stack((
+        _step_convolution(t_arr, t_arr, in_func, extent),
+        amp * _step_convolution_derivative(t_arr, t_arr, in_func, extent)))
 
 
-def model_step_2(t: list[float],
-                 in_func: list[float],
+def model_step_2(t: npt.ArrayLike,
+                 in_func: npt.ArrayLike,
                  amp1: float,
                  extent1: float,
                  amp2: float,
-                 extent2: float) -> list[float]:
+                 extent2: float) -> npt.NDArray[np.float64]:
     """Solves the model where the input response function is assumed to be a
     2-step function.
     This function calculates the convolution of a sampled input function with
@@ -125,9 +163,38 @@ def model_step_2(t: list[float],
     [0, extent1), value amp2 on the interval [extent1, extent2) and value 0 on
     the interval [extent2, infinity).
     The convolution is evaluated at the same time points as the sampled
-    input function and returned as a list.
-    The convolution is performed numerically using scipy.integrate.quad and
-    the input function is interpolated linearly between sample points.
+    input function and returned as an array.
+    The input function is interpolated linearly between sample points, which
+    means that the convolution can be computed exactly as a sum of two single
+    step convolutions (see model_step).
+
+    Arguments:
+    t       --  The time points of the input function samples.
+    in_func --  The input function samples.
+    amp1    --  The amplitude of the step function on [0, extent1).
+    extent1 --  The length of the first step function.
+    amp2    --  The amplitude of the step function on [0, extent2).
+    extent2 --  The length of the second step function.
+
+    Return value:
+    An array containing the modeled values at each time point.
+    """
+
+    t_arr = np.asarray(t, dtype=np.float64)
+    # If extent2 is shorter than extent1, the interval [extent1, extent2) is
+    # empty and the second step effectively ends at extent1.
+    return (amp1 * _step_convolution(t_arr, t_arr, in_func, extent1) +
+            amp2 * _step_convolution(t_arr, t_arr, in_func,
+                                     max(extent1, extent2)))
+
+
+def model_step_2_jac(t: npt.ArrayLike,
+                     in_func: npt.ArrayLike,
+                     amp1: float,
+                     extent1: float,
+                     amp2: float,
+                     extent2: float) -> npt.NDArray[np.float64]:
+    """Computes the Jacobian of model_step_2 with respect to its parameters.
 
     Arguments:
     t       --  The time points of the input function samples.
@@ -138,173 +205,279 @@ def model_step_2(t: list[float],
     extent2 --  The length of the second step function.
 
     Return value:
-    A list containing the modeled values at each time point.
+    An array of shape (len(t), 4) with the derivatives with respect to amp1,
+    extent1, amp2 and extent2 in the columns.
     """
-    res = []
-    for ti in t:
-        # For each time point the integrand (see above) is integrated.
-        # We use a higher subproblem limit and higher error tolerances to avoid
-        # running into problems, since the functions are not necessarily very
-        # well-behaved.
-        y = scipy.integrate.quad(_model_step_2_integrand, 0, ti,
-                                 args=(ti, amp1, extent1, amp2, extent2,
-                                       t, in_func),
-                                 limit=100,
-                                 epsabs=1e-2, epsrel=1e-4)
-        res.append(y[0])
-    return res
-
-
-def _model_step_fermi_integrand(tau: float, t: float,
-                                amp1: float,
-                                extent1: float,
-                                amp2: float,
-                                extent2: float,
-                                width2: float,
-                                tp: list[float],
-                                in_func: list[float]) -> float:
-    """Defines the integrand when the input response is a 2-step
-    fermi-function. The response function is defined on the domain
-    [0, infinty). It has value amp1+amp2 on at t=0, stays nearly constant until
-    t=extent1 where it transitions smoothly to a vlaue of amp2. It then stays
-    nearly constant at amp2 until t=extent2, where it smoothly approaches a
-    value of 0.
-    The integrand is the product of the response function evaluated at t-tau
-    and the input function evaluated at tau. The input function is interpolated
-    linearly between the sampled points.
+
+    t_arr = np.asarray(t, dtype=np.float64)
+
+    # The second step ends at the longest of the two extents (see
+    # model_step_2), which determines which extent it depends on.
+    d1 = _step_convolution_derivative(t_arr, t_arr, in_func, extent1)
+    d2 = _step_convolution_derivative(t_arr, t_arr, in_func, extent2)
+    if extent1 > extent2:
+        d_extent1 = (amp1 + amp2) * d1
+        d_extent2 = np.zeros_like(t_arr)
+    else:
+        d_extent1 = amp1 * d1
+        d_extent2 = amp2 * d2
+
+    return np.column_stack((
+        _step_convolution(t_arr, t_arr, in_func, extent1),
+        d_extent1,
+        _step_convolution(t_arr, t_arr, in_func, max(extent1, extent2)),
+        d_extent2))
+
+
+class ConvolutionOperator:
+    """Precomputed quadrature for the convolution of a sampled input function
+    with a response function.
+    The interval [0, t[-1]] is split into segments at the sample points, and
+    each segment is given a set of Gauss-Legendre quadrature nodes. Since the
+    input function is interpolated linearly between the sample points, the
+    integrand is smooth on each segment whenever the response function is
+    smooth. The nodes, the quadrature weights multiplied by the input function
+    values and the lags t_i - tau at which the response function must be
+    evaluated are computed once, so that each convolution only requires one
+    batched evaluation of the response function followed by a weighted sum.
+    The convolution is evaluated at the same time points as the sampled
+    input function.
 
     Arguments:
-    tau     --  The integration variable.
-    t       --  The time point at which the integral is evaluated.
-    amp1    --  The amplitude of the first fermi function.
-    extent1 --  The length of the first fermi function.
-    width1  --  The decay width of the first fermi function.
-    amp2    --  The amplitude of the second fermi function.
-    extent2 --  The length of the second fermi function.
-    width2  --  The decay width of the second fermi function
-    tp      --  The time points of the input function samples.
+    t       --  The time points of the input function samples.
+    in_func --  The input function samples.
+    nodes   --  The number of quadrature nodes on each segment.
+    """
+
+    def __init__(self, t: npt.ArrayLike, in_func: npt.ArrayLike,
+                 nodes: int = 16):
+
+        t_arr = np.asarray(t, dtype=np.float64)
+        f_arr = np.asarray(in_func, dtype=np.float64)
+        self.n = len(t_arr)
+
+        # Segment end points. The integration starts at 0, so sample points
+        # before 0 are dropped and 0 is added as the first end point.
+        ends = np.unique(np.concatenate(([0.0], t_arr[t_arr > 0.0])))
+        a = ends[:-1]
+        b = ends[1:]
+
+        # Quadrature nodes and weights on every segment (segments x nodes)
+        x, w = np.polynomial.legendre.leggauss(nodes)
+        tau = 0.5 * (b - a)[:, None] * x[None, :] + 0.5 * (a + b)[:, None]
+        weight = 0.5 * (b - a)[:, None] * w[None, :]
+        weight = weight * np.interp(tau, t_arr, f_arr)
+
+        # A segment contributes to the convolution at t_i if it lies entirely
+        # within [0, t_i]. Since the segment end points are sample points
+        # this covers the whole integration interval.
+        row, seg = np.nonzero(b[None, :] <= t_arr[:, None])
+        self._row = np.repeat(row, nodes)
+        self.lag = (t_arr[row][:, None] - tau[seg]).ravel()
+        self._weight = weight[seg].ravel()
+
+    def apply(self, resp_values: npt.NDArray[np.float64]) \
+            -> npt.NDArray[np.float64]:
+        """Compute the convolution of the input function with a response
+        function, which has already been evaluated at the lags of the
+        operator (the attribute lag).
+
+        Arguments:
+        resp_values --  The response function evaluated at each lag.
+
+        Return value:
+        An array with the convolution evaluated at each time point.
+        """
+
+        return np.bincount(self._row, weights=self._weight * resp_values,
+                           minlength=self.n).astype(np.float64, copy=False)
+
+    def __call__(self, resp: Callable[[npt.NDArray[np.float64]],
+                                      npt.NDArray[np.float64]]) \
+            -> npt.NDArray[np.float64]:
+        """Compute the convolution of the input function with a response
+        function.
+
+        Arguments:
+        resp    --  The response function. It is called once with an array of
+                    all the lags t - tau at which it must be evaluated.
+
+        Return value:
+        An array with the convolution evaluated at each time point.
+        """
+
+        return self.apply(resp(self.lag))
+
+
+# An operator takes up O(n^2 * nodes) memory for n time points, so only the
+# operator of the latest input function is kept. A fit (or a parametric map)
+# evaluates the model many times with the same input function.
+@functools.lru_cache(maxsize=1)
+def _cached_operator(t: bytes, in_func: bytes) -> ConvolutionOperator:
+    return ConvolutionOperator(np.frombuffer(t), np.frombuffer(in_func))
+
+
+def _convolution_operator(t: npt.ArrayLike,
+                          in_func: npt.ArrayLike) -> ConvolutionOperator:
+    """Get the convolution operator for a given input function.
+    The operator of the latest input function is cached, so when a model is
+    evaluated repeatedly with the same time points and input function (e.g.
+    during a fit), the operator is only constructed once. The memory used by
+    the cache does not grow with the number of input functions (e.g. in a
+    batch of fits).
+
+    Arguments:
+    t       --  The time points of the input function samples.
     in_func --  The input function samples.
 
     Return value:
-    The integrand evaluated at time point t and integration variable value tau.
+    The convolution operator for the input function.
+    """
+
+    return _cached_operator(
+        np.ascontiguousarray(t, dtype=np.float64).tobytes(),
+        np.ascontiguousarray(in_func, dtype=np.float64).tobytes())
+
+
+def _fermi(lag: npt.NDArray[np.float64], amp: float, extent: float,
+           width: float) -> npt.NDArray[np.float64]:
+    """Evaluates a fermi function:
+    f = amp * (1 + exp(-extent/width)) / (1 + exp((lag-extent)/width))
+
+    Arguments:
+    lag     --  The points at which the function is evaluated.
+    amp     --  The amplitude of the fermi function.
+    extent  --  The length of the fermi function.
+    width   --  The decay width of the fermi function.
+
+    Return value:
+    The fermi function evaluated at each point.
     """
 
-    # Compute response function value at t - tau
-    resp = (amp2 * (1.0 + np.exp(-extent2 / width2)) /
-            (1.0 + np.exp((t - tau - extent2) / width2)))
-    if t - tau < extent1:
-        resp = resp + amp1
+    # expit(-x) = 1 / (1 + exp(x)) without overflow for large x
+    scale: float = amp * (1.0 + np.exp(-extent / width))
+    decay: npt.NDArray[np.float64] = \
+        scipy.special.expit((extent - lag) / width)
+    return scale * decay
+
 
-    # Return integrand value.
-    # Numpy.interp returns an array, which is cast back to a float value.
-    return float(resp) * float(np.interp(tau, tp, in_func))
+def _fermi_derivatives(lag: npt.NDArray[np.float64], amp: float,
+                       extent: float, width: float) \
+        -> tuple[npt.NDArray[np.float64], npt.NDArray[np.float64],
+                 npt.NDArray[np.float64]]:
+    """Evaluates the derivatives of a fermi function (see _fermi) with respect
+    to its amplitude, extent and width.
 
+    Arguments:
+    lag     --  The points at which the derivatives are evaluated.
+    amp     --  The amplitude of the fermi function.
+    extent  --  The length of the fermi function.
+    width   --  The decay width of the fermi function.
 
-def model_step_fermi(t: list[float],
-                     in_func: list[float],
+    Return value:
+    A tuple with the derivatives with respect to amp, extent and width
+    evaluated at each point.
+    """
+
+    # With c = 1 + exp(-extent/width) and s = 1 / (1 + exp(z)), where
+    # z = (lag-extent)/width, the fermi function is amp * c * s.
+    e = float(np.exp(-extent / width))
+    c = 1.0 + e
+    z = (lag - extent) / width
+    s: npt.NDArray[np.float64] = scipy.special.expit(-z)
+    ds = c * s * (1.0 - s)
+
+    d_amp = c * s
+    d_extent = amp / width * (ds - e * s)
+    d_width = amp / width * (extent / width * e * s + ds * z)
+    return d_amp, d_extent, d_width
+
+
+def model_step_fermi(t: npt.ArrayLike,
+                     in_func: npt.ArrayLike,
                      amp1: float,
                      extent1: float,
                      amp2: float,
                      extent2: float,
-                     width2) -> list[float]:
+                     width2: float) -> npt.NDArray[np.float64]:
     """Solves the model where the input response function is assumed to be a
-    2-step fermi-function.
+    step function plus a fermi-function.
     This function calculates the convolution of a sampled input function with
-    a 2-step fermi-function.
+    the sum of a step function and a fermi-function.
+    The step function has value amp1 on the interval [0, extent1) and value 0
+    on the interval [extent1, infinity).
     The formula for the fermi function is:
-    f = A1 * (1 + exp(-t1/b1)) / (1 + exp((t-t1)/b1)) + ...
-    The ... indicates a second term of exactly the same construction, but
-    other parameters.
-    A1 is called the amplitude (of the first fermi function)
-    t1 is called the extent (of the first fermi function)
-    b1 is called the width (of the first fermi function)
+    f = A2 * (1 + exp(-t2/b2)) / (1 + exp((t-t2)/b2))
+    A2 is called the amplitude (of the fermi function)
+    t2 is called the extent (of the fermi function)
+    b2 is called the width (of the fermi function)
     The convolution is evaluated at the same time points as the sampled
-    input function and returned as a list.
-    The convolution is performed numerically using scipy.integrate.quad and
-    the input function is interpolated linearly between sample points.
+    input function and returned as an array.
+    The input function is interpolated linearly between sample points. The
+    step function part is computed exactly (see model_step), while the fermi
+    function part is computed with a precomputed quadrature (see
+    ConvolutionOperator).
 
     Arguments:
     t       --  The time points of the input function samples.
     in_func --  The input function samples.
-    amp1    --  The amplitude of the first fermi function.
-    extent1 --  The length of the first function.
-    width1  --  The decay width of the first fermi function.
-    amp2    --  The amplitude of the second fermi function.
-    extent2 --  The length of the second fermi function.
-    width2  --  The decay width of the second fermi function.
+    amp1    --  The amplitude of the step function.
+    extent1 --  The length of the step function.
+    amp2    --  The amplitude of the fermi function.
+    extent2 --  The length of the fermi function.
+    width2  --  The decay width of the fermi function.
 
     Return value:
-    A list containing the modeled values at each time point.
+    An array containing the modeled values at each time point.
     """
-    res = []
-    for ti in t:
-        # For each time point the integrand (see above) is integrated.
-        # We use a higher subproblem limit and higher error tolerances to avoid
-        # running into problems, since the functions are not necessarily very
-        # well-behaved.
-        y = scipy.integrate.quad(_model_step_fermi_integrand, 0, ti,
-                                 args=(ti, amp1, extent1,
-                                       amp2, extent2, width2, t, in_func),
-                                 limit=100,
-                                 epsabs=1e-2, epsrel=1e-4)
-        res.append(y[0])
-    return res
-
-
-def _model_fermi_2_integrand(tau: float, t: float,
-                             amp1: float,
-                             extent1: float,
-                             width1: float,
-                             amp2: float,
-                             extent2: float,
-                             width2: float,
-                             tp: list[float], in_func: list[float]) -> float:
-    """Defines the integrand when the input response is a 2-step
-    fermi-function. The response function is defined on the domain
-    [0, infinty). It has value amp1+amp2 on at t=0, stays nearly constant until
-    t=extent1 where it transitions smoothly to a vlaue of amp2. It then stays
-    nearly constant at amp2 until t=extent2, where it smoothly approaches a
-    value of 0.
-    The integrand is the product of the response function evaluated at t-tau
-    and the input function evaluated at tau. The input function is interpolated
-    linearly between the sampled points.
+
+    t_arr = np.asarray(t, dtype=np.float64)
+    op = _convolution_operator(t_arr, in_func)
+    return (amp1 * _step_convolution(t_arr, t_arr, in_func, extent1) +
+            op(lambda lag: _fermi(lag, amp2, extent2, width2)))
+
+
+def model_step_fermi_jac(t: npt.ArrayLike,
+                         in_func: npt.ArrayLike,
+                         amp1: float,
+                         extent1: float,
+                         amp2: float,
+                         extent2: float,
+                         width2: float) -> npt.NDArray[np.float64]:
+    """Computes the Jacobian of model_step_fermi with respect to its
+    parameters.
 
     Arguments:
-    tau     --  The integration variable.
-    t       --  The time point at which the integral is evaluated.
-    amp1    --  The amplitude of the first fermi function.
-    extent1 --  The length of the first fermi function.
-    width1  --  The decay width of the first fermi function.
-    amp2    --  The amplitude of the second fermi function.
-    extent2 --  The length of the second fermi function.
-    width2  --  The decay width of the second fermi function
-    tp      --  The time points of the input function samples.
+    t       --  The time points of the input function samples.
     in_func --  The input function samples.
+    amp1    --  The amplitude of the step function.
+    extent1 --  The length of the step function.
+    amp2    --  The amplitude of the fermi function.
+    extent2 --  The length of the fermi function.
+    width2  --  The decay width of the fermi function.
 
     Return value:
-    The integrand evaluated at time point t and integration variable value tau.
+    An array of shape (len(t), 5) with the derivatives with respect to amp1,
+    extent1, amp2, extent2 and width2 in the columns.
     """
 
-    # Compute response function value at t - tau
-    resp = (amp1 *
-            (1.0 + np.exp(-extent1 / width1)) /
-            (1.0 + np.exp((t - tau - extent1) / width1)) +
-            amp2 * (1.0 + np.exp(-extent2 / width2)) /
-            (1.0 + np.exp((t - tau - extent2) / width2)))
-
-    # Return integrand value.
-    # Numpy.interp returns an array, which is cast back to a float value.
-    return float(resp) * float(np.interp(tau, tp, in_func))
+    t_arr = np.asarray(t, dtype=np.float64)
+    op = _convolution_operator(t_arr, in_func)
+    d_fermi = _fermi_derivatives(op.lag, amp2, extent2, width2)
+    return np.column_stack((
+        _step_convolution(t_arr, t_arr, in_func, extent1),
+        amp1 * _step_convolution_derivative(t_arr, t_arr, in_func, extent1),
+        *(op.apply(d) for d in d_fermi)))
 
 
-def model_fermi_2(t: list[float],
-                  in_func: list[float],
+def model_fermi_2(t: npt.ArrayLike,
+                  in_func: npt.ArrayLike,
                   amp1: float,
                   extent1: float,
                   width1: float,
                   amp2: float,
                   extent2: float,
-                  width2) -> list[float]:
+                  width2: float) -> npt.NDArray[np.float64]:
     """Solves the model where the input response function is assumed to be a
     2-step fermi-function.
     This function calculates the convolution of a sampled input function with
@@ -317,9 +490,10 @@ def model_fermi_2(t: list[float],
     t1 is called the extent (of the first fermi function)
     b1 is called the width (of the first fermi function)
     The convolution is evaluated at the same time points as the sampled
-    input function and returned as a list.
-    The convolution is performed numerically using scipy.integrate.quad and
-    the input function is interpolated linearly between sample points.
+    input function and returned as an array.
+    The input function is interpolated linearly between sample points, and the
+    convolution is computed with a precomputed quadrature (see
+    ConvolutionOperator).
 
     Arguments:
     t       --  The time points of the input function samples.
@@ -332,27 +506,73 @@ def model_fermi_2(t: list[float],
     width2  --  The decay width of the second fermi function.
 
     Return value:
-    A list containing the modeled values at each time point.
+    An array containing the modeled values at each time point.
     """
-    res = []
-    for ti in t:
-        # For each time point the integrand (see above) is integrated.
-        # We use a higher subproblem limit and higher error tolerances to avoid
-        # running into problems, since the functions are not necessarily very
-        # well-behaved.
-        y = scipy.integrate.quad(_model_fermi_2_integrand, 0, ti,
-                                 args=(ti, amp1, extent1, width1,
-                                       amp2, extent2, width2, t, in_func),
-                                 limit=100,
-                                 epsabs=1e-2, epsrel=1e-4)
-        res.append(y[0])
-    return res
-
-
-def model_patlak(t: list[float],
-                 in_func: list[float],
+
+    op = _convolution_operator(t, in_func)
+    return op(lambda lag: (_fermi(lag, amp1, extent1, width1) +
+                           _fermi(lag, amp2, extent2, width2)))
+
+
+def model_fermi_2_jac(t: npt.ArrayLike,
+                      in_func: npt.ArrayLike,
+                      amp1: float,
+                      extent1: float,
+                      width1: float,
+                      amp2: float,
+                      extent2: float,
+                      width2: float) -> npt.NDArray[np.float64]:
+    """Computes the Jacobian of model_fermi_2 with respect to its parameters.
+
+    Arguments:
+    t       --  The time points of the input function samples.
+    in_func --  The input function samples.
+    amp1    --  The amplitude of the first fermi function.
+    extent1 --  The length of the first function.
+    width1  --  The decay width of the first fermi function.
+    amp2    --  The amplitude of the second fermi function.
+    extent2 --  The length of the second fermi function.
+    width2  --  The decay width of the second fermi function.
+
+    Return value:
+    An array of shape (len(t), 6) with the derivatives with respect to amp1,
+    extent1, width1, amp2, extent2 and width2 in the columns.
+    """
+
+    op = _convolution_operator(t, in_func)
+    d_fermi = (_fermi_derivatives(op.lag, amp1, extent1, width1) +
+               _fermi_derivatives(op.lag, amp2, extent2, width2))
+    return np.column_stack([op.apply(d) for d in d_fermi])
+
+
+def patlak_regressors(t: npt.ArrayLike,
+                      in_func: npt.ArrayLike) -> npt.NDArray[np.float64]:
+    """Computes the regressors of the Patlak-model, i.e. the integrated input
+    function and the input function itself, at each time point. The Patlak
+    model is linear in its parameters, so the modeled values are given by the
+    product of this matrix and the parameter vector (k1, v0).
+    The input function is integrated from the first time point with the
+    cumulative trapezoidal rule.
+
+    Arguments:
+    t       --  The time points of the input function samples.
+    in_func --  The input function samples.
+
+    Return value:
+    An array of shape (len(t), 2) with the integrated input function in the
+    first column and the input function in the second column.
+    """
+
+    f_arr = np.asarray(in_func, dtype=np.float64)
+    cum_int: npt.NDArray[np.float64] = scipy.integrate.cumulative_trapezoid(
+        f_arr, np.asarray(t, dtype=np.float64), initial=0.0)
+    return np.column_stack((cum_int, f_arr))
+
+
+def model_patlak(t: npt.ArrayLike,
+                 in_func: npt.ArrayLike,
                  k1: float,
-                 v0: float) -> list[float]:
+                 v0: float) -> npt.NDArray[np.float64]:
     """Solves the Patlak-model.
     In the Patlak model the observed signal is assumed to be a constant k1
     times the integrated input function up until that point, plus another
@@ -366,8 +586,50 @@ def model_patlak(t: list[float],
     v0      --  The constant v0 in the Patlak model.
 
     Return value:
-    A list containing the modeled values at each time point.
+    An array containing the modeled values at each time point.
+    """
+
+    return patlak_regressors(t, in_func) @ np.array([k1, v0], dtype=np.float64)
+
+
+def model_patlak_jac(t: npt.ArrayLike,
+                     in_func: npt.ArrayLike,
+                     k1: float,
+                     v0: float) -> npt.NDArray[np.float64]:
+    """Computes the Jacobian of model_patlak with respect to its parameters.
+    The model is linear, so the Jacobian does not depend on the parameters
+    and is given by the regressors (see patlak_regressors).
+
+    Arguments:
+    t       --  The time points of the input function samples.
+    in_func --  The input function samples.
+    k1      --  The constant k1 in the Patlak model.
+    v0      --  The constant v0 in the Patlak model.
+
+    Return value:
+    An array of shape (len(t), 2) with the derivatives with respect to k1 and
+    v0 in the columns.
+    """
+
+    return patlak_regressors(t, in_func)
+
+
+def model_patlak_batch(t: npt.ArrayLike,
+                       in_func: npt.ArrayLike,
+                       params: npt.ArrayLike) -> npt.NDArray[np.float64]:
+    """Solves the Patlak-model for many sets of parameters at once (see
+    model_patlak).
+
+    Arguments:
+    t       --  The time points of the input function samples.
+    in_func --  The input function samples.
+    params  --  An array of shape (m, 2), where each row is a pair of
+                parameters (k1, v0).
+
+    Return value:
+    An array of shape (m, len(t)), where row j contains the modeled values at
+    each time point for the j'th pair of parameters.
     """
 
-    return [k1 * scipy.integrate.trapezoid(in_func[0:i+1], t[0:i+1])
-            + v0 * in_func[i] for i in range(len(t))]
+    return np.asarray(params, dtype=np.float64) @ \
+        patlak_regressors(t, in_func).T
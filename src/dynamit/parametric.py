@@ -0,0 +1,269 @@
+import SimpleITK as sitk
+import concurrent.futures
+import dynamit
+import inspect
+import numpy as np
+import numpy.typing as npt
+import scipy
+import warnings
+from multiprocessing import shared_memory
+from typing import Any, Iterable, Optional
+
+
+def patlak_map(series: Iterable[sitk.Image],
+               t: npt.ArrayLike,
+               in_func: npt.ArrayLike) -> dict[str, sitk.Image]:
+    """Computes parametric images of the Patlak-model (see
+    dynamit.model_patlak). The Patlak-model is linear in its parameters, so
+    the model is fitted to the time series of every voxel by linear least
+    squares. The fits of all voxels share the same design matrix (see
+    dynamit.patlak_regressors), so the design matrix is factorized once as
+    X = QR, and Q^T y is accumulated for all voxels one frame at a time. The
+    fits are then solved together from R beta = Q^T y, which (unlike the
+    normal equations) does not square the condition number of X. This means
+    that only one frame of the series needs to be in memory at a time, and
+    the series can be given as e.g. a generator which loads the images one by
+    one.
+
+    Arguments:
+    series  --  The dynamic image series. It must have the same number of
+                images as there are time points.
+    t       --  The time points of the input function samples.
+    in_func --  The input function samples.
+
+    Return value:
+    A dict object with the parametric images of k1 and v0 under the keys 'k1'
+    and 'v0' and the root-mean-square residual of each fit under the key
+    'rms'. The images are in the same physical space as the images in the
+    series.
+    """
+
+    x = dynamit.patlak_regressors(t, in_func)
+    n_frames = x.shape[0]
+    q, r = np.linalg.qr(x)
+
+    # Accumulate Q^T y and y^T y for every voxel
+    qty = None
+    yty = None
+    ref = None
+    n = 0
+    for img in series:
+        if n >= n_frames:
+            raise ValueError("The image series has more images than there "
+                             "are time points.")
+        y = sitk.GetArrayViewFromImage(img).astype(np.float64).ravel()
+        if qty is None or yty is None:
+            ref = img
+            qty = np.zeros((2, y.size))
+            yty = np.zeros(y.size)
+        qty += np.outer(q[n], y)
+        yty += y * y
+        n += 1
+
+    if n != n_frames or qty is None or yty is None or ref is None:
+        raise ValueError("The image series has fewer images than there are "
+                         "time points.")
+
+    # Solve the triangular systems of all voxels at once
+    beta = scipy.linalg.solve_triangular(r, qty)
+
+    # Residual sum of squares: y^T y - |Q^T y|^2
+    rss = np.maximum(yty - np.sum(qty * qty, axis=0), 0.0)
+
+    res = {}
+    for name, arr in (('k1', beta[0]), ('v0', beta[1]),
+                      ('rms', np.sqrt(rss / n_frames))):
+        img = sitk.GetImageFromArray(
+            arr.reshape(sitk.GetArrayViewFromImage(ref).shape))
+        img.CopyInformation(ref)
+        res[name] = img
+    return res
+
+
+def _fit_voxel_chunk(shm_name: str,
+                     shape: tuple[int, int],
+                     start: int,
+                     stop: int,
+                     t: npt.NDArray[np.float64],
+                     in_func: npt.NDArray[np.float64],
+                     fit_model: str,
+                     params: dict[str, dict[str, float]]) \
+        -> tuple[npt.NDArray[np.float64], npt.NDArray[np.float64], int]:
+    """Fits a model to the time series of a chunk of voxels. The time series
+    of all voxels are stored in a shared memory block as a float64 array
+    with one row per voxel, and the chunk consists of the rows start:stop.
+    This is the work done by each worker process in parametric_map.
+    Voxels where the residuals are not finite at the initial parameter
+    values (e.g. because the time series contains nan) are not fitted.
+
+    Return value:
+    A tuple with an array with the best fit parameter values (one row per
+    voxel), an array with the root-mean-square residual of each fit and the
+    number of voxels that were not fitted.
+    """
+
+    model_func, jac = dynamit.fit_models()[fit_model]
+    names = [name for name in inspect.signature(model_func).parameters
+             if name not in ('t', 'in_func')]
+    x0 = np.array([params[name]['value'] for name in names])
+    lower = np.array([params[name].get('min', -np.inf) for name in names])
+    upper = np.array([params[name].get('max', np.inf) for name in names])
+
+    # Copy the chunk out of shared memory, so that the block can be closed
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        data = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        chunk = data[start:stop].copy()
+    finally:
+        shm.close()
+
+    values = np.full((stop - start, len(names)), np.nan)
+    rms = np.full(stop - start, np.nan)
+    skipped = 0
+    for i, y in enumerate(chunk):
+        def residual(p: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+            m: npt.NDArray[np.float64] = model_func(t, in_func, *p) - y
+            return m
+
+        def jacobian(p: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+            return jac(t, in_func, *p)
+
+        if not np.all(np.isfinite(residual(x0))):
+            skipped += 1
+            continue
+        res = scipy.optimize.least_squares(residual, x0, jac=jacobian,
+                                           bounds=(lower, upper))
+        values[i] = res.x
+        rms[i] = np.sqrt(np.mean(res.fun ** 2))
+    return values, rms, skipped
+
+
+def parametric_map(series: Iterable[sitk.Image],
+                   t: npt.ArrayLike,
+                   in_func: npt.ArrayLike,
+                   fit_model: str,
+                   params: dict[str, dict[str, float]],
+                   mask: Optional[sitk.Image] = None,
+                   chunk_size: int = 1024,
+                   workers: int = 1) -> dict[str, sitk.Image]:
+    """Computes parametric images of a model (see dynamit.tac_fit for the
+    available models) by fitting the model to the time series of every voxel
+    in a dynamic image series. The fits can optionally be restricted to the
+    voxels inside a mask.
+    The time series of the voxels are copied one frame at a time into a
+    shared memory block, so the series can be given as e.g. a generator which
+    loads the images one by one. The block stores the values as float64, so
+    no precision is lost whatever the pixel type of the images. The voxels
+    are then split into chunks, and the chunks are fitted in a pool of worker
+    processes, which read the time series directly from the shared memory
+    block. The memory used by each worker is therefore bounded by the chunk
+    size.
+
+    Arguments:
+    series      --  The dynamic image series. It must have the same number of
+                    images as there are time points.
+    t           --  The time points of the input function samples.
+    in_func     --  The input function samples.
+    fit_model   --  The name of the model.
+    params      --  The model parameters (see dynamit.tac_fit). The initial
+                    values and bounds are used for every voxel.
+    mask        --  An image in the same physical space as the series. Only
+                    voxels where the mask is nonzero are fitted. By default
+                    all voxels are fitted.
+    chunk_size  --  The number of voxels fitted in each chunk.
+    workers     --  The number of worker processes. With a single worker the
+                    chunks are fitted in the calling process.
+
+    Return value:
+    A dict object with a parametric image for each model parameter under the
+    parameter name, and the root-mean-square residual of each fit under the
+    key 'rms'. Voxels that are not fitted have the value nan. A warning
+    with the number of voxels that could not be fitted (see _fit_voxel_chunk)
+    is issued if there are any.
+    """
+
+    t_arr = np.asarray(t, dtype=np.float64)
+    f_arr = np.asarray(in_func, dtype=np.float64)
+    n_frames = len(t_arr)
+
+    model_func = dynamit.fit_models()[fit_model][0]
+    names = [name for name in inspect.signature(model_func).parameters
+             if name not in ('t', 'in_func')]
+
+    # Check the initial values and bounds once for all voxels
+    for name in names:
+        value = params[name]['value']
+        lower = params[name].get('min', -np.inf)
+        upper = params[name].get('max', np.inf)
+        if not lower < upper:
+            raise ValueError("The lower bound of the parameter " + name +
+                             " must be less than the upper bound.")
+        if not lower <= value <= upper:
+            raise ValueError("The initial value of the parameter " + name +
+                             " is outside its bounds.")
+
+    shm: Optional[shared_memory.SharedMemory] = None
+    ref: Optional[sitk.Image] = None
+    try:
+        n = 0
+        for img in series:
+            if n >= n_frames:
+                raise ValueError("The image series has more images than "
+                                 "there are time points.")
+            frame = sitk.GetArrayViewFromImage(img).ravel()
+            if shm is None:
+                # Find the voxels to fit and allocate the shared memory
+                ref = img
+                if mask is None:
+                    voxels = np.arange(frame.size)
+                else:
+                    voxels = np.flatnonzero(sitk.GetArrayViewFromImage(mask))
+                shape = (len(voxels), n_frames)
+                shm = shared_memory.SharedMemory(
+                    create=True, size=max(int(np.prod(shape)) * 8, 1))
+                data = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+            data[:, n] = frame[voxels]
+            n += 1
+
+        if n != n_frames or shm is None or ref is None:
+            raise ValueError("The image series has fewer images than there "
+                             "are time points.")
+
+        # Fit the chunks
+        chunks = [(start, min(start + chunk_size, shape[0]))
+                  for start in range(0, shape[0], chunk_size)]
+        args: tuple[Any, ...] = (t_arr, f_arr, fit_model, params)
+        if workers <= 1:
+            results = [_fit_voxel_chunk(shm.name, shape, start, stop, *args)
+                       for start, stop in chunks]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=workers) as ex:
+                futures = [ex.submit(_fit_voxel_chunk, shm.name, shape,
+                                     start, stop, *args)
+                           for start, stop in chunks]
+                results = [future.result() for future in futures]
+    finally:
+        if shm is not None:
+            del data
+            shm.close()
+            shm.unlink()
+
+    skipped = sum(r[2] for r in results)
+    if skipped > 0:
+        warnings.warn(str(skipped) + " voxels could not be fitted.")
+
+    # Assemble the parametric images
+    size = sitk.GetArrayViewFromImage(ref).shape
+    maps = {}
+    for k, name in enumerate(names + ['rms']):
+        arr = np.full(int(np.prod(size)), np.nan)
+        if len(results) > 0:
+            if name == 'rms':
+                arr[voxels] = np.concatenate([r[1] for r in results])
+            else:
+                arr[voxels] = np.concatenate([r[0][:, k] for r in results])
+        img = sitk.GetImageFromArray(arr.reshape(size))
+        img.CopyInformation(ref)
+        maps[name] = img
+    return maps
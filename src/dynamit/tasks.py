@@ -1,14 +1,361 @@
-from typing import OrderedDict, Any, Optional
+import glob
+from collections import defaultdict
+import hashlib
+import importlib.metadata
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from typing import OrderedDict, Any, Iterable, Optional
 
 import dynamit
 import lmfit
 import matplotlib.pyplot as plt
+import numpy as np
+import numpy.typing as npt
+import SimpleITK as sitk
 
 
-def task_roi_means(task: OrderedDict[str, Any]):
+# The tags of the tasks which name files read by the task, and the tags which
+# name files or folders written by the task
+_INPUT_TAGS = ('img_path', 'roi_path', 'tac_path', 'mask_path')
+_OUTPUT_TAGS = ('out_path', 'k1_path', 'v0_path', 'rms_path', 'out_dir',
+                'fig_path')
+
+# The tags of the task cache, which are not part of the cache key
+_CACHE_TAGS = ('cache', 'cache_dir', 'cache_size')
+_CACHE_VERSION = 1
+
+
+def task_io(task: Any) -> dict[str, set[str]]:
+    """Finds the files and named results read and written by a task, by
+    collecting the values of the input and output tags (also inside nested
+    tags such as <roi>). Paths are made absolute.
+
+    Arguments:
+    task    --  The task (as parsed from the xml file).
+
+    Return value:
+    A dict with the sets 'in_paths', 'out_paths', 'in_names' and
+    'out_names'.
+    """
+
+    io_sets: dict[str, set[str]] = {'in_paths': set(), 'out_paths': set(),
+                                    'in_names': set(), 'out_names': set()}
+
+    def collect(tags: Any):
+        if isinstance(tags, list):
+            for item in tags:
+                collect(item)
+            return
+        if not isinstance(tags, dict):
+            return
+        for tag, value in tags.items():
+            if isinstance(value, (dict, list)):
+                collect(value)
+            elif tag in _INPUT_TAGS:
+                io_sets['in_paths'].add(os.path.abspath(str(value)))
+            elif tag in _OUTPUT_TAGS:
+                io_sets['out_paths'].add(os.path.abspath(str(value)))
+            elif tag == 'tac_name':
+                io_sets['in_names'].add(str(value))
+            elif tag == 'out_name':
+                io_sets['out_names'].add(str(value))
+
+    collect(task)
+    return io_sets
+
+
+def _task_cache(task: OrderedDict[str, Any]) -> Optional[tuple[str, int]]:
+    """Reads the cache tags of a task (<cache>, <cache_dir> and
+    <cache_size>).
+
+    Return value:
+    None if the cache is not used, and else a tuple with the cache folder and
+    the maximum size of the cache in bytes.
+    """
+
+    if 'cache' not in task or str(task['cache']).lower() != 'true':
+        return None
+    cache_dir = os.path.join(dynamit.default_cache_dir(), 'task_results')
+    if 'cache_dir' in task:
+        cache_dir = str(task['cache_dir'])
+    max_size = 1024
+    if 'cache_size' in task:
+        max_size = int(task['cache_size'])
+    return cache_dir, max_size * 1024 * 1024
+
+
+def _path_fingerprint(path: str) -> Any:
+    """The size and modification time (in ns) of a file, or of every file in
+    a folder. A metadata file with the extension .json added (e.g. of a
+    memory-mapped series) is included. A missing file gives None.
+    """
+
+    if os.path.isdir(path):
+        stats = []
+        for root, _, names in os.walk(path):
+            for name in names:
+                st = os.stat(os.path.join(root, name))
+                stats.append([os.path.relpath(os.path.join(root, name), path),
+                              st.st_size, st.st_mtime_ns])
+        return sorted(stats)
+    stats = []
+    for name in (path, path + '.json'):
+        if os.path.isfile(name):
+            st = os.stat(name)
+            stats.append([name, st.st_size, st.st_mtime_ns])
+    return stats if len(stats) > 0 else None
+
+
+def _result_fingerprint(value: Any) -> str:
+    """A hash of the content of a named result (a TAC dataset or a dict of
+    plain values).
+    """
+
+    h = hashlib.sha256()
+    if isinstance(value, dynamit.TAC):
+        h.update(json.dumps(list(value.labels)).encode())
+        h.update(np.ascontiguousarray(value.data).tobytes())
+    else:
+        h.update(json.dumps(value, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+def _task_cache_key(task: OrderedDict[str, Any],
+                    store: Optional[dict[str, Any]]) -> str:
+    """The key of the results of a task in the task cache. The key is a hash
+    of the task tags, the size and modification time of the input files, the
+    content of the named results used by the task, the output paths and the
+    dynamit version, so any change to these gives a new key.
+    """
+
+    try:
+        version = importlib.metadata.version('dynamit')
+    except importlib.metadata.PackageNotFoundError:
+        version = 'unknown'
+
+    io_sets = task_io(task)
+    results: dict[str, Optional[str]] = {}
+    for name in sorted(io_sets['in_names']):
+        results[name] = None
+        if store is not None and name in store:
+            results[name] = _result_fingerprint(store[name])
+
+    key = {'cache_version': _CACHE_VERSION,
+           'dynamit_version': version,
+           'task': {tag: value for tag, value in task.items()
+                    if tag not in _CACHE_TAGS},
+           'in_paths': {path: _path_fingerprint(path)
+                        for path in sorted(io_sets['in_paths'])},
+           'in_names': results,
+           'out_paths': sorted(io_sets['out_paths'])}
+    return hashlib.sha256(json.dumps(key, sort_keys=True,
+                                     default=str).encode()).hexdigest()
+
+
+def _cache_restore(cache_dir: str, key: str) -> Optional[dict[str, Any]]:
+    """Restores the results of a task from the task cache. The output files
+    are copied back to their paths, and their folders are created if needed.
+    An entry that cannot be read (e.g. because it was removed from the cache
+    while being restored) is treated as missing.
+
+    Return value:
+    None if the key is not in the cache, and else a dict with the cached
+    results stored by name.
+    """
+
+    entry = os.path.join(cache_dir, key)
+    manifest_path = os.path.join(entry, 'manifest.json')
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    results: dict[str, Any] = {}
+    try:
+        for out_path, file_name in manifest['files']:
+            out_dir = os.path.dirname(out_path)
+            if out_dir:
+                os.makedirs(out_dir, exist_ok=True)
+            shutil.copyfile(os.path.join(entry, file_name), out_path)
+        for name, kind, value in manifest['results']:
+            if kind == 'tac':
+                results[name] = dynamit.load_tac(os.path.join(entry, value))
+            else:
+                results[name] = value
+
+        # Mark the entry as recently used
+        os.utime(manifest_path)
+    except OSError:
+        return None
+    return results
+
+
+def _cache_save(cache_dir: str,
+                key: str,
+                out_paths: Iterable[str],
+                results: dict[str, Any],
+                max_size: int):
+    """Saves the results of a task to the task cache. The entry is written to
+    a temporary folder, which is renamed when it is complete, so a partly
+    written entry is never used. If the cache grows larger than max_size
+    bytes, the least recently used entries are removed.
+
+    Arguments:
+    cache_dir   --  The cache folder.
+    key         --  The key of the task (see _task_cache_key).
+    out_paths   --  The paths of the output files of the task.
+    results     --  The named results of the task, as TAC datasets or plain
+                    values which can be saved to json.
+    max_size    --  The maximum size of the cache in bytes.
+    """
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='.tmp_', dir=cache_dir)
+    manifest: dict[str, Any] = {'files': [], 'results': []}
+    for i, out_path in enumerate(out_paths):
+        file_name = 'file_' + str(i)
+        shutil.copyfile(out_path, os.path.join(tmp_dir, file_name))
+        manifest['files'].append([os.path.abspath(out_path), file_name])
+    for i, (name, value) in enumerate(results.items()):
+        if isinstance(value, dynamit.TAC):
+            file_name = 'result_' + str(i) + '.tac'
+            dynamit.save_tac(value, os.path.join(tmp_dir, file_name),
+                             binary=True)
+            manifest['results'].append([name, 'tac', file_name])
+        else:
+            manifest['results'].append([name, 'json', value])
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+    try:
+        os.rename(tmp_dir, os.path.join(cache_dir, key))
+    except OSError:
+        # The entry was saved by another process
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    _evict_task_cache(cache_dir, max_size)
+
+
+def _evict_task_cache(cache_dir: str, max_size: int):
+    """Removes the least recently used entries of the task cache until the
+    size of the cache is at most max_size bytes.
+    """
+
+    entries = []
+    total = 0
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if not entry.is_dir() or entry.name.startswith('.tmp_'):
+                continue
+            try:
+                used = os.stat(os.path.join(entry.path,
+                                            'manifest.json')).st_mtime_ns
+                size = sum(os.stat(os.path.join(entry.path, name)).st_size
+                           for name in os.listdir(entry.path))
+            except OSError:
+                continue
+            entries.append((used, size, entry.path))
+            total += size
+
+    for used, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def _roi_set(tags: OrderedDict[str, Any]) -> dict[str, Any]:
+    """Reads the tags of a ROI set (<roi_path>, <labels>, <resample> and
+    <crop>) of the ROIMeans task into a dict, which can be passed to
+    dynamit.lazy_series_roi_set_means.
+    """
+
+    # Create label dictionary
+    labels = {}
+    if 'labels' in tags:
+        # This section transforms the string "X,a;Y,b;Z,c" into a dict of the
+        # form {'X': 'a', 'Y': 'b', 'Z': 'c'}
+        label_string = str(tags['labels']).split(';')
+        for label in label_string:
+            label_split = label.split(',')
+            labels[label_split[0]] = label_split[1]
+
+    # Check if resampling is required
+    resample: Optional[str] = None
+    if 'resample' in tags:
+        resample = str(tags['resample'])
+
+    # Check if the images should be cropped to the ROI
+    crop = False
+    if 'crop' in tags:
+        crop = str(tags['crop']).lower() == 'true'
+
+    return {'roi': str(tags['roi_path']),
+            'labels': labels,
+            'resample': resample,
+            'crop': crop}
+
+
+def _roi_destination(tags: OrderedDict[str, Any],
+                     task: OrderedDict[str, Any]) \
+        -> tuple[Optional[str], Optional[str]]:
+    """The output path and the output name (either can be None) of a ROI set
+    of the ROIMeans task. A ROI set uses its own <out_path>- and
+    <out_name>-tags if it has either of them, and else those of the task.
+    """
+
+    source = tags if 'out_path' in tags or 'out_name' in tags else task
+    out_path = str(source['out_path']) if 'out_path' in source else None
+    out_name = str(source['out_name']) if 'out_name' in source else None
+    if out_path is None and out_name is None:
+        raise ValueError("The ROIMeans task needs an <out_path>- or an "
+                         "<out_name>-tag.")
+    return out_path, out_name
+
+
+def _task_roi_means_incremental(task: OrderedDict[str, Any],
+                                img_path: str,
+                                roi_set: dict[str, Any],
+                                out_path: str,
+                                workers: int):
+    """Runs the incremental mode of the ROIMeans task (see task_roi_means).
+    """
+
+    print("Reading new images from ", img_path, ".")
+    print("Reading ROI image from ", roi_set['roi'], ".")
+    args: dict[str, Any] = {'resample': roi_set['resample'],
+                            'labels': roi_set['labels'],
+                            'crop': roi_set['crop'],
+                            'workers': workers}
+    if 'watch_interval' in task:
+        timeout = 60.0
+        if 'watch_timeout' in task:
+            timeout = float(task['watch_timeout'])
+        print("Watching for new images...")
+        n = dynamit.watch_series_roi_means(
+            img_path, roi_set['roi'], out_path,
+            interval=float(task['watch_interval']), timeout=timeout, **args)
+    else:
+        print("Processing...")
+        n = dynamit.incremental_series_roi_means(img_path, roi_set['roi'],
+                                                 out_path, **args)
+    print("... done! Processed", n, "new images.")
+    print()
+    print("Results saved to ", out_path, ".")
+    print()
+
+
+def task_roi_means(task: OrderedDict[str, Any],
+                   store: Optional[dict[str, Any]] = None):
     """Run the ROIMeans task. Loads an image series and a ROI image, and
     computes mean voxel values for each ROI in each time frame. The result
-    is saved to a text file.
+    is saved to a text file, and/or kept in memory under a name, so that
+    later tasks can use it without reading a file.
     The input to the function is an xml structure, which must have the
     following structure (not ordered):
 
@@ -17,64 +364,340 @@ def task_roi_means(task: OrderedDict[str, Any]):
     <labels>ROI_LABEL_1,NEW_LABEL_1;
             ROI_LABEL_2,NEW_LABEL_2;...</labels> <!-- OPTIONAL -->
     <resample>img_OR_roi</resample> <!-- OPTIONAL -->
-    <out_path>PATH_TO_RESULT_FILE</out_path>
+    <crop>true_OR_false</crop> <!-- OPTIONAL -->
+    <workers>NUMBER_OF_WORKER_THREADS</workers> <!-- OPTIONAL -->
+    <index_dir>PATH_TO_SERIES_INDEX_FOLDER</index_dir> <!-- OPTIONAL -->
+    <resample_cache>true_OR_false</resample_cache> <!-- OPTIONAL -->
+    <resample_cache_dir>PATH_TO_FOLDER</resample_cache_dir> <!-- OPTIONAL -->
+    <incremental>true_OR_false</incremental> <!-- OPTIONAL -->
+    <watch_interval>SECONDS</watch_interval> <!-- OPTIONAL -->
+    <watch_timeout>SECONDS</watch_timeout> <!-- OPTIONAL -->
+    <binary>true_OR_false</binary> <!-- OPTIONAL -->
+    <out_path>PATH_TO_RESULT_FILE</out_path> <!-- OPTIONAL -->
+    <out_name>NAME_OF_RESULT</out_name> <!-- OPTIONAL -->
+    <cache>true_OR_false</cache> <!-- OPTIONAL -->
+    <cache_dir>PATH_TO_CACHE_FOLDER</cache_dir> <!-- OPTIONAL -->
+    <cache_size>MEGABYTES</cache_size> <!-- OPTIONAL -->
 
+    The image series can be a folder of dicom files, a memory-mapped series
+    (see the SeriesMemmap task) or a single multi-frame dicom file.
     With the <labels>-tag, new labels can be chosen if the ROI-labels in the
     ROI-file are no descriptive.
+    At least one of the <out_path>- and <out_name>-tags must be given. With
+    the <out_name>-tag the result is stored as a TAC dataset under that name
+    in the store of named results, where it can be used as the input of
+    later tasks (e.g. with the <tac_name>-tag of the TACFit task). The result
+    is only saved to a file if the <out_path>-tag is given.
     The <resample>-tag can be used to resample either the images in the
     series to the ROI image (use the value 'img') or the other way around
     (use the value 'roi'). This is a mandatory input if the two images are
     not in the same physical space.
+    With <crop>true</crop> only the bounding box of the ROI is read from each
+    image, and the background (label 0) is not included in the result.
+    The <workers>-tag sets the number of threads loading and processing
+    images concurrently (default 1).
+    The <index_dir>-tag sets the folder where the series index is stored (see
+    dynamit.scan_dynamic_series).
+    With <resample_cache>true</resample_cache> the voxel mapping of the images
+    resampled with <resample>img</resample> is cached on disk, so that later
+    runs with the same image and ROI geometries do not compute it again (see
+    dynamit.NearestNeighbourResampler). The <resample_cache_dir>-tag sets the
+    folder of the cached voxel mappings.
+    With <incremental>true</incremental> a manifest of the processed dicom
+    files is kept next to the result file, and only images not processed by
+    an earlier run are read and appended to the result file (see
+    dynamit.incremental_series_roi_means). With the <watch_interval>-tag the
+    folder is polled for new images every given number of seconds, until no
+    new images have arrived for <watch_timeout> seconds (default 60) (see
+    dynamit.watch_series_roi_means). The incremental mode requires a folder
+    of dicom files and a single ROI file.
+    With <binary>true</binary> the result is saved in the binary TAC format
+    together with the paths of the images and the ROI file (see
+    dynamit.save_tac). This cannot be combined with the incremental mode.
+    With <cache>true</cache> the results are saved in a cache, and a later
+    run of the same task restores the results from the cache instead of
+    reading the images, as long as the tags of the task, the size and
+    modification time of the input files, the named results used and the
+    dynamit version are the same. The <cache_dir>-tag sets the cache folder
+    (by default the folder 'task_results' in the dynamit cache directory),
+    and the <cache_size>-tag sets the maximum size of the cache in megabytes
+    (default 1024), above which the least recently used results are removed.
+    The cache is not used in the incremental mode.
+
+    Several ROI files can be processed in a single pass over the images by
+    replacing the <roi_path>, <labels>, <resample> and <crop> tags with a
+    <roi>-tag for each ROI file:
+
+    <roi>
+        <roi_path>PATH_TO_ROI_IMAGE_FILE</roi_path>
+        <labels>...</labels> <!-- OPTIONAL -->
+        <resample>img_OR_roi</resample> <!-- OPTIONAL -->
+        <crop>true_OR_false</crop> <!-- OPTIONAL -->
+        <out_path>PATH_TO_RESULT_FILE</out_path> <!-- OPTIONAL -->
+        <out_name>NAME_OF_RESULT</out_name> <!-- OPTIONAL -->
+    </roi>
+    ...
+
+    A ROI file with its own <out_path>- or <out_name>-tag is saved to its own
+    file or result. The results of the other ROI files are merged into the
+    file or result given by the <out_path>- and <out_name>-tags of the task.
+    The labels in a merged result must be unique.
+
+    Arguments:
+    task    --  The task.
+    store   --  The named results of the tasks, which the results named by
+                <out_name>-tags are added to. Optional.
     """
 
     print("Starting image read and ROI-mean calculation.")
 
-    # Get the image and output paths
+    # Get the image path
     img_path = str(task['img_path'])
-    roi_path = str(task['roi_path'])
-    out_path = str(task['out_path'])
 
-    # Create label dictionary
-    labels = {}
-    if 'labels' in task:
-        # This section transforms the string "X,a;Y,b;Z,c" into a dict of the
-        # form {'X': 'a', 'Y': 'b', 'Z': 'c'}
-        label_string = str(task['labels']).split(';')
-        for label in label_string:
-            label_split = label.split(',')
-            labels[label_split[0]] = label_split[1]
+    # Get the ROI sets and their output paths and names
+    roi_sets = []
+    destinations = []
+    if 'roi' in task:
+        for tags in _as_list(task['roi']):
+            roi_sets.append(_roi_set(tags))
+            destinations.append(_roi_destination(tags, task))
+    else:
+        roi_sets.append(_roi_set(task))
+        destinations.append(_roi_destination(task, task))
 
-    # Check if resampling is required
-    resample: Optional[str] = None
-    if 'resample' in task:
-        resample = str(task['resample'])
+    # Get number of worker threads
+    workers = 1
+    if 'workers' in task:
+        workers = int(task['workers'])
+
+    # Get series index folder
+    index_dir: Optional[str] = None
+    if 'index_dir' in task:
+        index_dir = str(task['index_dir'])
+
+    # Check if the voxel mapping of the resampling should be cached
+    resample_cache = False
+    if 'resample_cache' in task:
+        resample_cache = str(task['resample_cache']).lower() == 'true'
+    resample_cache_dir: Optional[str] = None
+    if 'resample_cache_dir' in task:
+        resample_cache_dir = str(task['resample_cache_dir'])
+
+    # Check if only new images should be processed
+    incremental = 'watch_interval' in task
+    if 'incremental' in task:
+        incremental = incremental \
+            or str(task['incremental']).lower() == 'true'
+    # Check if the result should be saved in the binary format
+    binary = False
+    if 'binary' in task:
+        binary = str(task['binary']).lower() == 'true'
+
+    if incremental:
+        if binary:
+            raise ValueError("The incremental mode only saves text "
+                             "TAC-files.")
+        if len(roi_sets) != 1:
+            raise ValueError("The incremental mode requires a single ROI "
+                             "file.")
+        out_path, out_name = destinations[0]
+        if out_path is None or out_name is not None:
+            raise ValueError("The incremental mode only saves to the file "
+                             "given by the <out_path>-tag.")
+        _task_roi_means_incremental(task, img_path, roi_sets[0], out_path,
+                                    workers)
+        return
+
+    # Restore the results from the cache if the task has not changed
+    cache = _task_cache(task)
+    if cache is not None:
+        key = _task_cache_key(task, store)
+        restored = _cache_restore(cache[0], key)
+        if restored is not None:
+            print("Results restored from the cache.")
+            for name, tac in restored.items():
+                if store is not None:
+                    store[name] = tac
+                    print("Result stored as ", name, ".")
+            return
 
     print("Reading images from ", img_path, ".")
-    print("Reading ROI image from ", roi_path, ".")
+    for roi_set in roi_sets:
+        print("Reading ROI image from ", roi_set['roi'], ".")
     print("Processing...")
     # Run the task!
-    dyn = dynamit.lazy_series_roi_means(img_path,
-                                        roi_path,
-                                        resample=resample,
-                                        labels=labels)
+    results = dynamit.lazy_series_roi_set_means(img_path,
+                                                roi_sets,
+                                                workers=workers,
+                                                index_dir=index_dir,
+                                                use_cache=resample_cache,
+                                                cache_dir=resample_cache_dir)
     print("... done!")
     print()
 
-    print("Saving images to file ", out_path, ".")
-    print("Saving...")
-    # Save file to disk
-    dynamit.save_tac(dyn, out_path)
+    # Merge the results saved to the same file or name
+    merged: dict[tuple[Optional[str], Optional[str]],
+                 dict[str, npt.NDArray[np.float64]]] = {}
+    roi_paths: dict[tuple[Optional[str], Optional[str]], list[str]] = \
+        defaultdict(list)
+    for dest, dyn, roi_set in zip(destinations, results, roi_sets):
+        roi_paths[dest].append(str(roi_set['roi']))
+        if dest not in merged:
+            merged[dest] = {label: values for label, values in dyn.items()}
+            continue
+        for label, values in dyn.items():
+            if label == 'tacq':
+                continue
+            if label in merged[dest]:
+                raise ValueError("The label " + label + " occurs in more "
+                                 "than one ROI file saved to " +
+                                 str(dest[0] if dest[0] is not None
+                                     else dest[1]) + ".")
+            merged[dest][label] = values
+
+    cache_files = []
+    cache_results = {}
+    for (out_path, out_name), tac in merged.items():
+        if out_name is not None:
+            # Keep the result in memory for later tasks
+            cache_results[out_name] = dynamit.TAC.from_dict(tac)
+            if store is not None:
+                store[out_name] = cache_results[out_name]
+                print("Result stored as ", out_name, ".")
+        if out_path is None:
+            continue
+        print("Saving images to file ", out_path, ".")
+        print("Saving...")
+        # Save file to disk
+        if binary:
+            dynamit.save_tac(tac, out_path, binary=True,
+                             units={'tacq': 's'},
+                             metadata={'img_path': img_path,
+                                       'roi_path':
+                                           roi_paths[(out_path, out_name)]})
+        else:
+            dynamit.save_tac(tac, out_path)
+        cache_files.append(out_path)
+        print("... done!")
+
+    if cache is not None:
+        _cache_save(cache[0], key, cache_files, cache_results, cache[1])
+
+
+def task_series_memmap(task: OrderedDict[str, Any],
+                       store: Optional[dict[str, Any]] = None):
+    """Run the SeriesMemmap task. Converts a dynamic image series (dicom
+    files or a multi-frame dicom file) to a memory-mapped series, which can be
+    used as the image series of the other tasks without decoding the dicom
+    files again (see dynamit.save_series_memmap).
+    The input is an xml-structure, which must have the following content (in
+    any order):
+
+    <img_path>PATH_TO_IMAGE_SERIES</img_path>
+    <out_path>PATH_TO_MEMMAP_FILE</out_path>
+
+    The images are saved in the file given by <out_path> (usually with the
+    extension .npy), and the acquisition times and image geometry are saved
+    in a metadata file with the extension .json added.
+
+    Arguments:
+    task    --  The task.
+    store   --  The named results of the tasks (not used by this task).
+    """
+
+    img_path = str(task['img_path'])
+    out_path = str(task['out_path'])
+
+    print("Converting images from ", img_path, " to ", out_path, ".")
+    dynamit.save_series_memmap(img_path, out_path)
     print("... done!")
 
 
-def task_tac_fit(task: OrderedDict[str, Any]):
+def _as_list(value: Any) -> list[Any]:
+    """Returns the value of an xml tag as a list. xmltodict only creates a list
+    when a tag is repeated, so a single value is put in a list.
+    """
+
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def _series_frames(img_path: str, t_cut: Optional[int] = None) \
+        -> tuple[Iterable[sitk.Image], sitk.Image]:
+    """Prepares the images of a dynamic series for a voxel-wise task. The
+    series can be a folder of dicom files, in which case the images are read
+    one at a time, a memory-mapped series (see dynamit.save_series_memmap) or
+    a multi-frame dicom file (see dynamit.load_multiframe_series).
+
+    Return value:
+    A tuple with the images (in order of acquisition, as an iterable) and the
+    first image (to be used as a reference image).
+    """
+
+    if os.path.isfile(img_path):
+        frames = dynamit.load_series_file(img_path)['img'][0:t_cut]
+        return frames, frames[0]
+    names = dynamit.scan_dynamic_series(img_path)['files'][0:t_cut]
+    return (sitk.ReadImage(name) for name in names), \
+        sitk.ReadImage(names[0])
+
+
+def _fit_params(task: OrderedDict[str, Any]) -> dict[str, dict[str, float]]:
+    """Reads the <param>-tags of a fit task into a dict with the parameter
+    names as keys, which can be passed to dynamit.tac_fit.
+    """
+
+    params = {}
+    for param in _as_list(task['param']):
+        # Initial parameter value
+        param_dict = {'value': float(param['init'])}
+        # Optional parameter minimum
+        if 'min' in param:
+            param_dict['min'] = float(param['min'])
+        # Optional parameter maximum
+        if 'max' in param:
+            param_dict['max'] = float(param['max'])
+        # Get parameter name and store in dict
+        params[str(param['name'])] = param_dict
+    return params
+
+
+def _task_tac(task: OrderedDict[str, Any],
+              store: Optional[dict[str, Any]]) -> dynamit.TAC:
+    """Gets the TAC of a task. If the task has a <tac_name>-tag, the TAC is
+    the result with that name in the store of named results (e.g. from the
+    <out_name>-tag of a ROIMeans task). Otherwise it is loaded from the file
+    given by the <tac_path>-tag, or, if the task has a <tac_key>-tag, it is
+    the dataset with that key in the TAC archive given by the <tac_path>-tag
+    (see dynamit.load_tac_archive).
+    """
+
+    if 'tac_name' in task:
+        tac_name = str(task['tac_name'])
+        if store is None or tac_name not in store:
+            raise ValueError("There is no result named " + tac_name + ".")
+        print("Using TAC-data ", tac_name, ".")
+        return dynamit.TAC.from_dict(store[tac_name])
+
+    tac_path = str(task['tac_path'])
+    print("Loading TAC-data from", tac_path, "...")
+    if 'tac_key' in task:
+        return dynamit.load_tac_archive(tac_path, str(task['tac_key']))
+    return dynamit.load_tac(tac_path)
+
+
+def task_tac_fit(task: OrderedDict[str, Any],
+                 store: Optional[dict[str, Any]] = None):
     """Run the TACFit task. Fits model parameters to a measured TAC. The fit
     is shown in standard out and a figure of the fitted curve and the data is
-    shown.
+    shown, unless the task runs in a worker process (see dynamit.__main__).
     The input is an xml-structure, which must have the following content (in
     any order):
 
     <tac_path>PATH_TO_TAC_FILE</tac_path>
+    <tac_key>KEY_OF_DATASET_IN_TAC_ARCHIVE</tac_key> <!-- OPTIONAL -->
+    <tac_name>NAME_OF_TAC_RESULT</tac_name> <!-- INSTEAD OF <tac_path> -->
     <time_label>LABEL_OF_TIME_DATA</time_label>
     <inp_label>LABEL_OF_INPUT_FUNCTION_DATA</inp_label>
     <tis_label>LABEL_OF_TISSUE_DATA</tis_label>
@@ -90,13 +713,35 @@ def task_tac_fit(task: OrderedDict[str, Any]):
         <init>PARAM2_INIT_VALUE</init>
     </param>
     ...
+
+    <out_name>NAME_OF_FIT_RESULT</out_name> <!-- OPTIONAL -->
+    <fig_path>PATH_TO_FIGURE_FILE</fig_path> <!-- OPTIONAL -->
+    <cache>true_OR_false</cache> <!-- OPTIONAL -->
+    <cache_dir>PATH_TO_CACHE_FOLDER</cache_dir> <!-- OPTIONAL -->
+    <cache_size>MEGABYTES</cache_size> <!-- OPTIONAL -->
+
+    With the <tac_key>-tag the TAC is the dataset with the given key in the
+    TAC archive <tac_path> (see dynamit.append_tac_archive).
+    With the <tac_name>-tag the TAC is the result with the given name from
+    an earlier task (e.g. the <out_name>-tag of the ROIMeans task), and no
+    file is read.
+    With the <out_name>-tag the best fit values of the parameters are stored
+    under the given name in the store of named results (as a dict, see
+    dynamit.tac_fit_batch).
+    With the <fig_path>-tag the figure is saved to the given file (in a
+    format given by the file extension, e.g. png or pdf). When the tasks are
+    run in worker processes the figure is only saved, and not shown.
+    With <cache>true</cache> the fit is saved in a cache, and a later run of
+    the same task shows the fit from the cache instead of fitting again (see
+    the ROIMeans task for the cache tags).
+
+    Arguments:
+    task    --  The task.
+    store   --  The named results of the tasks. Optional.
     """
 
     print("Starting TAC-fitting.")
 
-    # Get the data path
-    tac_path = str(task['tac_path'])
-
     # Get labels of relevant TACs
     inp_label = str(task['inp_label'])
     time_label = str(task['time_label'])
@@ -106,60 +751,54 @@ def task_tac_fit(task: OrderedDict[str, Any]):
     fit_model = str(task['model'])
 
     # Load TAC data
-    print("Loading TAC-data from", tac_path, "...")
-    tac = dynamit.load_tac(tac_path)
+    tac = _task_tac(task, store)
     print("... done!")
     print()
 
     # Get tcut if required
-    t_cut = len(tac[time_label])
+    t_cut = tac.rows
     if 'tcut' in task:
         t_cut = int(task['tcut'])
 
     print("Fitting TAC data to model ", fit_model, ".")
 
-    # Dict of possible models
-    models = {
-        'step2': dynamit.model_step_2,
-        'fermi2': dynamit.model_fermi_2,
-        'step_fermi': dynamit.model_step_fermi,
-        'step': dynamit.model_step,
-        'patlak': dynamit.model_patlak
-    }
-
     # Put parameters into a dict
-    params = {}
-    for param in task['param']:
-        # Initial parameter value
-        param_dict = {'value': float(param['init'])}
-        # Optional parameter minimum
-        if 'min' in param:
-            param_dict['min'] = float(param['min'])
-        # Optional parameter maximum
-        if 'max' in param:
-            param_dict['max'] = float(param['max'])
-        # Get parameter name and store in dict
-        params[param['name']] = param_dict
+    params = _fit_params(task)
 
-    # Create lmfit Parameters-object
-    parameters = lmfit.create_params(**params)
+    # Restore the fit from the cache if the task has not changed
+    cache = _task_cache(task)
+    restored = None
+    if cache is not None:
+        key = _task_cache_key(task, store)
+        restored = _cache_restore(cache[0], key)
 
-    # Define model to fit
-    model = lmfit.Model(models[fit_model], independent_vars=['t', 'in_func'])
-    # Run fit from initial values
-    res = model.fit(tac[tis_label][0:t_cut], t=tac[time_label][0:t_cut],
-                    in_func=tac[inp_label][0:t_cut],
-                    params=parameters)
+    if restored is not None:
+        print("Fit restored from the cache.")
+        summary = restored['summary']
+        report = restored['report']
+        curves = restored['curves']
+    else:
+        # Run fit from initial values
+        res = dynamit.tac_fit(tac, time_label, inp_label, tis_label,
+                              fit_model, params, t_cut=t_cut)
+        summary = dynamit.fit_summary(res)
+        report = lmfit.fit_report(res)
+        # Best fitting model and the confidence and prediction intervals
+        e_fit, p_fit = dynamit.tac_fit_uncertainty(res, fit_model, sigma=2)
+        curves = dynamit.TAC([res.best_fit, e_fit, p_fit],
+                             ['best_fit', 'e_fit', 'p_fit'])
+        if cache is not None:
+            _cache_save(cache[0], key, [],
+                        {'summary': summary, 'report': report,
+                         'curves': curves}, cache[1])
 
     # Report!
-    lmfit.report_fit(res)
-    # Calculate best fitting model
-    best_fit = models[fit_model](t=tac[time_label][0:t_cut],  # type: ignore
-                                 in_func=list(tac[inp_label][0:t_cut]),
-                                 **res.best_values)
-    # Calculate prediction interval
-    e_fit = res.eval_uncertainty(t=tac[time_label][0:t_cut], sigma=2)
-    p_fit = res.dely_predicted
+    print(report)
+    if 'out_name' in task and store is not None:
+        store[str(task['out_name'])] = summary
+    best_fit = curves['best_fit']
+    e_fit = curves['e_fit']
+    p_fit = curves['p_fit']
 
     print("... done!")
     print()
@@ -180,8 +819,280 @@ def task_tac_fit(task: OrderedDict[str, Any]):
     ax.set_xlabel('Time [sec]')
     ax.set_ylabel('Mean ROI-activity concentration [Bq/mL]')
 
-    plt.legend()
-    plt.grid(visible=True)
-    plt.show()
+    ax.legend()
+    ax.grid(visible=True)
+    if 'fig_path' in task:
+        fig.savefig(str(task['fig_path']))
+    # A worker process has no display to show the figure on
+    if multiprocessing.parent_process() is None:
+        plt.show()
+    plt.close(fig)
+    print("... done!")
+    print()
+
+
+def task_tac_fit_batch(task: OrderedDict[str, Any],
+                       store: Optional[dict[str, Any]] = None):
+    """Run the TACFitBatch task. Fits the same model with the same initial
+    parameters to many TAC-files, spread over a number of worker processes.
+    The results of all fits are saved to a single tab-separated text file with
+    one row per TAC-file, in the same order as the TAC-files.
+    The input is an xml-structure, which must have the following content (in
+    any order):
+
+    <tac_path>PATH_OR_GLOB_PATTERN_1</tac_path>
+    <tac_path>PATH_OR_GLOB_PATTERN_2</tac_path>
+    ...
+    <time_label>LABEL_OF_TIME_DATA</time_label>
+    <inp_label>LABEL_OF_INPUT_FUNCTION_DATA</inp_label>
+    <tis_label>LABEL_OF_TISSUE_DATA</tis_label>
+    <model>FIT_MODEL</model>
+    <param>
+        <name>PARAM1_NAME</name>
+        <init>PARAM1_INIT_VALUE</init>
+        <min>PARAM1_MIN_VALUE</min> <!-- OPTIONAL -->
+        <max>PARAM1_MAX_VALUE</max> <!-- OPTIONAL -->
+    </param>
+    ...
+    <tcut>NUMBER_OF_TIME_POINTS</tcut> <!-- OPTIONAL -->
+    <workers>NUMBER_OF_WORKER_PROCESSES</workers> <!-- OPTIONAL -->
+    <out_path>PATH_TO_RESULT_FILE</out_path> <!-- OPTIONAL -->
+    <out_name>NAME_OF_RESULT</out_name> <!-- OPTIONAL -->
+
+    Each <tac_path> can be a glob pattern (e.g. data/*/tac.txt). The files
+    matching a pattern are sorted by name. By default a single worker is used.
+    With the <out_name>-tag the results of the fits (see
+    dynamit.tac_fit_batch) are stored under the given name in the store of
+    named results. The results are only saved to a file if the
+    <out_path>-tag is given.
+
+    Arguments:
+    task    --  The task.
+    store   --  The named results of the tasks. Optional.
+    """
+
+    print("Starting batch TAC-fitting.")
+
+    # Expand the paths of the TAC-files
+    tac_paths = []
+    for pattern in _as_list(task['tac_path']):
+        tac_paths.extend(sorted(glob.glob(str(pattern))))
+
+    # Get labels of relevant TACs
+    inp_label = str(task['inp_label'])
+    time_label = str(task['time_label'])
+    tis_label = str(task['tis_label'])
+
+    # Get required fit model
+    fit_model = str(task['model'])
+
+    # Put parameters into a dict
+    params = _fit_params(task)
+
+    # Get tcut if required
+    t_cut: Optional[int] = None
+    if 'tcut' in task:
+        t_cut = int(task['tcut'])
+
+    # Get number of worker processes
+    workers = 1
+    if 'workers' in task:
+        workers = int(task['workers'])
+
+    print("Fitting", len(tac_paths), "TAC-files to model ", fit_model,
+          "using", workers, "worker(s).")
+    res = dynamit.tac_fit_batch(tac_paths, time_label, inp_label, tis_label,
+                                fit_model, params, t_cut=t_cut,
+                                workers=workers)
+    for r in res:
+        if not r['success']:
+            print("Fit failed for", r['tac_path'], ":",
+                  r.get('error', "no convergence"))
+    print("... done!")
+    print()
+
+    if 'out_name' in task and store is not None:
+        store[str(task['out_name'])] = res
+
+    if 'out_path' in task:
+        out_path = str(task['out_path'])
+        print("Saving fit results to file ", out_path, ".")
+        dynamit.save_fit_table(res, list(params), out_path)
+        print("... done!")
+
+
+def task_patlak_map(task: OrderedDict[str, Any],
+                    store: Optional[dict[str, Any]] = None):
+    """Run the PatlakMap task. Fits the Patlak-model to the time series of
+    every voxel in a dynamic image series and saves parametric images of the
+    model parameters k1 and v0 (e.g. as .nrrd-files). The input function is
+    read from a TAC-file, which must have the same time points as the image
+    series (e.g. from the ROIMeans task).
+    The input is an xml-structure, which must have the following content (in
+    any order):
+
+    <img_path>PATH_TO_IMAGE_SERIES</img_path>
+    <tac_path>PATH_TO_TAC_FILE</tac_path>
+    <tac_key>KEY_OF_DATASET_IN_TAC_ARCHIVE</tac_key> <!-- OPTIONAL -->
+    <tac_name>NAME_OF_TAC_RESULT</tac_name> <!-- INSTEAD OF <tac_path> -->
+    <time_label>LABEL_OF_TIME_DATA</time_label>
+    <inp_label>LABEL_OF_INPUT_FUNCTION_DATA</inp_label>
+    <tcut>NUMBER_OF_TIME_POINTS</tcut> <!-- OPTIONAL -->
+    <k1_path>PATH_TO_K1_IMAGE</k1_path>
+    <v0_path>PATH_TO_V0_IMAGE</v0_path>
+    <rms_path>PATH_TO_RESIDUAL_IMAGE</rms_path> <!-- OPTIONAL -->
+
+    The image series can be a folder of dicom files, a memory-mapped series
+    (see the SeriesMemmap task) or a single multi-frame dicom file.
+    With the <tcut>-tag only the first images of the series are used.
+    The <rms_path>-tag saves the root-mean-square residual of each voxel fit.
+    With the <tac_key>-tag the TAC is read from a TAC archive, and with the
+    <tac_name>-tag it is the result of an earlier task (see the TACFit task).
+
+    Arguments:
+    task    --  The task.
+    store   --  The named results of the tasks. Optional.
+    """
+
+    print("Starting voxel-wise Patlak fitting.")
+
+    img_path = str(task['img_path'])
+    time_label = str(task['time_label'])
+    inp_label = str(task['inp_label'])
+
+    # Load TAC data
+    tac = _task_tac(task, store)
     print("... done!")
     print()
+
+    # Get tcut if required
+    t_cut = tac.rows
+    if 'tcut' in task:
+        t_cut = int(task['tcut'])
+
+    # Images are loaded one at a time while fitting
+    series = _series_frames(img_path, t_cut)[0]
+
+    print("Reading images from ", img_path, ".")
+    print("Processing...")
+    fit_tac = tac.window(0, t_cut)
+    maps = dynamit.patlak_map(series, fit_tac[time_label],
+                              fit_tac[inp_label])
+    print("... done!")
+    print()
+
+    print("Saving parametric images...")
+    sitk.WriteImage(maps['k1'], str(task['k1_path']))
+    sitk.WriteImage(maps['v0'], str(task['v0_path']))
+    if 'rms_path' in task:
+        sitk.WriteImage(maps['rms'], str(task['rms_path']))
+    print("... done!")
+
+
+def task_parametric_map(task: OrderedDict[str, Any],
+                        store: Optional[dict[str, Any]] = None):
+    """Run the ParametricMap task. Fits a model to the time series of every
+    voxel in a dynamic image series, optionally restricted to the voxels
+    inside a mask, and saves a parametric image (.nrrd-file) of each model
+    parameter and of the root-mean-square residual of the fits. The input
+    function is read from a TAC-file, which must have the same time points as
+    the image series (e.g. from the ROIMeans task).
+    The input is an xml-structure, which must have the following content (in
+    any order):
+
+    <img_path>PATH_TO_IMAGE_SERIES</img_path>
+    <tac_path>PATH_TO_TAC_FILE</tac_path>
+    <tac_key>KEY_OF_DATASET_IN_TAC_ARCHIVE</tac_key> <!-- OPTIONAL -->
+    <tac_name>NAME_OF_TAC_RESULT</tac_name> <!-- INSTEAD OF <tac_path> -->
+    <time_label>LABEL_OF_TIME_DATA</time_label>
+    <inp_label>LABEL_OF_INPUT_FUNCTION_DATA</inp_label>
+    <model>FIT_MODEL</model>
+    <param>
+        <name>PARAM1_NAME</name>
+        <init>PARAM1_INIT_VALUE</init>
+        <min>PARAM1_MIN_VALUE</min> <!-- OPTIONAL -->
+        <max>PARAM1_MAX_VALUE</max> <!-- OPTIONAL -->
+    </param>
+    ...
+    <mask_path>PATH_TO_MASK_IMAGE</mask_path> <!-- OPTIONAL -->
+    <tcut>NUMBER_OF_TIME_POINTS</tcut> <!-- OPTIONAL -->
+    <chunk_size>NUMBER_OF_VOXELS_PER_CHUNK</chunk_size> <!-- OPTIONAL -->
+    <workers>NUMBER_OF_WORKER_PROCESSES</workers> <!-- OPTIONAL -->
+    <out_dir>PATH_TO_OUTPUT_DIRECTORY</out_dir>
+
+    The image series can be a folder of dicom files, a memory-mapped series
+    (see the SeriesMemmap task) or a single multi-frame dicom file.
+    The mask can e.g. be a ROI labelmap, in which case all labelled voxels are
+    fitted. It is resampled to the space of the image series.
+    The images are saved in the output directory as PARAM_NAME.nrrd and
+    rms.nrrd.
+    With the <tac_key>-tag the TAC is read from a TAC archive, and with the
+    <tac_name>-tag it is the result of an earlier task (see the TACFit task).
+
+    Arguments:
+    task    --  The task.
+    store   --  The named results of the tasks. Optional.
+    """
+
+    print("Starting voxel-wise model fitting.")
+
+    img_path = str(task['img_path'])
+    time_label = str(task['time_label'])
+    inp_label = str(task['inp_label'])
+    fit_model = str(task['model'])
+    out_dir = str(task['out_dir'])
+
+    # Put parameters into a dict
+    params = _fit_params(task)
+
+    # Load TAC data
+    tac = _task_tac(task, store)
+    print("... done!")
+    print()
+
+    # Get tcut if required
+    t_cut = tac.rows
+    if 'tcut' in task:
+        t_cut = int(task['tcut'])
+
+    chunk_size = 1024
+    if 'chunk_size' in task:
+        chunk_size = int(task['chunk_size'])
+
+    workers = 1
+    if 'workers' in task:
+        workers = int(task['workers'])
+
+    # Images are loaded one at a time while copying them to shared memory
+    series, ref = _series_frames(img_path, t_cut)
+
+    # Read and resample the mask if required
+    mask: Optional[sitk.Image] = None
+    if 'mask_path' in task:
+        print("Reading mask image from ", str(task['mask_path']), ".")
+        resampler = sitk.ResampleImageFilter()
+        resampler.SetReferenceImage(ref)
+        resampler.SetInterpolator(sitk.sitkNearestNeighbor)
+        mask = resampler.Execute(sitk.ReadImage(str(task['mask_path'])))
+
+    print("Reading images from ", img_path, ".")
+    print("Fitting model ", fit_model, "using", workers, "worker(s).")
+    start = time.perf_counter()
+    fit_tac = tac.window(0, t_cut)
+    maps = dynamit.parametric_map(series, fit_tac[time_label],
+                                  fit_tac[inp_label], fit_model, params,
+                                  mask=mask, chunk_size=chunk_size,
+                                  workers=workers)
+    elapsed = time.perf_counter() - start
+    n_voxels = int(np.count_nonzero(
+        ~np.isnan(sitk.GetArrayViewFromImage(maps['rms']))))
+    print("Fitted", n_voxels, "voxels in", round(elapsed, 1), "seconds (",
+          round(n_voxels / max(elapsed, 1e-9), 1), "voxels per second ).")
+    print("... done!")
+    print()
+
+    print("Saving parametric images to ", out_dir, ".")
+    os.makedirs(out_dir, exist_ok=True)
+    for name, img in maps.items():
+        sitk.WriteImage(img, os.path.join(out_dir, name + '.nrrd'))
+    print("... done!")
@@ -1 +1,7 @@
 # This is a meaningless comment
+import atexit
+from test import util
+
+# All tests use a temporary dynamit cache directory
+util.use_temp_cache_dir()
+atexit.register(util.restore_cache_dir)
@@ -1,7 +1,9 @@
 import os
+import shutil
 import unittest
 from datetime import datetime
 import dynamit
+import numpy as np
 from typing import Union
 
 
@@ -21,6 +23,10 @@ class TestGetAcqDateTime(unittest.TestCase):
         dt = dynamit.get_acq_datetime(dcm_path)
         self.assertEqual(dt, datetime(2023, 12, 1, 13, 30, 40, 800000))
 
+    def test_parse_acq_datetime(self):
+        dt = dynamit.parse_acq_datetime('20231201', '133028.0')
+        self.assertEqual(dt, datetime(2023, 12, 1, 13, 30, 28, 0))
+
 
 class TestShiftTime(unittest.TestCase):
 
@@ -48,10 +54,150 @@ class TestSaveLoadTAC(unittest.TestCase):
              }
         dynamit.save_tac(tac, os.path.join('test', 'tac.txt'))
         tac2 = dynamit.load_tac(os.path.join('test', 'tac.txt'))
-        self.assertEqual(tac2['tacq'], [0.0, 1.2, 5.4])
-        self.assertEqual(tac2['1'], [1.0, 2.0, 3.0])
-        self.assertEqual(tac2['2'], [0.5, 0.1, 3.0])
+        self.assertEqual(list(tac2['tacq']), [0.0, 1.2, 5.4])
+        self.assertEqual(list(tac2['1']), [1.0, 2.0, 3.0])
+        self.assertEqual(list(tac2['2']), [0.5, 0.1, 3.0])
+
+    def test_save_load_tac_single_row(self):
+        dynamit.save_tac({'tacq': [0.0], '1': [2.5]},
+                         os.path.join('test', 'tac.txt'))
+        tac = dynamit.load_tac(os.path.join('test', 'tac.txt'))
+        self.assertEqual(tac, {'tacq': [0.0], '1': [2.5]})
+
+    def test_save_load_tac_binary(self):
+        tac: dict[Union[str, int], list[float]] = \
+            {'tacq': [0.0, 1.2, 5.4],
+             1: [1.0, 2.0, 3.0],
+             '2': [0.5, 0.1, 3.0]
+             }
+        path = os.path.join('test', 'tac.bin')
+        dynamit.save_tac(tac, path, binary=True, units={'tacq': 's'},
+                         metadata={'img_path': 'series'})
+        tac2 = dynamit.load_tac(path)
+        self.assertEqual(list(tac2), ['tacq', '1', '2'])
+        self.assertEqual(list(tac2['tacq']), [0.0, 1.2, 5.4])
+        self.assertEqual(list(tac2['1']), [1.0, 2.0, 3.0])
+        self.assertEqual(list(tac2['2']), [0.5, 0.1, 3.0])
+
+        # The columns are views of the same buffer
+        self.assertIs(tac2['1'].base, tac2['2'].base)
+
+        info = dynamit.load_tac_info(path)
+        self.assertEqual(info['labels'], ['tacq', '1', '2'])
+        self.assertEqual(info['rows'], 3)
+        self.assertEqual(info['units'], {'tacq': 's'})
+        self.assertEqual(info['metadata'], {'img_path': 'series'})
+
+    def test_load_tac_info_text(self):
+        dynamit.save_tac({'tacq': [0.0]}, os.path.join('test', 'tac.txt'))
+        with self.assertRaises(ValueError):
+            dynamit.load_tac_info(os.path.join('test', 'tac.txt'))
 
     def tearDown(self):
-        if os.path.exists(os.path.join('test', 'tac.txt')):
-            os.remove(os.path.join('test', 'tac.txt'))
+        for name in ['tac.txt', 'tac.bin']:
+            if os.path.exists(os.path.join('test', name)):
+                os.remove(os.path.join('test', name))
+
+
+class TestTAC(unittest.TestCase):
+
+    def setUp(self):
+        self.tac = dynamit.TAC.from_dict({'tacq': [0.0, 1.0, 2.0, 4.0],
+                                          1: [5.0, 6.0, 7.0, 8.0]})
+
+    def test_columns(self):
+        self.assertEqual(list(self.tac), ['tacq', '1'])
+        self.assertEqual(len(self.tac), 2)
+        self.assertEqual(self.tac.rows, 4)
+        self.assertEqual(list(self.tac['1']), [5.0, 6.0, 7.0, 8.0])
+        self.assertIs(self.tac['1'].base, self.tac.data)
+        self.assertEqual(self.tac.to_dict(),
+                         {'tacq': [0.0, 1.0, 2.0, 4.0],
+                          '1': [5.0, 6.0, 7.0, 8.0]})
+        self.assertEqual(self.tac, {'1': [5.0, 6.0, 7.0, 8.0],
+                                    'tacq': [0.0, 1.0, 2.0, 4.0]})
+        self.assertIs(dynamit.TAC.from_dict(self.tac), self.tac)
+
+    def test_window(self):
+        window = self.tac.window(1, 3)
+        self.assertEqual(window.rows, 2)
+        self.assertEqual(list(window['1']), [6.0, 7.0])
+        self.assertTrue(np.shares_memory(window.data, self.tac.data))
+
+        window = self.tac.time_window(1.0, 3.0)
+        self.assertEqual(list(window['tacq']), [1.0, 2.0])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            dynamit.TAC.from_dict({'tacq': [0.0, 1.0], '1': [1.0]})
+        with self.assertRaises(ValueError):
+            dynamit.TAC(np.zeros((2, 3)), ['a', 'a'])
+        with self.assertRaises(ValueError):
+            dynamit.TAC(np.zeros((2, 3)), ['a'])
+
+
+class TestTACArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join('test', 'out_archive.tar')
+        self.out_dir = os.path.join('test', 'out_export')
+        self.tacs = {'p1/s1': {'tacq': [0.0, 1.0, 2.0], '1': [1.0, 2.0, 3.0]},
+                     'p2/s1': {'tacq': [0.0, 2.0], '1': [4.0, 5.0]}}
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        shutil.rmtree(self.out_dir, ignore_errors=True)
+
+    def test_append_and_load(self):
+        dynamit.append_tac_archive(self.path, self.tacs)
+        dynamit.append_tac_archive(
+            self.path, {'p3/s2': dynamit.TAC.from_dict({'tacq': [0.5],
+                                                        'aorta': [7.0]})})
+        self.assertEqual(dynamit.tac_archive_keys(self.path),
+                         ['p1/s1', 'p2/s1', 'p3/s2'])
+        tac = dynamit.load_tac_archive(self.path, 'p2/s1')
+        self.assertEqual(tac, self.tacs['p2/s1'])
+        self.assertIsInstance(tac.data.base, np.memmap)
+        self.assertEqual(list(dynamit.load_tac_archive(self.path, 'p3/s2')),
+                         ['tacq', 'aorta'])
+        with self.assertRaises(KeyError):
+            dynamit.load_tac_archive(self.path, 'p4')
+
+    def test_replace(self):
+        dynamit.append_tac_archive(self.path, self.tacs)
+        new = {'p1/s1': {'tacq': [0.0], '1': [9.0]}}
+        with self.assertRaises(ValueError):
+            dynamit.append_tac_archive(self.path, new)
+        dynamit.append_tac_archive(self.path, new, replace=True)
+        self.assertEqual(dynamit.tac_archive_keys(self.path),
+                         ['p2/s1', 'p1/s1'])
+        self.assertEqual(dynamit.load_tac_archive(self.path, 'p1/s1'),
+                         new['p1/s1'])
+
+    def test_failed_append(self):
+        dynamit.append_tac_archive(self.path, self.tacs)
+        size = os.path.getsize(self.path)
+        with self.assertRaises(ValueError):
+            dynamit.append_tac_archive(
+                self.path, {'p3': {'tacq': [1.0, 2.0], 'a': [3.0]}})
+
+        # The archive is unchanged and readable
+        self.assertEqual(os.path.getsize(self.path), size)
+        self.assertEqual(dynamit.tac_archive_keys(self.path),
+                         ['p1/s1', 'p2/s1'])
+        self.assertEqual(dynamit.load_tac_archive(self.path, 'p1/s1'),
+                         self.tacs['p1/s1'])
+
+    def test_export(self):
+        dynamit.append_tac_archive(self.path, self.tacs)
+        paths = dynamit.export_tac_archive(self.path, self.out_dir)
+        self.assertEqual(paths,
+                         [os.path.join(self.out_dir, 'p1/s1.txt'),
+                          os.path.join(self.out_dir, 'p2/s1.txt')])
+        self.assertEqual(dynamit.load_tac(paths[1]), self.tacs['p2/s1'])
+
+    def test_not_an_archive(self):
+        dynamit.save_tac({'tacq': [0.0]}, self.path)
+        with self.assertRaises(ValueError):
+            dynamit.tac_archive_keys(self.path)
@@ -1,6 +1,11 @@
 import os.path
+import shutil
 import unittest
+import unittest.mock
 import dynamit
+from dynamit.image import _read_frame
+import json
+import numpy as np
 import SimpleITK as sitk
 
 
@@ -43,6 +48,258 @@ class TestLoadDynamicSeries(unittest.TestCase):
                          [0, 3.0, 6.3, 9.5, 12.8, 16.0, 19.3, 22.5, 25.8])
 
 
+class TestScanDynamicSeries(unittest.TestCase):
+
+    def test_scan_dynamic_series_8_3V(self):
+        dcm_path = os.path.join('test', 'data', '8_3V')
+        scan = dynamit.scan_dynamic_series(dcm_path)
+        self.assertEqual(len(scan['files']), 9)
+        self.assertEqual(scan['acq'],
+                         [0, 3.0, 6.3, 9.5, 12.8, 16.0, 19.3, 22.5, 25.8])
+        for i, name in enumerate(scan['files']):
+            self.assertTrue(name.endswith('Dyn_' + str(i + 1) + '.dcm'))
+        geometry = scan['geometry']
+        self.assertEqual(geometry['size'], (128, 128, 64))
+        self.assertEqual(geometry['spacing'], (4.92, 4.92, 4.92))
+        img = sitk.ReadImage(scan['files'][0])
+        self.assertEqual(geometry['origin'], img.GetOrigin())
+        self.assertEqual(geometry['direction'], img.GetDirection())
+
+
+class TestSeriesIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index_dir = os.path.join('test', 'out_index')
+        self.dcm_path = os.path.join('test', 'out_series')
+        shutil.copytree(os.path.join('test', 'data', '8_3V'), self.dcm_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+        shutil.rmtree(self.dcm_path, ignore_errors=True)
+
+    def test_index_written_and_used(self):
+        scan = dynamit.scan_dynamic_series(self.dcm_path,
+                                           index_dir=self.index_dir)
+        self.assertEqual(len(os.listdir(self.index_dir)), 1)
+        index_scan = dynamit.scan_dynamic_series(self.dcm_path,
+                                                 index_dir=self.index_dir)
+        self.assertEqual(index_scan, scan)
+
+        # Mark the index so that it can be seen if it is used
+        index_path = os.path.join(self.index_dir,
+                                  os.listdir(self.index_dir)[0])
+        with open(index_path) as f:
+            index = json.load(f)
+        index['acq'][1] = 100.0
+        with open(index_path, 'w') as f:
+            json.dump(index, f)
+        index_scan = dynamit.scan_dynamic_series(self.dcm_path,
+                                                 index_dir=self.index_dir)
+        self.assertEqual(index_scan['acq'][1], 100.0)
+        dyn = dynamit.load_dynamic_series(self.dcm_path,
+                                          index_dir=self.index_dir)
+        self.assertEqual(dyn['acq'][1], 100.0)
+
+        # The index is not used when disabled
+        no_index_scan = dynamit.scan_dynamic_series(self.dcm_path,
+                                                    use_index=False)
+        self.assertEqual(no_index_scan['acq'][1], 3.0)
+
+    def test_index_size(self):
+        # Index files are removed when they do not fit in the index folder
+        with unittest.mock.patch('dynamit.image._SERIES_INDEX_SIZE', 0):
+            scan = dynamit.scan_dynamic_series(self.dcm_path,
+                                               index_dir=self.index_dir)
+        self.assertEqual(len(scan['files']), 9)
+        self.assertEqual(os.listdir(self.index_dir), [])
+
+    def test_index_invalidated(self):
+        dynamit.scan_dynamic_series(self.dcm_path, index_dir=self.index_dir)
+        index_path = os.path.join(self.index_dir,
+                                  os.listdir(self.index_dir)[0])
+        with open(index_path) as f:
+            index = json.load(f)
+        index['acq'][1] = 100.0
+        with open(index_path, 'w') as f:
+            json.dump(index, f)
+
+        # Remove a file from the series
+        os.remove(os.path.join(
+            self.dcm_path, 'Patient_test_Study_10_Scan_10_Bed_1_Dyn_9.dcm'))
+        scan = dynamit.scan_dynamic_series(self.dcm_path,
+                                           index_dir=self.index_dir)
+        self.assertEqual(len(scan['files']), 8)
+        self.assertEqual(scan['acq'],
+                         [0, 3.0, 6.3, 9.5, 12.8, 16.0, 19.3, 22.5])
+
+
+class TestSeriesMemmap(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join('test', 'out_series.npy')
+        dynamit.save_series_memmap(os.path.join('test', 'data', '8_3V'),
+                                   self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+        os.remove(self.path + '.json')
+
+    def test_load_series_memmap(self):
+        dyn = dynamit.load_dynamic_series(os.path.join('test', 'data',
+                                                       '8_3V'))
+        mm = dynamit.load_series_memmap(self.path)
+        self.assertEqual(mm['acq'], dyn['acq'])
+        self.assertEqual(mm['data'].shape, (9, 64, 128, 128))
+        self.assertEqual(len(mm['img']), 9)
+        for i in range(9):
+            img = mm['img'][i]
+            self.assertEqual(img.GetSize(), dyn['img'][i].GetSize())
+            self.assertEqual(img.GetSpacing(), dyn['img'][i].GetSpacing())
+            self.assertEqual(img.GetOrigin(), dyn['img'][i].GetOrigin())
+            self.assertEqual(img.GetPixelID(), dyn['img'][i].GetPixelID())
+            self.assertTrue(
+                (mm['data'][i]
+                 == sitk.GetArrayViewFromImage(dyn['img'][i])).all())
+        self.assertEqual(len(mm['img'][2:5]), 3)
+
+    def test_metadata_mismatch(self):
+        # No temporary files are left
+        self.assertEqual(sorted(name for name in os.listdir('test')
+                                if name.startswith('out_series.npy')),
+                         ['out_series.npy', 'out_series.npy.json'])
+
+        # Metadata of another series (e.g. while the series is rewritten)
+        with open(self.path + '.json') as f:
+            metadata = json.load(f)
+        metadata['acq'] = metadata['acq'][:-1]
+        with open(self.path + '.json', 'w') as f:
+            json.dump(metadata, f)
+        with self.assertRaises(ValueError):
+            dynamit.load_series_memmap(self.path)
+
+    def test_roi_means_from_memmap(self):
+        roi_path = os.path.join(
+            'test', 'data', '8_3V_seg', 'Segmentation.nrrd')
+        mm = dynamit.load_series_memmap(self.path)
+        r = dynamit.series_roi_means(mm['data'], sitk.ReadImage(roi_path))
+        self.assertAlmostEqual(r[1][1], 0.767681, places=6)
+        self.assertAlmostEqual(r[2][1], 3501.54, places=2)
+
+        dyn = dynamit.lazy_series_roi_means(self.path, roi_path, workers=2)
+        self.assertEqual(list(dyn['tacq']),
+                         [0, 3.0, 6.3, 9.5, 12.8, 16.0, 19.3, 22.5, 25.8])
+        for i in range(9):
+            self.assertAlmostEqual(dyn['1'][i], r[1][i])
+            self.assertAlmostEqual(dyn['2'][i], r[2][i])
+
+
+class TestDynamicSeries(unittest.TestCase):
+
+    def setUp(self):
+        self.dcm_path = os.path.join('test', 'data', '8_3V')
+        self.roi = sitk.ReadImage(os.path.join(
+            'test', 'data', '8_3V_seg', 'Segmentation.nrrd'))
+
+    def test_frames(self):
+        series = dynamit.DynamicSeries(self.dcm_path, cache_size=2)
+        dyn = dynamit.load_dynamic_series(self.dcm_path)
+        self.assertEqual(len(series), 9)
+        self.assertEqual(list(series.acq),
+                         [0, 3.0, 6.3, 9.5, 12.8, 16.0, 19.3, 22.5, 25.8])
+
+        # Images are the same as from load_dynamic_series
+        for i in [0, 4, 8, -1]:
+            img = series[i]
+            self.assertEqual(img.GetPixelID(), dyn['img'][i].GetPixelID())
+            self.assertEqual(img.GetOrigin(), dyn['img'][i].GetOrigin())
+            self.assertEqual(img.GetSpacing(), dyn['img'][i].GetSpacing())
+            self.assertTrue(
+                (sitk.GetArrayViewFromImage(img)
+                 == sitk.GetArrayViewFromImage(dyn['img'][i])).all())
+        self.assertEqual(len(series[2:5]), 3)
+        self.assertRaises(IndexError, series.__getitem__, 9)
+
+        # The stored values are kept in their integer type
+        arr, slope, intercept = series.raw(3)
+        self.assertEqual(arr.dtype, np.uint16)
+        self.assertAlmostEqual(slope, 36.30353)
+        self.assertEqual(intercept, 0.0)
+
+    def test_roi_means(self):
+        series = dynamit.DynamicSeries(self.dcm_path)
+        r = dynamit.series_roi_means(series, self.roi)
+        self.assertEqual(r[1][0], 0)
+        self.assertAlmostEqual(r[2][0], 31.3157, places=4)
+        self.assertAlmostEqual(r[1][3], 12019.3, places=1)
+        self.assertAlmostEqual(r[2][3], 38544.1, places=1)
+        self.assertAlmostEqual(r[1][7], 0.748028, places=6)
+        self.assertAlmostEqual(r[2][7], 0.345963, places=6)
+
+    def test_resample_series_to_reference(self):
+        series = dynamit.DynamicSeries(self.dcm_path, cache_size=0)
+        res = dynamit.resample_series_to_reference(series, self.roi)
+        self.assertEqual(len(res), 9)
+        self.assertEqual(res[0].GetSize(), self.roi.GetSize())
+        self.assertEqual(res[0].GetOrigin(), self.roi.GetOrigin())
+
+
+class TestNearestNeighbourResampler(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = os.path.join('test', 'out_nn_index')
+        self.img = sitk.ReadImage(os.path.join(
+            'test', 'data', '8_3V',
+            'Patient_test_Study_10_Scan_10_Bed_1_Dyn_4.dcm'))
+
+        # A rotated reference, partly outside the image
+        self.ref = sitk.Image(90, 100, 70, sitk.sitkUInt8)
+        self.ref.SetSpacing((5.5, 3.3, 4.1))
+        self.ref.SetOrigin((-300.0, -320.0, 880.0))
+        self.ref.SetDirection((0.955336, -0.29552, 0.0,
+                               0.29552, 0.955336, 0.0,
+                               0.0, 0.0, 1.0))
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_same_as_resample_filter(self):
+        resampler = sitk.ResampleImageFilter()
+        resampler.SetReferenceImage(self.ref)
+        resampler.SetInterpolator(sitk.sitkNearestNeighbor)
+        expected = resampler.Execute(self.img)
+
+        for _ in range(2):
+            # The second time the index map is read from the cache
+            nn_resampler = dynamit.NearestNeighbourResampler(
+                self.img, self.ref, use_cache=True, cache_dir=self.cache_dir)
+            res = nn_resampler.execute(self.img)
+            self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+            self.assertEqual(res.GetPixelID(), expected.GetPixelID())
+            self.assertEqual(res.GetSize(), expected.GetSize())
+            self.assertEqual(res.GetOrigin(), expected.GetOrigin())
+            self.assertTrue(
+                (sitk.GetArrayViewFromImage(res)
+                 == sitk.GetArrayViewFromImage(expected)).all())
+
+    def test_cache_off_by_default(self):
+        with unittest.mock.patch.dict(os.environ,
+                                      {'DYNAMIT_CACHE_DIR': self.cache_dir}):
+            dynamit.NearestNeighbourResampler(self.img, self.ref)
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_cache_size(self):
+        # A cache too small for a single map keeps no maps
+        dynamit.NearestNeighbourResampler(
+            self.img, self.ref, use_cache=True, cache_dir=self.cache_dir,
+            cache_size=0)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_geometry_mismatch(self):
+        nn_resampler = dynamit.NearestNeighbourResampler(
+            self.img, self.ref, use_cache=False)
+        self.assertRaises(ValueError, nn_resampler.execute, self.ref)
+
+
 class TestResampleSeriesToReference(unittest.TestCase):
 
     def test_resample_series_to_reference_8_3V(self):
@@ -100,6 +357,113 @@ class TestResampleSeriesToReference(unittest.TestCase):
         self.assertEqual(img[8].GetDimension(), 3)
 
 
+class TestLabelIndex(unittest.TestCase):
+
+    def test_label_index_8_3V(self):
+        dcm_path = os.path.join('test', 'data', '8_3V')
+        roi_path = os.path.join(
+            'test', 'data', '8_3V_seg', 'Segmentation.nrrd')
+        dyn = dynamit.load_dynamic_series(dcm_path)
+        roi = sitk.ReadImage(roi_path)
+
+        label_index = dynamit.LabelIndex(roi)
+        self.assertEqual(label_index.labels, [0, 1, 2])
+        self.assertEqual(list(label_index.counts),
+                         [128 * 128 * 64 - 735, 245, 490])
+
+        label_stats_filter = sitk.LabelStatisticsImageFilter()
+        for img in dyn['img']:
+            label_stats_filter.Execute(img, roi)
+            means = label_index.means(img)
+            self.assertEqual(list(means), [0, 1, 2])
+            for label in label_stats_filter.GetLabels():
+                mean = label_stats_filter.GetMean(label)
+                self.assertLessEqual(abs(means[label] - mean),
+                                     1e-10 * max(abs(mean), 1.0))
+
+    def test_label_index_no_background(self):
+        roi = sitk.Image(2, 2, 1, sitk.sitkInt16)
+        roi.SetPixel(0, 0, 0, 1)
+        roi.SetPixel(1, 0, 0, 1)
+        roi.SetPixel(0, 1, 0, 3)
+        roi.SetPixel(1, 1, 0, 3)
+        img = sitk.Image(2, 2, 1, sitk.sitkFloat32)
+        img.SetPixel(0, 0, 0, 1.0)
+        img.SetPixel(1, 0, 0, 2.0)
+        img.SetPixel(0, 1, 0, 4.0)
+        img.SetPixel(1, 1, 0, 8.0)
+
+        label_index = dynamit.LabelIndex(roi)
+        self.assertEqual(label_index.means(img), {1: 1.5, 3: 6.0})
+        self.assertEqual(list(label_index.sums(img)), [3.0, 12.0])
+
+    def test_label_index_size_mismatch(self):
+        roi = sitk.Image(2, 2, 1, sitk.sitkInt16)
+        img = sitk.Image(2, 2, 2, sitk.sitkFloat32)
+        label_index = dynamit.LabelIndex(roi)
+        self.assertRaises(ValueError, label_index.means, img)
+
+
+class TestRoiWeights(unittest.TestCase):
+
+    def setUp(self):
+        self.roi = sitk.Image(2, 2, 1, sitk.sitkInt16)
+        self.roi.SetPixel(0, 0, 0, 1)
+        self.roi.SetPixel(1, 0, 0, 1)
+        self.roi.SetPixel(0, 1, 0, 2)
+        self.weight_map = sitk.Image(2, 2, 1, sitk.sitkFloat32)
+        self.weight_map.SetPixel(0, 0, 0, 1.0)
+        self.weight_map.SetPixel(1, 0, 0, 0.5)
+        self.weight_map.SetPixel(0, 1, 0, 0.5)
+        self.img = sitk.Image(2, 2, 1, sitk.sitkFloat32)
+        self.img.SetPixel(0, 0, 0, 1.0)
+        self.img.SetPixel(1, 0, 0, 2.0)
+        self.img.SetPixel(0, 1, 0, 4.0)
+        self.img.SetPixel(1, 1, 0, 8.0)
+
+    def test_overlapping_rois(self):
+        weights = dynamit.RoiWeights(self.roi)
+        weights.add_labelmap(self.roi, labels={'1': 'left'})
+        weights.add_weight_map(self.weight_map, 'frac')
+        self.assertEqual(weights.names, ['left', '2', 'frac'])
+
+        img2 = sitk.Image(self.img)
+        img2.SetPixel(1, 1, 0, 100.0)
+        means = weights.series_means([self.img, img2])
+        self.assertEqual(means, {'left': [1.5, 1.5],
+                                 '2': [4.0, 4.0],
+                                 'frac': [2.0, 2.0]})
+
+    def test_duplicate_name(self):
+        weights = dynamit.RoiWeights(self.roi)
+        weights.add_labelmap(self.roi)
+        self.assertRaises(ValueError, weights.add_weight_map,
+                          self.weight_map, '1')
+
+    def test_lazy_series_roi_means_8_3V(self):
+        dcm_path = os.path.join('test', 'data', '8_3V')
+        roi_path = os.path.join(
+            'test', 'data', '8_3V_seg', 'Segmentation.nrrd')
+        roi = sitk.ReadImage(roi_path)
+
+        # The whole ROI with half weight in every voxel
+        whole = sitk.Cast(roi > 0, sitk.sitkFloat32) * 0.5
+        weights = dynamit.RoiWeights(roi)
+        weights.add_labelmap(roi)
+        weights.add_weight_map(whole, 'whole')
+
+        dyn = dynamit.lazy_series_roi_means(dcm_path, weights, workers=2)
+        self.assertEqual(list(dyn), ['tacq', '1', '2', 'whole'])
+        self.assertEqual(list(dyn['tacq']),
+                         [0, 3.0, 6.3, 9.5, 12.8, 16.0, 19.3, 22.5, 25.8])
+        self.assertAlmostEqual(dyn['1'][1], 0.767681, places=6)
+        self.assertAlmostEqual(dyn['2'][1], 3501.54, places=2)
+        for i in range(9):
+            self.assertAlmostEqual(
+                dyn['whole'][i],
+                (245 * dyn['1'][i] + 490 * dyn['2'][i]) / 735)
+
+
 class TestSeriesRoiMeans(unittest.TestCase):
 
     def test_series_roi_means_8_3V(self):
@@ -148,7 +512,7 @@ class TestLazySeriesRoiMeans(unittest.TestCase):
         dyn = dynamit.lazy_series_roi_means(dcm_path, roi_path)
 
         tacq = dyn['tacq']
-        self.assertEqual(tacq,
+        self.assertEqual(list(tacq),
                          [0, 3.0, 6.3, 9.5, 12.8, 16.0, 19.3, 22.5, 25.8])
 
         r1 = dyn['1']
@@ -205,6 +569,78 @@ class TestLazySeriesRoiMeans(unittest.TestCase):
         self.assertAlmostEqual(r1[3], 11405.7, places=1)
         self.assertAlmostEqual(r2[3], 15053.1, places=1)
 
+    def test_lazy_series_roi_means_8_3V_workers(self):
+        dcm_path = os.path.join('test', 'data', '8_3V')
+        roi_path = os.path.join(
+            'test', 'data', '8_3V_seg', 'Segmentation.nrrd')
+        dyn1 = dynamit.lazy_series_roi_means(dcm_path, roi_path)
+        dyn3 = dynamit.lazy_series_roi_means(dcm_path, roi_path, workers=3)
+
+        self.assertEqual(list(dyn1.keys()), list(dyn3.keys()))
+        for key in dyn1:
+            self.assertEqual(list(dyn1[key]), list(dyn3[key]))
+
+    def test_lazy_series_roi_means_8_3V_crop(self):
+        dcm_path = os.path.join('test', 'data', '8_3V')
+        roi_path = os.path.join(
+            'test', 'data', '8_3V_seg', 'Segmentation.nrrd')
+        dyn = dynamit.lazy_series_roi_means(dcm_path, roi_path)
+        crop = dynamit.lazy_series_roi_means(dcm_path, roi_path, crop=True)
+        self.assertEqual(list(crop), ['tacq', '1', '2'])
+        self.assertEqual(list(crop['tacq']), list(dyn['tacq']))
+        for label in ['1', '2']:
+            for i in range(9):
+                self.assertAlmostEqual(crop[label][i], dyn[label][i])
+
+    def test_lazy_series_roi_means_8_3V_crop_resample_img(self):
+        dcm_path = os.path.join('test', 'data', '8_3V')
+        roi = sitk.ReadImage(os.path.join(
+            'test', 'data', '8_3V_seg', 'Segmentation.nrrd'))
+
+        # ROI on a finer grid than the images
+        roi = sitk.Resample(roi, [200, 200, 110], sitk.Transform(),
+                            sitk.sitkNearestNeighbor, roi.GetOrigin(),
+                            [3.0, 3.0, 3.0], roi.GetDirection(), 0,
+                            roi.GetPixelID())
+        roi_path = os.path.join('test', 'out_roi.nrrd')
+        sitk.WriteImage(roi, roi_path)
+        try:
+            dyn = dynamit.lazy_series_roi_means(dcm_path, roi_path,
+                                                resample='img')
+            crop = dynamit.lazy_series_roi_means(dcm_path, roi_path,
+                                                 resample='img', crop=True,
+                                                 workers=2)
+        finally:
+            os.remove(roi_path)
+        self.assertEqual(list(crop), ['tacq', '1', '2'])
+        for label in ['1', '2']:
+            for i in range(9):
+                self.assertAlmostEqual(crop[label][i], dyn[label][i])
+
+    def test_lazy_series_roi_set_means_8_3V(self):
+        dcm_path = os.path.join('test', 'data', '8_3V')
+        roi_path = os.path.join(
+            'test', 'data', '8_3V_seg', 'Segmentation.nrrd')
+        roi = sitk.ReadImage(roi_path)
+        weights = dynamit.RoiWeights(roi)
+        weights.add_weight_map(sitk.Cast(roi > 0, sitk.sitkFloat32), 'all')
+        res = dynamit.lazy_series_roi_set_means(
+            dcm_path,
+            [{'roi': roi_path},
+             {'roi': roi_path, 'labels': {'1': 'a'}, 'crop': True},
+             {'roi': weights, 'crop': True}],
+            workers=2)
+        self.assertEqual(len(res), 3)
+        self.assertEqual(list(res[0]), ['tacq', '0', '1', '2'])
+        self.assertEqual(list(res[1]), ['tacq', 'a', '2'])
+        self.assertEqual(list(res[2]), ['tacq', 'all'])
+        for i in range(9):
+            self.assertAlmostEqual(res[1]['a'][i], res[0]['1'][i])
+            self.assertAlmostEqual(res[1]['2'][i], res[0]['2'][i])
+            self.assertAlmostEqual(
+                res[2]['all'][i],
+                (245 * res[0]['1'][i] + 490 * res[0]['2'][i]) / 735)
+
     def test_custom_labels(self):
         dcm_path = os.path.join('test', 'data', '8_3V')
         roi_path = os.path.join(
@@ -218,3 +654,222 @@ class TestLazySeriesRoiMeans(unittest.TestCase):
         self.assertTrue('tacq' in dyn.keys())
         self.assertFalse('0' in dyn.keys())
         self.assertFalse('2' in dyn.keys())
+
+
+class TestIncrementalSeriesRoiMeans(unittest.TestCase):
+
+    def setUp(self):
+        self.src_path = os.path.join('test', 'data', '8_3V')
+        self.roi_path = os.path.join(
+            'test', 'data', '8_3V_seg', 'Segmentation.nrrd')
+        self.dcm_path = os.path.join('test', 'out_series')
+        self.out_path = os.path.join('test', 'out.txt')
+        self.files = dynamit.scan_dynamic_series(self.src_path,
+                                                 use_index=False)['files']
+        os.mkdir(self.dcm_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dcm_path, ignore_errors=True)
+        for path in (self.out_path, self.out_path + '.manifest.json'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def copy_frames(self, start, stop):
+        for name in self.files[start:stop]:
+            shutil.copy(name, self.dcm_path)
+
+    def test_only_new_frames_read(self):
+        self.copy_frames(0, 4)
+        n = dynamit.incremental_series_roi_means(self.dcm_path,
+                                                 self.roi_path,
+                                                 self.out_path, crop=True)
+        self.assertEqual(n, 4)
+        self.assertEqual(len(dynamit.load_tac(self.out_path)['tacq']), 4)
+
+        # A file that is not a dicom file is skipped
+        with open(os.path.join(self.dcm_path, 'partial.dcm'), 'w') as f:
+            f.write('not yet written')
+        self.copy_frames(4, 9)
+        n = dynamit.incremental_series_roi_means(self.dcm_path,
+                                                 self.roi_path,
+                                                 self.out_path, crop=True)
+        self.assertEqual(n, 5)
+        n = dynamit.incremental_series_roi_means(self.dcm_path,
+                                                 self.roi_path,
+                                                 self.out_path, crop=True)
+        self.assertEqual(n, 0)
+
+        full = dynamit.lazy_series_roi_means(self.src_path, self.roi_path,
+                                             crop=True)
+        tac = dynamit.load_tac(self.out_path)
+        self.assertEqual(list(tac), list(full))
+        for label in tac:
+            for value, expected in zip(tac[label], full[label]):
+                self.assertAlmostEqual(value, expected)
+
+    def test_truncated_frame_left_for_later(self):
+        self.copy_frames(0, 4)
+        with open(self.files[4], 'rb') as f:
+            data = f.read()
+        truncated = os.path.join(self.dcm_path,
+                                 os.path.basename(self.files[4]))
+        with open(truncated, 'wb') as f:
+            f.write(data[:len(data) // 2])
+        n = dynamit.incremental_series_roi_means(self.dcm_path,
+                                                 self.roi_path,
+                                                 self.out_path)
+        self.assertEqual(n, 4)
+
+        # The file is processed when it is completely written
+        self.copy_frames(4, 5)
+        n = dynamit.incremental_series_roi_means(self.dcm_path,
+                                                 self.roi_path,
+                                                 self.out_path)
+        self.assertEqual(n, 1)
+        self.assertEqual(list(dynamit.load_tac(self.out_path)['tacq']),
+                         [0, 3.0, 6.3, 9.5, 12.8])
+
+    def test_unreadable_pixel_data_left_for_later(self):
+        self.copy_frames(0, 6)
+        unreadable = os.path.join(self.dcm_path,
+                                  os.path.basename(self.files[4]))
+
+        def fail_on_unreadable(name, region):
+            if name == unreadable:
+                raise RuntimeError("incomplete pixel data")
+            return _read_frame(name, region)
+
+        # The header can be read but the pixel data cannot, so the frame and
+        # the later frames are left for a later call
+        with unittest.mock.patch('dynamit.image._read_frame',
+                                 fail_on_unreadable):
+            n = dynamit.incremental_series_roi_means(self.dcm_path,
+                                                     self.roi_path,
+                                                     self.out_path,
+                                                     workers=2)
+        self.assertEqual(n, 4)
+        n = dynamit.incremental_series_roi_means(self.dcm_path,
+                                                 self.roi_path,
+                                                 self.out_path)
+        self.assertEqual(n, 2)
+        self.assertEqual(list(dynamit.load_tac(self.out_path)['tacq']),
+                         [0, 3.0, 6.3, 9.5, 12.8, 16.0])
+
+    def test_recomputed_when_settings_change(self):
+        self.copy_frames(0, 9)
+        dynamit.incremental_series_roi_means(self.dcm_path, self.roi_path,
+                                             self.out_path)
+        n = dynamit.incremental_series_roi_means(self.dcm_path,
+                                                 self.roi_path,
+                                                 self.out_path,
+                                                 labels={'1': 'a'})
+        self.assertEqual(n, 9)
+        self.assertEqual(list(dynamit.load_tac(self.out_path)),
+                         ['tacq', '0', 'a', '2'])
+
+    def test_recomputed_when_earlier_frame_arrives(self):
+        self.copy_frames(1, 9)
+        dynamit.incremental_series_roi_means(self.dcm_path, self.roi_path,
+                                             self.out_path)
+        self.copy_frames(0, 1)
+        n = dynamit.incremental_series_roi_means(self.dcm_path,
+                                                 self.roi_path,
+                                                 self.out_path)
+        self.assertEqual(n, 9)
+        self.assertEqual(list(dynamit.load_tac(self.out_path)['tacq']),
+                         [0, 3.0, 6.3, 9.5, 12.8, 16.0, 19.3, 22.5, 25.8])
+
+    def test_watch_stops_without_new_frames(self):
+        self.copy_frames(0, 9)
+        n = dynamit.watch_series_roi_means(self.dcm_path, self.roi_path,
+                                           self.out_path, interval=0.0,
+                                           timeout=0.0)
+        self.assertEqual(n, 9)
+        self.assertEqual(len(dynamit.load_tac(self.out_path)['tacq']), 9)
+
+
+class TestMultiframeSeries(unittest.TestCase):
+
+    def setUp(self):
+        # Stack the stored values of the test series into a single
+        # multi-frame dicom file with a frame time vector
+        self.series = dynamit.DynamicSeries(os.path.join('test', 'data',
+                                                         '8_3V'))
+        self.raw = [self.series.raw(i)[0] for i in range(len(self.series))]
+        img = sitk.GetImageFromArray(np.concatenate(self.raw))
+        img.SetSpacing(self.series.geometry['spacing'])
+        img.SetOrigin(self.series.geometry['origin'])
+        img.SetMetaData('0054|0101', str(len(self.raw)))
+        increments = np.diff(self.series.acq, prepend=0.0) * 1000.0
+        img.SetMetaData('0018|1065',
+                        '\\'.join(str(round(t)) for t in increments))
+        self.path = os.path.join('test', 'out_multiframe.dcm')
+        writer = sitk.ImageFileWriter()
+        writer.KeepOriginalImageUIDOn()
+        writer.SetFileName(self.path)
+        writer.Execute(img)
+
+    def tearDown(self):
+        for path in (self.path, os.path.join('test', 'out_series.npy'),
+                     os.path.join('test', 'out_series.npy.json')):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_load_multiframe_series(self):
+        series = dynamit.load_multiframe_series(self.path)
+        self.assertEqual(len(series['img']), 9)
+        self.assertEqual(series['data'].shape, (9, 64, 128, 128))
+        np.testing.assert_allclose(series['acq'], self.series.acq)
+        self.assertEqual(series['geometry']['size'], (128, 128, 64))
+        for i in range(9):
+            np.testing.assert_array_equal(series['data'][i], self.raw[i])
+        img = series['img'][3]
+        self.assertEqual(img.GetSize(), (128, 128, 64))
+        self.assertEqual(img.GetOrigin(), self.series.geometry['origin'])
+
+    def test_frame_reference_time(self):
+        img = sitk.ReadImage(self.path)
+        img.EraseMetaData('0018|1065')
+        img.SetMetaData('0054|1300', '\\'.join(
+            str(round(t * 1000.0 + 500.0)) for t in self.series.acq))
+        sitk.WriteImage(img, self.path)
+        series = dynamit.load_multiframe_series(self.path)
+        np.testing.assert_allclose(series['acq'], self.series.acq)
+
+    def test_frame_time(self):
+        img = sitk.ReadImage(self.path)
+        img.EraseMetaData('0018|1065')
+        img.SetMetaData('0018|1063', '2500')
+        sitk.WriteImage(img, self.path)
+        series = dynamit.load_multiframe_series(self.path)
+        np.testing.assert_allclose(series['acq'],
+                                   [2.5 * i for i in range(9)])
+
+    def test_frame_count_mismatch(self):
+        img = sitk.ReadImage(self.path)
+        img.SetMetaData('0054|0101', '5')
+        sitk.WriteImage(img, self.path)
+        with self.assertRaises(ValueError):
+            dynamit.load_multiframe_series(self.path)
+
+    def test_dynamic_series_and_roi_means(self):
+        series = dynamit.DynamicSeries(self.path)
+        self.assertEqual(len(series), 9)
+        np.testing.assert_array_equal(
+            sitk.GetArrayFromImage(series[2]), self.raw[2])
+
+        roi_path = os.path.join(
+            'test', 'data', '8_3V_seg', 'Segmentation.nrrd')
+        roi = sitk.ReadImage(roi_path)
+        expected = dynamit.series_roi_means(np.stack(self.raw), roi)
+        dyn = dynamit.lazy_series_roi_means(self.path, roi_path, crop=True)
+        for label in (1, 2):
+            for value, exp in zip(dyn[str(label)], expected[label]):
+                self.assertAlmostEqual(value, exp, places=6)
+
+    def test_save_series_memmap(self):
+        out_path = os.path.join('test', 'out_series.npy')
+        dynamit.save_series_memmap(self.path, out_path)
+        series = dynamit.load_series_file(out_path)
+        np.testing.assert_array_equal(series['data'], np.stack(self.raw))
+        np.testing.assert_allclose(series['acq'], self.series.acq)
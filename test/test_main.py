@@ -0,0 +1,65 @@
+import unittest
+import os
+import shutil
+import SimpleITK as sitk
+from dynamit.__main__ import main, task_dependencies
+
+
+class TestMain(unittest.TestCase):
+
+    def test_pipeline_in_memory(self):
+        status = main([os.path.join('test', 'xml_input',
+                                    'test_pipeline.xml')])
+        self.assertEqual(status, 0)
+
+        # The TAC is passed between the tasks without a file
+        self.assertFalse(os.path.exists(os.path.join('test', 'out.txt')))
+        k1 = sitk.ReadImage(os.path.join('test', 'k1.nrrd'))
+        self.assertEqual(k1.GetSize(), (128, 128, 64))
+
+    def test_pipeline_parallel(self):
+        status = main([os.path.join('test', 'xml_input', 'test_pipeline.xml'),
+                       '--jobs', '2',
+                       '--log-dir', os.path.join('test', 'out_logs')])
+        self.assertEqual(status, 0)
+
+        # The named TAC is passed from the worker of the first task
+        k1 = sitk.ReadImage(os.path.join('test', 'k1.nrrd'))
+        self.assertEqual(k1.GetSize(), (128, 128, 64))
+        self.assertEqual(sorted(os.listdir(os.path.join('test', 'out_logs'))),
+                         ['task_001_ROIMeans.log', 'task_002_PatlakMap.log'])
+
+    def test_pipeline_failure(self):
+        status = main([os.path.join('test', 'xml_input',
+                                    'test_pipeline_fail.xml'),
+                       '--log-dir', os.path.join('test', 'out_logs')])
+        self.assertEqual(status, 1)
+        self.assertFalse(os.path.exists(os.path.join('test', 'k1.nrrd')))
+
+        # Each task has its own log with the error
+        for name in ('task_001_TACFit.log', 'task_002_PatlakMap.log'):
+            with open(os.path.join('test', 'out_logs', name)) as f:
+                self.assertIn('missing.txt', f.read())
+
+    def test_task_dependencies(self):
+        tasks = [
+            {'@name': 'SeriesMemmap', 'img_path': 'a', 'out_path': 'b.npy'},
+            {'@name': 'ROIMeans', 'img_path': 'b.npy', 'roi_path': 'r',
+             'out_path': 'c/t1.txt'},
+            {'@name': 'ROIMeans', 'img_path': 'a',
+             'roi': [{'roi_path': 'r', 'out_name': 'tac'}]},
+            {'@name': 'TACFitBatch', 'tac_path': 'c/*.txt',
+             'out_path': 'fits.txt'},
+            {'@name': 'PatlakMap', 'img_path': 'a', 'tac_name': 'tac',
+             'k1_path': 'k1.nrrd', 'v0_path': 'v0.nrrd'},
+            {'@name': 'SeriesMemmap', 'img_path': 'a', 'out_path': 'b.npy'}
+        ]
+        self.assertEqual(task_dependencies(tasks),
+                         [set(), {0}, set(), {1}, {2}, {0, 1}])
+
+    def tearDown(self):
+        for name in ('k1.nrrd', 'v0.nrrd'):
+            if os.path.exists(os.path.join('test', name)):
+                os.remove(os.path.join('test', name))
+        if os.path.exists(os.path.join('test', 'out_logs')):
+            shutil.rmtree(os.path.join('test', 'out_logs'))
@@ -1,5 +1,7 @@
 import unittest
 import dynamit
+from dynamit.model import _cached_operator
+from test import util
 
 
 class TestModelFermi2(unittest.TestCase):
@@ -25,5 +27,62 @@ class TestModelFermi2(unittest.TestCase):
         self.assertAlmostEqual(389.333, m[1], places=3)
         self.assertAlmostEqual(2472.040, m[2], places=1)
         self.assertAlmostEqual(3249.592, m[3], places=2)
-        self.assertAlmostEqual(1899.835, m[4], places=3)
-        self.assertAlmostEqual(748.214, m[5], places=3)
+        self.assertAlmostEqual(1899.836, m[4], places=3)
+        self.assertAlmostEqual(748.215, m[5], places=3)
+
+
+class TestConvolutionOperator(unittest.TestCase):
+
+    def test_constant_response(self):
+        # Convolution with a constant response is the integrated input
+        # function, which is the same as a step function longer than the
+        # curve.
+        tp = [0.0, 3.7, 7.1, 10.2, 13.5, 17.8]
+        in_func = [0.0, 572.1, 3021.5, 123.7, 50.21, 10.5]
+
+        op = dynamit.ConvolutionOperator(tp, in_func)
+        m = op(lambda lag: 0.5 + 0.0 * lag)
+        m_step = dynamit.model_step(amp=0.5, extent=100.0,
+                                    t=tp, in_func=in_func)
+
+        self.assertEqual(6, len(m))
+        for i in range(6):
+            self.assertAlmostEqual(m_step[i], m[i], places=8)
+
+    def test_late_first_sample(self):
+        # The input function before the first sample takes the value of the
+        # first sample, and the convolution starts at t=0.
+        tp = [1.0, 3.0, 4.0]
+        in_func = [2.0, 6.0, 6.0]
+
+        op = dynamit.ConvolutionOperator(tp, in_func)
+        m = op(lambda lag: 1.0 + 0.0 * lag)
+
+        self.assertEqual(3, len(m))
+        self.assertAlmostEqual(2.0, m[0], places=10)
+        self.assertAlmostEqual(10.0, m[1], places=10)
+        self.assertAlmostEqual(16.0, m[2], places=10)
+
+    def test_operator_cache(self):
+        # Only the operator of the latest input function is kept
+        tp = [0.0, 3.7, 7.1, 10.2, 13.5, 17.8]
+        for scale in (1.0, 2.0, 3.0):
+            in_func = [scale * v for v in [0.0, 572.1, 3021.5, 123.7, 50.21,
+                                           10.5]]
+            dynamit.model_fermi_2(amp1=0.1, extent1=3.0, amp2=0.3,
+                                  extent2=6.0, width1=1.0, width2=3.0,
+                                  t=tp, in_func=in_func)
+        self.assertEqual(_cached_operator.cache_info().currsize, 1)
+
+
+class TestModelFermi2Jacobian(unittest.TestCase):
+
+    def test_model_fermi_2_jac(self):
+        params = {'amp1': 0.1, 'extent1': 3.0, 'width1': 1.0,
+                  'amp2': 0.3, 'extent2': 6.0, 'width2': 3.0}
+
+        tp = [0.0, 3.7, 7.1, 10.2, 13.5, 17.8]
+        in_func = [0.0, 572.1, 3021.5, 123.7, 50.21, 10.5]
+
+        util.assert_jacobian(self, dynamit.model_fermi_2,
+                             dynamit.model_fermi_2_jac, tp, in_func, params)
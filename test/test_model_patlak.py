@@ -19,3 +19,33 @@ class TestModelPatlak(unittest.TestCase):
         self.assertAlmostEqual(294.955, m[2], places=3)
         self.assertAlmostEqual(403.425, m[3], places=3)
         self.assertAlmostEqual(432.965, m[4], places=3)
+
+    def test_model_patlak_batch(self):
+        tp = [0.0, 4.3, 7.5, 12.4, 16.2]
+        in_func = [0.0, 10.3, 12.1, 8.1, 4.1]
+        params = [[3.0, 10.0],
+                  [0.5, 0.0],
+                  [0.0, 2.0]]
+
+        m = dynamit.model_patlak_batch(tp, in_func, params)
+
+        self.assertEqual((3, 5), m.shape)
+        for j in range(3):
+            mj = dynamit.model_patlak(k1=params[j][0], v0=params[j][1],
+                                      t=tp, in_func=in_func)
+            for i in range(5):
+                self.assertAlmostEqual(mj[i], m[j, i], places=10)
+        self.assertAlmostEqual(432.965, m[0, 4], places=3)
+
+    def test_model_patlak_jac(self):
+        tp = [0.0, 4.3, 7.5, 12.4, 16.2]
+        in_func = [0.0, 10.3, 12.1, 8.1, 4.1]
+
+        j = dynamit.model_patlak_jac(k1=3.0, v0=10.0, t=tp, in_func=in_func)
+        m1 = dynamit.model_patlak(k1=1.0, v0=0.0, t=tp, in_func=in_func)
+        m2 = dynamit.model_patlak(k1=0.0, v0=1.0, t=tp, in_func=in_func)
+
+        self.assertEqual((5, 2), j.shape)
+        for i in range(5):
+            self.assertAlmostEqual(m1[i], j[i, 0], places=10)
+            self.assertAlmostEqual(m2[i], j[i, 1], places=10)
@@ -1,5 +1,6 @@
 import unittest
 import dynamit
+from test import util
 
 
 class TestModelStep(unittest.TestCase):
@@ -37,6 +38,31 @@ class TestModelStep(unittest.TestCase):
         self.assertAlmostEqual(25.0844, m[4], places=3)
         self.assertAlmostEqual(7.3057, m[5], places=3)
 
+    def test_model_step_late_first_sample(self):
+        # Before the first sample the input function takes the value of the
+        # first sample, and the integration starts at t=0.
+        amp = 0.5
+        extent = 2.0
+
+        tp = [1.0, 3.0, 4.0]
+        in_func = [2.0, 6.0, 6.0]
+
+        m = dynamit.model_step(amp=amp, extent=extent, t=tp, in_func=in_func)
+
+        self.assertEqual(3, len(m))
+        self.assertAlmostEqual(1.0, m[0], places=10)
+        self.assertAlmostEqual(4.0, m[1], places=10)
+        self.assertAlmostEqual(5.5, m[2], places=10)
+
+    def test_model_step_zero_extent(self):
+        tp = [0.0, 3.7, 7.1, 10.2]
+        in_func = [0.0, 572.1, 3021.5, 123.7]
+
+        m = dynamit.model_step(amp=1.0, extent=0.0, t=tp, in_func=in_func)
+
+        for mi in m:
+            self.assertEqual(0.0, mi)
+
 
 class TestModelStep2(unittest.TestCase):
 
@@ -57,6 +83,43 @@ class TestModelStep2(unittest.TestCase):
         self.assertAlmostEqual(0.0, m[0], places=4)
         self.assertAlmostEqual(419.5657, m[1], places=1)
         self.assertAlmostEqual(2704.4526, m[2], places=1)
-        self.assertAlmostEqual(3640.1826, m[3], places=3)
+        self.assertAlmostEqual(3640.1819, m[3], places=3)
         self.assertAlmostEqual(1233.5420, m[4], places=2)
         self.assertAlmostEqual(81.7247, m[5], places=2)
+
+    def test_model_step_2_reversed_extents(self):
+        # When extent2 < extent1 the second step ends together with the first
+        tp = [0.0, 3.7, 7.1, 10.2, 13.5, 17.8]
+        in_func = [0.0, 572.1, 3021.5, 123.7, 50.21, 10.5]
+
+        m = dynamit.model_step_2(amp1=0.1, extent1=6.0,
+                                 amp2=0.3, extent2=3.0,
+                                 t=tp, in_func=in_func)
+        m1 = dynamit.model_step(amp=0.4, extent=6.0, t=tp, in_func=in_func)
+
+        self.assertEqual(6, len(m))
+        for i in range(6):
+            self.assertAlmostEqual(m1[i], m[i], places=8)
+
+
+class TestModelStepJacobians(unittest.TestCase):
+
+    tp = [0.0, 3.7, 7.1, 10.2, 13.5, 17.8]
+    in_func = [0.0, 572.1, 3021.5, 123.7, 50.21, 10.5]
+
+    def assertJacobian(self, model, jac, params):
+        util.assert_jacobian(self, model, jac, self.tp, self.in_func, params)
+
+    def test_model_step_jac(self):
+        self.assertJacobian(dynamit.model_step, dynamit.model_step_jac,
+                            {'amp': 0.1, 'extent': 3.0})
+
+    def test_model_step_2_jac(self):
+        self.assertJacobian(dynamit.model_step_2, dynamit.model_step_2_jac,
+                            {'amp1': 0.1, 'extent1': 3.0,
+                             'amp2': 0.3, 'extent2': 6.0})
+
+    def test_model_step_2_jac_reversed_extents(self):
+        self.assertJacobian(dynamit.model_step_2, dynamit.model_step_2_jac,
+                            {'amp1': 0.1, 'extent1': 6.0,
+                             'amp2': 0.3, 'extent2': 3.0})
@@ -0,0 +1,40 @@
+import unittest
+import dynamit
+from test import util
+
+
+class TestModelStepFermi(unittest.TestCase):
+
+    def test_model_step_fermi_case1(self):
+        amp = 0.1
+        amp2 = 0.3
+        extent = 3.0
+        extent2 = 6.0
+        width2 = 3.0
+
+        tp = [0.0, 3.7, 7.1, 10.2, 13.5, 17.8]
+        in_func = [0.0, 572.1, 3021.5, 123.7, 50.21, 10.5]
+
+        m = dynamit.model_step_fermi(amp1=amp, extent1=extent,
+                                     amp2=amp2, extent2=extent2,
+                                     width2=width2,
+                                     t=tp, in_func=in_func)
+
+        self.assertEqual(6, len(m))
+        self.assertAlmostEqual(0.0, m[0], places=4)
+        self.assertAlmostEqual(400.003, m[1], places=3)
+        self.assertAlmostEqual(2513.454, m[2], places=3)
+        self.assertAlmostEqual(3199.079, m[3], places=3)
+        self.assertAlmostEqual(1839.370, m[4], places=3)
+        self.assertAlmostEqual(745.017, m[5], places=3)
+
+    def test_model_step_fermi_jac(self):
+        params = {'amp1': 0.1, 'extent1': 3.0,
+                  'amp2': 0.3, 'extent2': 6.0, 'width2': 3.0}
+
+        tp = [0.0, 3.7, 7.1, 10.2, 13.5, 17.8]
+        in_func = [0.0, 572.1, 3021.5, 123.7, 50.21, 10.5]
+
+        util.assert_jacobian(self, dynamit.model_step_fermi,
+                             dynamit.model_step_fermi_jac, tp, in_func,
+                             params)
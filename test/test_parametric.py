@@ -0,0 +1,210 @@
+import os
+import unittest
+import dynamit
+import numpy as np
+import SimpleITK as sitk
+import xmltodict
+
+
+class TestPatlakMap(unittest.TestCase):
+
+    def test_patlak_map_synthetic(self):
+        t = [0.0, 4.3, 7.5, 12.4, 16.2, 20.0]
+        in_func = [0.0, 10.3, 12.1, 8.1, 4.1, 3.0]
+        k1 = np.arange(24, dtype=np.float64).reshape((2, 3, 4)) / 100.0
+        v0 = np.arange(24, dtype=np.float64).reshape((2, 3, 4))[::-1] / 10.0
+
+        series = []
+        for i in range(len(t)):
+            m = dynamit.model_patlak_batch(
+                t, in_func, np.column_stack((k1.ravel(), v0.ravel())))
+            img = sitk.GetImageFromArray(m[:, i].reshape(k1.shape))
+            img.SetSpacing((2.0, 3.0, 4.0))
+            series.append(img)
+
+        maps = dynamit.patlak_map(series, t, in_func)
+
+        self.assertEqual(maps['k1'].GetSize(), (4, 3, 2))
+        self.assertEqual(maps['v0'].GetSpacing(), (2.0, 3.0, 4.0))
+        np.testing.assert_allclose(sitk.GetArrayFromImage(maps['k1']), k1,
+                                   atol=1e-8)
+        np.testing.assert_allclose(sitk.GetArrayFromImage(maps['v0']), v0,
+                                   atol=1e-8)
+        np.testing.assert_allclose(sitk.GetArrayFromImage(maps['rms']), 0.0,
+                                   atol=1e-4)
+
+    def test_patlak_map_ill_conditioned(self):
+        # Nearly collinear regressors (condition number about 3e6)
+        t = np.linspace(0.0, 30.0, 12)
+        in_func = np.exp(t / 2.0)
+        m = dynamit.model_patlak(t, in_func, 0.3, 2.0)
+        series = [sitk.GetImageFromArray(np.full((1, 1, 2), v)) for v in m]
+
+        maps = dynamit.patlak_map(series, t, in_func)
+
+        np.testing.assert_allclose(sitk.GetArrayFromImage(maps['k1']), 0.3,
+                                   rtol=1e-8)
+        np.testing.assert_allclose(sitk.GetArrayFromImage(maps['v0']), 2.0,
+                                   rtol=1e-6)
+
+    def test_patlak_map_wrong_length(self):
+        img = sitk.Image(2, 2, 2, sitk.sitkFloat32)
+        with self.assertRaises(ValueError):
+            dynamit.patlak_map([img, img], [0.0, 1.0, 2.0], [0.0, 1.0, 1.0])
+        with self.assertRaises(ValueError):
+            dynamit.patlak_map([img, img, img], [0.0, 1.0], [0.0, 1.0])
+
+
+class TestParametricMap(unittest.TestCase):
+
+    t = [0.0, 3.0, 6.0, 9.0, 12.0, 15.0, 20.0, 25.0, 30.0, 40.0, 50.0]
+    in_func = [0.0, 50.0, 200.0, 150.0, 90.0, 60.0, 40.0, 30.0, 25.0, 20.0,
+               15.0]
+
+    def setUp(self):
+        # 2x2x3 voxels with different step functions
+        self.amp = np.linspace(0.1, 0.3, 12).reshape((2, 2, 3))
+        self.extent = np.linspace(8.0, 20.0, 12).reshape((2, 2, 3))
+        frames = np.zeros((len(self.t), 2, 2, 3))
+        for idx in np.ndindex(2, 2, 3):
+            frames[(slice(None),) + idx] = dynamit.model_step(
+                self.t, self.in_func, float(self.amp[idx]),
+                float(self.extent[idx]))
+        self.series = [sitk.GetImageFromArray(frame) for frame in frames]
+        self.params = {'amp': {'value': 0.2, 'min': 0.0},
+                       'extent': {'value': 10.0, 'min': 0.0}}
+
+    def test_parametric_map_step(self):
+        maps = dynamit.parametric_map(self.series, self.t, self.in_func,
+                                      'step', self.params, chunk_size=5)
+
+        self.assertEqual(set(maps.keys()), {'amp', 'extent', 'rms'})
+        np.testing.assert_allclose(sitk.GetArrayFromImage(maps['amp']),
+                                   self.amp, atol=1e-4)
+        np.testing.assert_allclose(sitk.GetArrayFromImage(maps['extent']),
+                                   self.extent, atol=1e-2)
+
+    def test_parametric_map_float64(self):
+        # Values where float32 would lose precision are fitted exactly
+        m = dynamit.model_patlak(self.t, self.in_func, 0.0123456789, 1.0e5)
+        series = [sitk.GetImageFromArray(np.full((1, 1, 2), v)) for v in m]
+        maps = dynamit.parametric_map(series, self.t, self.in_func, 'patlak',
+                                      {'k1': {'value': 0.01},
+                                       'v0': {'value': 9.0e4}})
+        self.assertTrue(np.all(sitk.GetArrayFromImage(maps['rms']) < 1e-6))
+        np.testing.assert_allclose(sitk.GetArrayFromImage(maps['k1']),
+                                   0.0123456789, rtol=1e-9)
+
+    def test_parametric_map_mask_workers(self):
+        mask_arr = np.zeros((2, 2, 3), dtype=np.uint8)
+        mask_arr[0, 1, :] = 1
+        mask_arr[1, 0, 2] = 2
+        mask = sitk.GetImageFromArray(mask_arr)
+
+        maps1 = dynamit.parametric_map(self.series, self.t, self.in_func,
+                                       'step', self.params, mask=mask,
+                                       chunk_size=2)
+        maps2 = dynamit.parametric_map(self.series, self.t, self.in_func,
+                                       'step', self.params, mask=mask,
+                                       chunk_size=2, workers=2)
+
+        amp1 = sitk.GetArrayFromImage(maps1['amp'])
+        amp2 = sitk.GetArrayFromImage(maps2['amp'])
+        np.testing.assert_array_equal(amp1, amp2)
+        self.assertTrue(np.all(np.isnan(amp1[mask_arr == 0])))
+        np.testing.assert_allclose(amp1[mask_arr > 0],
+                                   self.amp[mask_arr > 0], atol=1e-4)
+
+    def test_parametric_map_bad_params(self):
+        with self.assertRaises(ValueError):
+            dynamit.parametric_map(self.series, self.t, self.in_func, 'step',
+                                   {'amp': {'value': -1.0, 'min': 0.0},
+                                    'extent': {'value': 10.0}})
+        with self.assertRaises(ValueError):
+            dynamit.parametric_map(self.series, self.t, self.in_func, 'step',
+                                   {'amp': {'value': 0.2},
+                                    'extent': {'value': 10.0, 'min': 20.0,
+                                               'max': 5.0}})
+
+    def test_parametric_map_skipped(self):
+        # A voxel with a nan value is not fitted, and it is reported
+        frame = sitk.GetArrayFromImage(self.series[3])
+        frame[0, 0, 0] = np.nan
+        self.series[3] = sitk.GetImageFromArray(frame)
+        with self.assertWarnsRegex(UserWarning, "^1 voxels"):
+            maps = dynamit.parametric_map(self.series, self.t, self.in_func,
+                                          'step', self.params)
+        amp = sitk.GetArrayFromImage(maps['amp'])
+        self.assertTrue(np.isnan(amp[0, 0, 0]))
+        np.testing.assert_allclose(amp.ravel()[1:], self.amp.ravel()[1:],
+                                   atol=1e-4)
+
+
+class TestTaskPatlakMap(unittest.TestCase):
+
+    def test_task_patlak_map(self):
+        dcm_path = os.path.join('test', 'data', '8_3V')
+        roi_path = os.path.join(
+            'test', 'data', '8_3V_seg', 'Segmentation.nrrd')
+        tac = dynamit.lazy_series_roi_means(dcm_path, roi_path)
+        dynamit.save_tac(tac, os.path.join('test', 'out.txt'))
+
+        f = open(os.path.join('test', 'xml_input', 'test_patlak_map.xml'))
+        tree = xmltodict.parse(f.read(), xml_attribs=True)
+        task = tree['dynamit1']['task']
+        dynamit.task_patlak_map(task)
+
+        k1 = sitk.ReadImage(os.path.join('test', 'k1.nrrd'))
+        v0 = sitk.ReadImage(os.path.join('test', 'v0.nrrd'))
+        self.assertEqual(k1.GetSize(), (128, 128, 64))
+        self.assertEqual(v0.GetSize(), (128, 128, 64))
+        self.assertEqual(k1.GetSpacing(), (4.92, 4.92, 4.92))
+
+    def tearDown(self):
+        for name in ('out.txt', 'k1.nrrd', 'v0.nrrd'):
+            if os.path.exists(os.path.join('test', name)):
+                os.remove(os.path.join('test', name))
+
+
+class TestTaskParametricMap(unittest.TestCase):
+
+    def test_task_parametric_map(self):
+        dcm_path = os.path.join('test', 'data', '8_3V')
+        roi_path = os.path.join(
+            'test', 'data', '8_3V_seg', 'Segmentation.nrrd')
+        tac = dynamit.lazy_series_roi_means(dcm_path, roi_path)
+        dynamit.save_tac(tac, os.path.join('test', 'out.txt'))
+
+        # Fit a small part of the kidney ROI only
+        roi = sitk.ReadImage(roi_path)
+        mask_arr = np.zeros(sitk.GetArrayViewFromImage(roi).shape,
+                            dtype=np.uint8)
+        mask_arr.ravel()[np.flatnonzero(
+            sitk.GetArrayViewFromImage(roi) == 1)[0:10]] = 1
+        mask = sitk.GetImageFromArray(mask_arr)
+        mask.CopyInformation(roi)
+        sitk.WriteImage(mask, os.path.join('test', 'out_mask.nrrd'))
+
+        f = open(os.path.join(
+            'test', 'xml_input', 'test_parametric_map.xml'))
+        tree = xmltodict.parse(f.read(), xml_attribs=True)
+        task = tree['dynamit1']['task']
+        dynamit.task_parametric_map(task)
+
+        for name in ('amp', 'extent', 'rms'):
+            img = sitk.ReadImage(os.path.join('test', 'out_maps',
+                                              name + '.nrrd'))
+            self.assertEqual(img.GetSize(), (128, 128, 64))
+            arr = sitk.GetArrayViewFromImage(img)
+            self.assertEqual(10, np.count_nonzero(~np.isnan(arr)))
+
+    def tearDown(self):
+        for name in ('out.txt', 'out_mask.nrrd'):
+            if os.path.exists(os.path.join('test', name)):
+                os.remove(os.path.join('test', name))
+        for name in ('amp', 'extent', 'rms'):
+            path = os.path.join('test', 'out_maps', name + '.nrrd')
+            if os.path.exists(path):
+                os.remove(path)
+        if os.path.exists(os.path.join('test', 'out_maps')):
+            os.rmdir(os.path.join('test', 'out_maps'))
@@ -1,7 +1,13 @@
 import unittest
+import contextlib
 import dynamit
+import io
 import os
+import shutil
+import SimpleITK as sitk
+import unittest.mock
 import xmltodict
+from typing import Any
 
 
 class TestTaskROIMeans(unittest.TestCase):
@@ -14,7 +20,7 @@ class TestTaskROIMeans(unittest.TestCase):
         dynamit.task_roi_means(task)
         dyn = dynamit.load_tac(os.path.join('test', 'out.txt'))
         tacq = dyn['tacq']
-        self.assertEqual(tacq,
+        self.assertEqual(list(tacq),
                          [0, 3.0, 6.3, 9.5, 12.8, 16.0, 19.3, 22.5, 25.8])
 
         r1 = dyn['1']
@@ -55,7 +61,7 @@ class TestTaskROIMeans(unittest.TestCase):
         dynamit.task_roi_means(task)
         dyn = dynamit.load_tac(os.path.join('test', 'out.txt'))
         tacq = dyn['tacq']
-        self.assertEqual(tacq,
+        self.assertEqual(list(tacq),
                          [0, 3.0, 6.3, 9.5, 12.8, 16.0, 19.3, 22.5, 25.8])
 
         r1 = dyn['a']
@@ -88,6 +94,25 @@ class TestTaskROIMeans(unittest.TestCase):
         self.assertEqual(r1[8], 0)
         self.assertAlmostEqual(r2[8], 0.0727437, places=7)
 
+    def test_task_workers(self):
+        f = open(os.path.join(
+            'test', 'xml_input', 'test_roi_means_workers.xml'))
+        tree = xmltodict.parse(f.read(), xml_attribs=True)
+        task = tree['dynamit1']['task']
+        dynamit.task_roi_means(task)
+        dyn = dynamit.load_tac(os.path.join('test', 'out.txt'))
+        tacq = dyn['tacq']
+        self.assertEqual(list(tacq),
+                         [0, 3.0, 6.3, 9.5, 12.8, 16.0, 19.3, 22.5, 25.8])
+
+        r1 = dyn['1']
+        r2 = dyn['2']
+
+        self.assertAlmostEqual(r1[3], 12019.3, places=1)
+        self.assertAlmostEqual(r2[3], 38544.1, places=1)
+        self.assertAlmostEqual(r1[6], 13.4822, places=4)
+        self.assertAlmostEqual(r2[6], 2.57748, places=5)
+
     def test_task_resample_img(self):
         f = open(os.path.join(
             'test', 'xml_input', 'test_roi_means_resample_img.xml'))
@@ -96,7 +121,7 @@ class TestTaskROIMeans(unittest.TestCase):
         dynamit.task_roi_means(task)
         dyn = dynamit.load_tac(os.path.join('test', 'out.txt'))
         tacq = dyn['tacq']
-        self.assertEqual(tacq,
+        self.assertEqual(list(tacq),
                          [0, 3.0, 6.3, 9.5, 12.8, 16.0, 19.3, 22.5, 25.8])
 
         r1 = dyn['1']
@@ -113,7 +138,7 @@ class TestTaskROIMeans(unittest.TestCase):
         dynamit.task_roi_means(task)
         dyn = dynamit.load_tac(os.path.join('test', 'out.txt'))
         tacq = dyn['tacq']
-        self.assertEqual(tacq,
+        self.assertEqual(list(tacq),
                          [0, 3.0, 6.3, 9.5, 12.8, 16.0, 19.3, 22.5, 25.8])
 
         r1 = dyn['1']
@@ -122,6 +147,197 @@ class TestTaskROIMeans(unittest.TestCase):
         self.assertAlmostEqual(r1[3], 13473.5, places=1)
         self.assertAlmostEqual(r2[3], 17120.9, places=1)
 
+    def test_task_roi_sets(self):
+        # A ROI on a finer grid than the images with a single label
+        roi = sitk.ReadImage(os.path.join(
+            'test', 'data', '8_3V_seg', 'Segmentation.nrrd'))
+        roi = sitk.Resample(roi > 0, [200, 200, 110], sitk.Transform(),
+                            sitk.sitkNearestNeighbor, roi.GetOrigin(),
+                            [3.0, 3.0, 3.0], roi.GetDirection(), 0,
+                            sitk.sitkUInt8)
+        sitk.WriteImage(roi, os.path.join('test', 'out_roi.nrrd'))
+
+        f = open(os.path.join(
+            'test', 'xml_input', 'test_roi_means_roi_sets.xml'))
+        tree = xmltodict.parse(f.read(), xml_attribs=True)
+        task = tree['dynamit1']['task']
+        dynamit.task_roi_means(task)
+
+        # The first two ROI files are merged
+        dyn = dynamit.load_tac(os.path.join('test', 'out.txt'))
+        self.assertEqual(list(dyn), ['tacq', 'left', 'right', 'whole'])
+        self.assertEqual(list(dyn['tacq']),
+                         [0, 3.0, 6.3, 9.5, 12.8, 16.0, 19.3, 22.5, 25.8])
+        self.assertAlmostEqual(dyn['left'][3], 12019.3, places=1)
+        self.assertAlmostEqual(dyn['right'][3], 38544.1, places=1)
+        self.assertTrue(dyn['left'][3] < dyn['whole'][3] < dyn['right'][3])
+
+        # The third ROI file is saved to its own file
+        dyn = dynamit.load_tac(os.path.join('test', 'out_2.txt'))
+        self.assertEqual(list(dyn), ['tacq', '0', '1', '2'])
+        self.assertAlmostEqual(dyn['1'][3], 12019.3, places=1)
+        self.assertAlmostEqual(dyn['2'][3], 38544.1, places=1)
+
+    def test_task_incremental(self):
+        dcm_path = os.path.join('test', 'out_series')
+        files = dynamit.scan_dynamic_series(
+            os.path.join('test', 'data', '8_3V'), use_index=False)['files']
+        os.mkdir(dcm_path)
+        for name in files[:5]:
+            shutil.copy(name, dcm_path)
+
+        f = open(os.path.join(
+            'test', 'xml_input', 'test_roi_means_incremental.xml'))
+        tree = xmltodict.parse(f.read(), xml_attribs=True)
+        task = tree['dynamit1']['task']
+        dynamit.task_roi_means(task)
+        dyn = dynamit.load_tac(os.path.join('test', 'out.txt'))
+        self.assertEqual(list(dyn['tacq']), [0, 3.0, 6.3, 9.5, 12.8])
+
+        # Only the new images are added to the result file
+        for name in files[5:]:
+            shutil.copy(name, dcm_path)
+        dynamit.task_roi_means(task)
+        dyn = dynamit.load_tac(os.path.join('test', 'out.txt'))
+        self.assertEqual(list(dyn['tacq']),
+                         [0, 3.0, 6.3, 9.5, 12.8, 16.0, 19.3, 22.5, 25.8])
+        self.assertAlmostEqual(dyn['1'][3], 12019.3, places=1)
+        self.assertAlmostEqual(dyn['2'][3], 38544.1, places=1)
+
+    def test_task_out_name(self):
+        f = open(
+            os.path.join('test', 'xml_input', 'test_roi_means_simple.xml'))
+        tree = xmltodict.parse(f.read(), xml_attribs=True)
+        task = tree['dynamit1']['task']
+        del task['out_path']
+        task['out_name'] = 'kidney'
+        store: dict[str, Any] = {}
+        dynamit.task_roi_means(task, store)
+        self.assertFalse(os.path.exists(os.path.join('test', 'out.txt')))
+        dyn = store['kidney']
+        self.assertEqual(list(dyn), ['tacq', '0', '1', '2'])
+        self.assertAlmostEqual(dyn['1'][3], 12019.3, places=1)
+
+        del task['out_name']
+        with self.assertRaises(ValueError):
+            dynamit.task_roi_means(task, store)
+
+    def test_task_binary(self):
+        f = open(os.path.join(
+            'test', 'xml_input', 'test_roi_means_binary.xml'))
+        tree = xmltodict.parse(f.read(), xml_attribs=True)
+        task = tree['dynamit1']['task']
+        dynamit.task_roi_means(task)
+        dyn = dynamit.load_tac(os.path.join('test', 'out.txt'))
+        self.assertEqual(list(dyn['tacq']),
+                         [0, 3.0, 6.3, 9.5, 12.8, 16.0, 19.3, 22.5, 25.8])
+        self.assertAlmostEqual(dyn['1'][3], 12019.3, places=1)
+        self.assertAlmostEqual(dyn['2'][3], 38544.1, places=1)
+        info = dynamit.load_tac_info(os.path.join('test', 'out.txt'))
+        self.assertEqual(info['units'], {'tacq': 's'})
+        self.assertEqual(info['metadata']['roi_path'],
+                         ['test/data/8_3V_seg/Segmentation.nrrd'])
+
+    def test_task_cache(self):
+        f = open(
+            os.path.join('test', 'xml_input', 'test_roi_means_cache.xml'))
+        tree = xmltodict.parse(f.read(), xml_attribs=True)
+        task = tree['dynamit1']['task']
+        cache_dir = os.path.join('test', 'out_cache')
+        store: dict[str, Any] = {}
+        dynamit.task_roi_means(task, store)
+        expected = dynamit.load_tac(os.path.join('test', 'out.txt'))
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        # The unchanged task restores the file and the result from the cache
+        os.remove(os.path.join('test', 'out.txt'))
+        restored: dict[str, Any] = {}
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            dynamit.task_roi_means(task, restored)
+        self.assertIn("restored from the cache", log.getvalue())
+        self.assertEqual(dynamit.load_tac(os.path.join('test', 'out.txt')),
+                         expected)
+        self.assertEqual(restored['kidney'], store['kidney'])
+
+        # Without a store the results are not reported as stored
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            dynamit.task_roi_means(task)
+        self.assertIn("restored from the cache", log.getvalue())
+        self.assertNotIn("Result stored as", log.getvalue())
+
+        # A changed task is computed again
+        task['labels'] = '1,kidney;2,aorta'
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            dynamit.task_roi_means(task, restored)
+        self.assertNotIn("restored from the cache", log.getvalue())
+        self.assertEqual(list(restored['kidney']),
+                         ['tacq', '0', 'kidney', 'aorta'])
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+        # The least recently used results are removed from a full cache
+        task['labels'] = '1,kidney'
+        task['cache_size'] = '0'
+        dynamit.task_roi_means(task, restored)
+        self.assertEqual(os.listdir(cache_dir), [])
+
+    def test_task_cache_missing_files(self):
+        f = open(os.path.join(
+            'test', 'xml_input', 'test_roi_means_cache_subdir.xml'))
+        tree = xmltodict.parse(f.read(), xml_attribs=True)
+        task = tree['dynamit1']['task']
+        out_path = os.path.join('test', 'out_dir', 'out.txt')
+        os.makedirs(os.path.dirname(out_path))
+        dynamit.task_roi_means(task)
+        expected = dynamit.load_tac(out_path)
+
+        # The folder of the output file is created when it is restored
+        shutil.rmtree(os.path.dirname(out_path))
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            dynamit.task_roi_means(task)
+        self.assertIn("restored from the cache", log.getvalue())
+        self.assertEqual(dynamit.load_tac(out_path), expected)
+
+        # An entry with missing files is computed again
+        cache_dir = os.path.join('test', 'out_cache')
+        entry = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+        for name in os.listdir(entry):
+            if name != 'manifest.json':
+                os.remove(os.path.join(entry, name))
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            dynamit.task_roi_means(task)
+        self.assertNotIn("restored from the cache", log.getvalue())
+        self.assertEqual(dynamit.load_tac(out_path), expected)
+
+    def test_task_resample_cache(self):
+        f = open(os.path.join(
+            'test', 'xml_input', 'test_roi_means_resample_cache.xml'))
+        tree = xmltodict.parse(f.read(), xml_attribs=True)
+        task = tree['dynamit1']['task']
+        cache_dir = os.path.join('test', 'out_nn_cache')
+        dynamit.task_roi_means(task)
+        expected = dynamit.load_tac(os.path.join('test', 'out.txt'))
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        # The second run reads the voxel mapping from the cache
+        with unittest.mock.patch.object(
+                dynamit.NearestNeighbourResampler, '_compute_index_map',
+                side_effect=AssertionError("index map not cached")):
+            dynamit.task_roi_means(task)
+        self.assertEqual(dynamit.load_tac(os.path.join('test', 'out.txt')),
+                         expected)
+
     def tearDown(self):
-        if os.path.exists(os.path.join('test', 'out.txt')):
-            os.remove(os.path.join('test', 'out.txt'))
+        for name in ['out.txt', 'out_2.txt', 'out_roi.nrrd',
+                     'out.txt.manifest.json']:
+            if os.path.exists(os.path.join('test', name)):
+                os.remove(os.path.join('test', name))
+        shutil.rmtree(os.path.join('test', 'out_series'), ignore_errors=True)
+        shutil.rmtree(os.path.join('test', 'out_cache'), ignore_errors=True)
+        shutil.rmtree(os.path.join('test', 'out_nn_cache'),
+                      ignore_errors=True)
+        shutil.rmtree(os.path.join('test', 'out_dir'), ignore_errors=True)
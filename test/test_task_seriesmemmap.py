@@ -0,0 +1,33 @@
+import unittest
+import dynamit
+import os
+import xmltodict
+
+
+class TestTaskSeriesMemmap(unittest.TestCase):
+
+    def tearDown(self):
+        for name in ['out_series.npy', 'out_series.npy.json', 'out.txt']:
+            path = os.path.join('test', name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_task_series_memmap(self):
+        f = open(
+            os.path.join('test', 'xml_input', 'test_series_memmap.xml'))
+        tree = xmltodict.parse(f.read(), xml_attribs=True,
+                               force_list=('task'))
+        tasks = tree['dynamit1']['task']
+        dynamit.task_series_memmap(tasks[0])
+        self.assertTrue(os.path.exists(os.path.join('test',
+                                                    'out_series.npy.json')))
+
+        # The ROI means are computed from the memory-mapped series
+        dynamit.task_roi_means(tasks[1])
+        dyn = dynamit.load_tac(os.path.join('test', 'out.txt'))
+        self.assertEqual(list(dyn['tacq']),
+                         [0, 3.0, 6.3, 9.5, 12.8, 16.0, 19.3, 22.5, 25.8])
+        self.assertAlmostEqual(dyn['1'][1], 0.767681, places=6)
+        self.assertAlmostEqual(dyn['2'][1], 3501.54, places=2)
+        self.assertAlmostEqual(dyn['1'][3], 12019.3, places=1)
+        self.assertAlmostEqual(dyn['2'][3], 38544.1, places=1)
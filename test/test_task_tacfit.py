@@ -0,0 +1,110 @@
+import unittest
+import contextlib
+import dynamit
+import io
+import matplotlib
+import os
+import shutil
+import unittest.mock
+import xmltodict
+from typing import Any
+
+
+class TestTaskTACFit(unittest.TestCase):
+
+    def setUp(self):
+        matplotlib.use('Agg')
+        t = [0.0, 4.3, 7.5, 12.4, 16.2, 20.0, 30.0]
+        inp = [0.0, 10.3, 12.1, 8.1, 4.1, 3.0, 2.0]
+        tacs = {}
+        for i, (k1, v0) in enumerate([(0.05, 0.3), (0.2, 0.0), (0.11, 1.2)]):
+            tacs[f'patient_{i}'] = {
+                'tacq': t, 'inp': inp,
+                'tis': dynamit.model_patlak(t, inp, k1, v0)}
+        dynamit.append_tac_archive(os.path.join('test', 'out_archive.tar'),
+                                   tacs)
+
+    def test_task_tac_fit_archive(self):
+        f = open(
+            os.path.join('test', 'xml_input', 'test_tac_fit_archive.xml'))
+        tree = xmltodict.parse(f.read(), xml_attribs=True)
+        task = tree['dynamit1']['task']
+        dynamit.task_tac_fit(task)
+
+        res = dynamit.tac_fit(
+            dynamit.load_tac_archive(os.path.join('test', 'out_archive.tar'),
+                                     str(task['tac_key'])),
+            'tacq', 'inp', 'tis', 'patlak', {'k1': {'value': 0.1},
+                                             'v0': {'value': 0.5}})
+        self.assertAlmostEqual(res.params['k1'].value, 0.11, places=6)
+        self.assertAlmostEqual(res.params['v0'].value, 1.2, places=6)
+
+    def test_task_tac_fit_store(self):
+        f = open(
+            os.path.join('test', 'xml_input', 'test_tac_fit_archive.xml'))
+        tree = xmltodict.parse(f.read(), xml_attribs=True)
+        task = tree['dynamit1']['task']
+        del task['tac_path']
+        del task['tac_key']
+        task['tac_name'] = 'tac'
+        task['out_name'] = 'fit'
+        store: dict[str, Any] = {'tac': dynamit.load_tac_archive(
+            os.path.join('test', 'out_archive.tar'), 'patient_0')}
+        dynamit.task_tac_fit(task, store)
+        self.assertTrue(store['fit']['success'])
+        self.assertAlmostEqual(store['fit']['k1'], 0.05, places=6)
+        self.assertAlmostEqual(store['fit']['v0'], 0.3, places=6)
+
+        task['tac_name'] = 'missing'
+        with self.assertRaises(ValueError):
+            dynamit.task_tac_fit(task, store)
+
+    def test_task_tac_fit_cache(self):
+        f = open(
+            os.path.join('test', 'xml_input', 'test_tac_fit_archive.xml'))
+        tree = xmltodict.parse(f.read(), xml_attribs=True)
+        task = tree['dynamit1']['task']
+        task['cache'] = 'true'
+        task['cache_dir'] = os.path.join('test', 'out_cache')
+        task['out_name'] = 'fit'
+        store: dict[str, Any] = {}
+        dynamit.task_tac_fit(task, store)
+
+        restored: dict[str, Any] = {}
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            dynamit.task_tac_fit(task, restored)
+        self.assertIn("restored from the cache", log.getvalue())
+        self.assertEqual(restored['fit'], store['fit'])
+
+        # A changed TAC file gives a new fit
+        dynamit.append_tac_archive(
+            os.path.join('test', 'out_archive.tar'),
+            {'patient_3': dynamit.load_tac_archive(
+                os.path.join('test', 'out_archive.tar'), 'patient_0')})
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            dynamit.task_tac_fit(task, restored)
+        self.assertNotIn("restored from the cache", log.getvalue())
+
+    def test_task_tac_fit_figure(self):
+        f = open(
+            os.path.join('test', 'xml_input', 'test_tac_fit_archive.xml'))
+        tree = xmltodict.parse(f.read(), xml_attribs=True)
+        task = tree['dynamit1']['task']
+        task['fig_path'] = os.path.join('test', 'out_fig.png')
+
+        # In a worker process the figure is saved but not shown
+        with unittest.mock.patch('multiprocessing.parent_process',
+                                 return_value=object()), \
+                unittest.mock.patch('matplotlib.pyplot.show') as show:
+            dynamit.task_tac_fit(task)
+        show.assert_not_called()
+        self.assertGreater(
+            os.path.getsize(os.path.join('test', 'out_fig.png')), 0)
+
+    def tearDown(self):
+        os.remove(os.path.join('test', 'out_archive.tar'))
+        if os.path.exists(os.path.join('test', 'out_fig.png')):
+            os.remove(os.path.join('test', 'out_fig.png'))
+        shutil.rmtree(os.path.join('test', 'out_cache'), ignore_errors=True)
@@ -0,0 +1,72 @@
+import unittest
+import dynamit
+import os
+import xmltodict
+
+
+class TestTaskTACFitBatch(unittest.TestCase):
+
+    k1 = [0.05, 0.2, 0.11]
+    v0 = [0.3, 0.0, 1.2]
+
+    def setUp(self):
+        t = [0.0, 4.3, 7.5, 12.4, 16.2, 20.0, 30.0]
+        inp = [0.0, 10.3, 12.1, 8.1, 4.1, 3.0, 2.0]
+        noise = [0.0, 0.01, -0.02, 0.015, -0.01, 0.005, -0.005]
+        for i in range(3):
+            tis = dynamit.model_patlak(t, inp, self.k1[i], self.v0[i])
+            dynamit.save_tac({'tacq': t,
+                              'inp': inp,
+                              'tis': list(tis + noise)},
+                             os.path.join('test', f'tac_batch_{i}.txt'))
+
+    def test_task_tac_fit_batch(self):
+        f = open(
+            os.path.join('test', 'xml_input', 'test_tac_fit_batch.xml'))
+        tree = xmltodict.parse(f.read(), xml_attribs=True)
+        task = tree['dynamit1']['task']
+        dynamit.task_tac_fit_batch(task)
+
+        with open(os.path.join('test', 'out.txt')) as f:
+            lines = f.read().splitlines()
+
+        header = lines[0].split('\t')
+        self.assertEqual(header,
+                         ['tac_path', 'success', 'nfev', 'chisqr', 'redchi',
+                          'k1', 'k1_stderr', 'v0', 'v0_stderr'])
+        self.assertEqual(4, len(lines))
+        for i in range(3):
+            row = lines[i + 1].split('\t')
+            self.assertEqual(os.path.join('test', f'tac_batch_{i}.txt'),
+                             row[0])
+            self.assertEqual('True', row[1])
+            self.assertAlmostEqual(self.k1[i], float(row[5]), places=2)
+            self.assertAlmostEqual(self.v0[i], float(row[7]), places=1)
+
+    def test_tac_fit_batch_workers(self):
+        paths = [os.path.join('test', f'tac_batch_{i}.txt')
+                 for i in range(3)]
+        params = {'k1': {'value': 0.1, 'min': 0.0}, 'v0': {'value': 0.1}}
+        res1 = dynamit.tac_fit_batch(paths, 'tacq', 'inp', 'tis', 'patlak',
+                                     params, workers=1)
+        res2 = dynamit.tac_fit_batch(paths, 'tacq', 'inp', 'tis', 'patlak',
+                                     params, workers=2)
+        self.assertEqual(res1, res2)
+
+    def test_tac_fit_batch_missing_file(self):
+        paths = [os.path.join('test', 'tac_batch_0.txt'),
+                 os.path.join('test', 'tac_batch_missing.txt')]
+        params = {'k1': {'value': 0.1}, 'v0': {'value': 0.1}}
+        res = dynamit.tac_fit_batch(paths, 'tacq', 'inp', 'tis', 'patlak',
+                                    params)
+        self.assertTrue(res[0]['success'])
+        self.assertFalse(res[1]['success'])
+        self.assertTrue('error' in res[1])
+
+    def tearDown(self):
+        for i in range(3):
+            path = os.path.join('test', f'tac_batch_{i}.txt')
+            if os.path.exists(path):
+                os.remove(path)
+        if os.path.exists(os.path.join('test', 'out.txt')):
+            os.remove(os.path.join('test', 'out.txt'))
@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+from typing import Any, Callable, Optional
+
+_saved_cache_dirs: list[Optional[str]] = []
+
+
+def use_temp_cache_dir():
+    """Points the dynamit cache directory (DYNAMIT_CACHE_DIR) to a new
+    temporary folder, so that the tests do not write to the cache of the
+    user. Called once when the test package is imported.
+    """
+
+    _saved_cache_dirs.append(os.environ.get('DYNAMIT_CACHE_DIR'))
+    os.environ['DYNAMIT_CACHE_DIR'] = tempfile.mkdtemp(prefix='dynamit_')
+
+
+def restore_cache_dir():
+    """Removes the temporary cache directory (see use_temp_cache_dir) and
+    restores the cache directory of the user. Called when the tests exit.
+    """
+
+    shutil.rmtree(os.environ['DYNAMIT_CACHE_DIR'], ignore_errors=True)
+    saved = _saved_cache_dirs.pop()
+    if saved is None:
+        del os.environ['DYNAMIT_CACHE_DIR']
+    else:
+        os.environ['DYNAMIT_CACHE_DIR'] = saved
+
+
+def assert_jacobian(test: unittest.TestCase,
+                    model: Callable[..., Any],
+                    jac: Callable[..., Any],
+                    t: list[float],
+                    in_func: list[float],
+                    params: dict[str, float]):
+    """Checks an analytic model Jacobian against central differences of the
+    model, for each parameter and time point.
+    """
+
+    j = jac(t=t, in_func=in_func, **params)
+    test.assertEqual((len(t), len(params)), j.shape)
+    for k, name in enumerate(params):
+        h = 1e-6
+        p_plus = dict(params)
+        p_plus[name] += h
+        p_minus = dict(params)
+        p_minus[name] -= h
+        m_plus = model(t=t, in_func=in_func, **p_plus)
+        m_minus = model(t=t, in_func=in_func, **p_minus)
+        for i in range(len(t)):
+            test.assertAlmostEqual((m_plus[i] - m_minus[i]) / (2 * h),
+                                   j[i, k], places=3)